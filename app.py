@@ -1,11 +1,31 @@
 # app.py
 """Main Flask application for the SMS gateway."""
-from flask import Flask, jsonify, render_template, request
-from flask_socketio import SocketIO, emit
-from threading import Lock, Thread
-from modem_handler import ModemHandler
-from auth import AuthManager, require_auth
 from config import Config
+if Config.ASYNC_MODE == 'eventlet':
+    # Patch before anything else creates sockets, locks or threads
+    import eventlet
+    eventlet.monkey_patch()
+elif Config.ASYNC_MODE == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+from flask import Flask, Response, g, jsonify, render_template, request
+from flask_socketio import SocketIO
+from auth import AuthManager, SharedTokenCache, require_auth
+from sms_queue import normalize_number, PRIORITY_TRANSACTIONAL, PRIORITY_BULK
+from event_bus import (EventBus, SMS_RECEIVED, SMS_STATUS, SMS_BATCH_STATUS,
+                       SMS_DELIVERY, USSD_EXCHANGE)
+from message_store import MessageStore
+from code_store import create_code_store
+from sms_encoding import prepare as prepare_sms
+from ussd_cache import UssdCache
+from modem_service import ModemService
+from modem_ipc import (ModemClient, RemoteModemPool, RemoteProxy, RemoteSmsQueue,
+                       RemoteSupervisor)
+from modem_trace import ModemTracer
+from socket_fanout import SocketFanout
+from functools import wraps
+import metrics
+import math
 import logging
 import json
 import time
@@ -20,100 +40,225 @@ logger = logging.getLogger(__name__)
 # Initialize Flask and SocketIO
 app = Flask(__name__)
 app.config.from_object(Config)
-socketio = SocketIO(app, cors_allowed_origins="*")
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode=Config.ASYNC_MODE)
+event_bus = EventBus(default_maxsize=Config.EVENT_BUS_QUEUE_SIZE)
 
-# Global variables
-thread = None
-thread_lock = Lock()
-modem_handler = None
+HTTP_SECONDS = metrics.histogram(
+    'http_request_duration_seconds', 'Flask request latency',
+    ['endpoint', 'method', 'status'])
 
-def handle_sms_callback(sms):
-    """Handle incoming SMS messages."""
-    logger.info("SMS received from: %s", sms.number)
-    
-    data = {
-        "number": sms.number,
-        "time": sms.time.isoformat(),
-        "text": sms.text
-    }
-    
-    socketio.emit('sms_web', json.dumps(data), namespace='/', broadcast=True)
-    logger.info("SMS data emitted to websocket")
+# Browser pushes go out in micro-batched 'events' frames, one per feed room
+socket_fanout = SocketFanout(
+    socketio,
+    window=Config.SOCKETIO_BATCH_WINDOW,
+    max_batch=Config.SOCKETIO_BATCH_SIZE,
+    client_buffer=Config.SOCKETIO_CLIENT_BUFFER,
+    max_pending=Config.SOCKETIO_MAX_PENDING,
+    ack_timeout=Config.SOCKETIO_ACK_TIMEOUT
+)
+socket_fanout.start()
 
-def additional_sms_processing(sms):
-    """Additional SMS processing if needed."""
-    logger.info("Processing SMS in additional callback")
+@app.before_request
+def start_request_timer():
+    g.request_started = time.time()
 
-def initialize_modem():
-    try:
-        logger.info("Initializing modem...")
-        handler = ModemHandler(
-                    config=Config,
-                    socketio=socketio,  # Pass the socketio instance
-                    sms_callback=additional_sms_processing  # Optional
-                )
-        
-        # Try to connect
-        if not handler.connect():
-            logger.error("Failed to connect to modem")
-            return None
-            
-        # Wait for network
-        if not handler.wait_for_network():
-            logger.error("Failed to register with network")
-            return None
-            
-        # Check network status
-        status_ok, message = handler.check_network_status()
-        if not status_ok:
-            logger.error("Network status check failed: %s", message)
-            return None
-            
-        logger.info("Modem initialized successfully: %s", message)
-        return handler
-        
-    except Exception as e:
-        logger.error("Error initializing modem: %s", str(e), exc_info=True)
-        return None
+@app.after_request
+def observe_request(response):
+    started = getattr(g, 'request_started', None)
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        HTTP_SECONDS.labels(endpoint, request.method, response.status_code).observe(
+            time.time() - started)
+    return response
 
-try:
-    modem_handler = None
-    max_init_attempts = 3
-    
-    for attempt in range(max_init_attempts):
-        logger.info("Attempting modem initialization (attempt %d/%d)", 
-                   attempt + 1, max_init_attempts)
-        
-        modem_handler = initialize_modem()
-        if modem_handler:
-            break
-            
-        logger.warning("Initialization attempt failed, retrying in 5 seconds...")
-        time.sleep(5)
-        
-    if not modem_handler:
-        logger.error("Failed to initialize modem after %d attempts", max_init_attempts)
-except Exception as e:
-    logger.error("Critical error during modem initialization: %s", str(e), exc_info=True)
+message_store = MessageStore(
+    Config.MESSAGE_STORE_DB,
+    batch_size=Config.MESSAGE_STORE_BATCH_SIZE,
+    flush_interval=Config.MESSAGE_STORE_FLUSH_INTERVAL
+)
+
+def handle_sms_callback(data):
+    """Push inbound SMS to the frontend."""
+    logger.info("SMS received from: %s", data['number'])
+    socket_fanout.publish('sms_grab', data)
+
+def emit_ussd_response(data):
+    """Push USSD answers from the modem to the frontend."""
+    socket_fanout.publish('ussd_response', {
+        'response': data.get('text'),
+        'modem': data.get('modem')
+    })
+
+def emit_sms_status(job):
+    """Push outbound job status changes to the frontend."""
+    socket_fanout.publish('sms_status', job)
+
+def emit_batch_status(batch):
+    """Push outbound batch progress to the frontend."""
+    socket_fanout.publish('sms_batch_status', batch)
+
+def emit_sms_delivery(delivery):
+    """Push delivery report outcomes to the frontend."""
+    socket_fanout.publish('sms_delivery', delivery)
+
+# Route name -> callables run for inbound SMS the router tagged with it
+SMS_ROUTE_HANDLERS = {}
+
+def on_sms_route(route):
+    """Register the decorated function for inbound SMS tagged with route."""
+    def decorator(f):
+        SMS_ROUTE_HANDLERS.setdefault(route, []).append(f)
+        return f
+    return decorator
+
+def dispatch_sms_routes(data):
+    """Run the handlers of every route an inbound SMS matched."""
+    for route in data.get('routes') or ():
+        for handler in SMS_ROUTE_HANDLERS.get(route, ()):
+            try:
+                handler(data)
+            except Exception as e:
+                logger.error("SMS route handler for %s failed: %s", route, str(e),
+                             exc_info=True)
+
+# Modem events every web worker pushes to its own Socket.IO clients
+BROWSER_EVENTS = {
+    SMS_RECEIVED: handle_sms_callback,
+    USSD_EXCHANGE: emit_ussd_response,
+    SMS_STATUS: emit_sms_status,
+    SMS_BATCH_STATUS: emit_batch_status,
+    SMS_DELIVERY: emit_sms_delivery
+}
 
-# # Initialize ModemHandler with SMS callback
-# modem_handler = ModemHandler(
-#     config=Config,
-#     socketio=socketio,  # Pass the socketio instance
-#     sms_callback=additional_sms_processing  # Optional
+# Subscribers here run once per event, in whichever process handles it
+event_bus.subscribe(SMS_RECEIVED, dispatch_sms_routes)
 
+if Config.MODEM_DAEMON_SOCKET:
+    # Split mode: modem_daemon.py owns the serial ports, this is one of many workers
+    if Config.CODE_STORE_BACKEND != 'sqlite':
+        # A code sent through one worker must verify on any other
+        raise RuntimeError("Split mode needs CODE_STORE_BACKEND='sqlite' so verification "
+                           "codes are shared between web workers")
+    modem_client = ModemClient(Config.MODEM_DAEMON_SOCKET, timeout=Config.MODEM_DAEMON_TIMEOUT)
+    modem_service = None
+    modem_handler = RemoteModemPool(modem_client)
+    modem_supervisor = RemoteSupervisor(modem_client)
+    modem_tracer = RemoteProxy(modem_client, 'trace')
+    modem_events = RemoteProxy(modem_client, 'bus')
+    sms_queue = RemoteSmsQueue(modem_client)
+    sms_scheduler = RemoteProxy(modem_client, 'scheduler')
+    delivery_reports = RemoteProxy(modem_client, 'delivery')
+    webhooks = RemoteProxy(modem_client, 'webhooks')
+    route_stats = lambda limit=None: modem_client.call('routes.stats', limit)
+    reload_routes = lambda: modem_client.call('routes.reload')
+    send_code_limiter = RemoteProxy(modem_client, 'send_code_limiter')
+    send_sms_limiter = RemoteProxy(modem_client, 'send_sms_limiter')
 
+    def dispatch_daemon_event(topic, data, work):
+        handler = BROWSER_EVENTS.get(topic)
+        if handler:
+            handler(data)
+        if work:
+            event_bus.publish(topic, data)
 
-auth_manager = AuthManager(modem_handler, Config.SECRET_KEY)
+    modem_client.stream(dispatch_daemon_event)
+else:
+    if Config.ASYNC_MODE in ('eventlet', 'gevent'):
+        # gsmmodem's reader thread and blocking serial calls would stall the
+        # event loop; the modem daemon keeps them in a separate process
+        raise RuntimeError("ASYNC_MODE={0} needs split mode: set MODEM_DAEMON_SOCKET "
+                           "and run modem_daemon.py".format(Config.ASYNC_MODE))
+    modem_client = None
+    modem_tracer = ModemTracer(
+        capacity=Config.MODEM_TRACE_BUFFER,
+        enabled=Config.MODEM_TRACE_ENABLED
+    )
+    modem_service = ModemService(
+        Config,
+        event_bus,
+        message_store=message_store,
+        tracer=modem_tracer,
+        socketio=socketio  # Pass the socketio instance
+    )
+    modem_handler = modem_service.pool
+    modem_supervisor = modem_service.supervisor
+    modem_events = event_bus
+    sms_queue = modem_service.queue
+    sms_scheduler = modem_service.scheduler
+    delivery_reports = modem_service.delivery_tracker
+    webhooks = modem_service.webhooks
+    route_stats = modem_service.route_stats
+    reload_routes = modem_service.reload_routes
+    send_code_limiter = modem_service.send_code_limiter
+    send_sms_limiter = modem_service.send_sms_limiter
+    for topic, handler in BROWSER_EVENTS.items():
+        event_bus.subscribe(topic, handler)
+    modem_service.start()
+
+def require_modem(f):
+    """Answer 503 with Retry-After until the modem is ready."""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if not modem_supervisor.ready:
+            retry_after = modem_supervisor.retry_after(Config.MODEM_RETRY_AFTER)
+            response = jsonify({
+                'status': 'error',
+                'message': 'Modem not ready ({0})'.format(modem_supervisor.state),
+                'retry_after': retry_after
+            })
+            response.headers['Retry-After'] = str(retry_after)
+            return response, 503
+        return f(*args, **kwargs)
+    return decorated
+
+code_store = create_code_store(Config)
+code_store.start_sweeper(Config.CODE_STORE_SWEEP_INTERVAL)
+token_cache = None
+if Config.CODE_STORE_BACKEND == 'sqlite':
+    # Workers sharing codes also share revocations, kept in the same file
+    token_cache = SharedTokenCache(Config.CODE_STORE_DB, capacity=Config.TOKEN_CACHE_SIZE,
+                                   refresh_interval=Config.TOKEN_REVOCATION_REFRESH)
+auth_manager = AuthManager(
+    modem_handler,
+    Config.SECRET_KEY,
+    code_store=code_store,
+    token_cache_size=Config.TOKEN_CACHE_SIZE,
+    sms_queue=sms_queue,
+    token_cache=token_cache
+)
 
 @app.route('/')
 def index():
     """Serve the frontend interface."""
     return render_template('index.html')
 
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness probe: the process is serving requests."""
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """Readiness probe: a modem is registered and in rotation."""
+    stats = modem_supervisor.stats()
+    if not stats['ready']:
+        response = jsonify(dict(stats, status='unavailable'))
+        response.headers['Retry-After'] = str(
+            modem_supervisor.retry_after(Config.MODEM_RETRY_AFTER))
+        return response, 503
+    return jsonify(dict(stats, status='ok'))
+
+# The auth class is reserved for verification codes
+API_PRIORITIES = (PRIORITY_TRANSACTIONAL, PRIORITY_BULK)
+
+def api_client():
+    """Client id outbound jobs are fair-queued by."""
+    return request.headers.get('X-Client-Id') or request.remote_addr
+
 @app.route('/send_sms', methods=['POST'])
+@require_modem
 def send_sms():
-    """API endpoint to send SMS messages."""
+    """API endpoint to queue SMS messages for sending."""
     try:
         data = request.json
         number = data.get('number')
@@ -124,21 +269,177 @@ def send_sms():
                 'status': 'error',
                 'message': 'Phone number and message are required.'
             }), 400
+        if not isinstance(number, str) or not isinstance(message, str):
+            return jsonify({
+                'status': 'error',
+                'message': 'Phone number and message must be strings.'
+            }), 400
 
-        modem_handler.send_sms(number, message)
+        priority = data.get('priority', PRIORITY_TRANSACTIONAL)
+        if priority not in API_PRIORITIES:
+            return jsonify({
+                'status': 'error',
+                'message': 'priority must be one of: {0}'.format(', '.join(API_PRIORITIES))
+            }), 400
+
+        transliterate = data.get('transliterate')
+        if transliterate is None:
+            transliterate = Config.SMS_TRANSLITERATE
+        prepared = prepare_sms(message, transliterate, Config.SMS_TRANSLITERATE_ACCENTS)
+        encoding = prepared[1]
+        # X-Client-Id is caller-supplied, so it only picks the fair-queuing
+        # lane; the limit follows the connecting address
+        allowed, retry_after, scope = send_sms_limiter.check(
+            [('client', request.remote_addr)], cost=encoding['segments'])
+        if not allowed:
+            logger.warning("Rate limited send_sms for %s (%d parts)",
+                           request.remote_addr, encoding['segments'])
+            return too_many_requests(retry_after, scope)
+
+        job = sms_queue.enqueue(number, message, priority=priority, client=api_client(),
+                                prepared=prepared)
         return jsonify({
             'status': 'success',
-            'message': 'SMS sent successfully'
-        })
+            'message': 'SMS queued',
+            'job_id': job['job_id'],
+            'segments': job['segments'],
+            'encoding': job['encoding'],
+            'job': job
+        }), 202
+
+    except Exception as e:
+        logger.error("Failed to queue SMS: %s", str(e))
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+JSON_LINES_TYPES = ('application/x-ndjson', 'application/jsonl', 'application/json-lines')
+
+def _batch_entry(entry):
+    if not isinstance(entry, dict):
+        raise ValueError("batch entries must be objects, got {0}".format(
+            type(entry).__name__))
+    return entry
+
+def _batch_pair(number, message):
+    for field, value in (('number', number), ('message', message)):
+        if value is not None and not isinstance(value, str):
+            raise ValueError("{0} must be a string, got {1}".format(
+                field, type(value).__name__))
+    return number, message
+
+def read_batch_items():
+    """
+    Yield (number, message) pairs from a JSON or JSON lines batch request.
+
+    Raises ValueError on a malformed payload.
+    """
+    template = request.args.get('message')
+    if request.mimetype in JSON_LINES_TYPES:
+        for line in request.stream:
+            line = line.strip()
+            if not line:
+                continue
+            entry = _batch_entry(json.loads(line))
+            yield _batch_pair(entry.get('number'), entry.get('message') or template)
+        return
 
+    data = request.get_json(silent=True, force=True)
+    if data is None:
+        raise ValueError("body is not valid JSON")
+    data = _batch_entry(data)
+    if 'recipients' in data:
+        message = data.get('message') or template
+        recipients = data['recipients']
+        if not isinstance(recipients, list):
+            raise ValueError("recipients must be a list")
+        for number in recipients:
+            yield _batch_pair(number, message)
+    else:
+        messages = data.get('messages', [])
+        if not isinstance(messages, list):
+            raise ValueError("messages must be a list")
+        for entry in messages:
+            entry = _batch_entry(entry)
+            yield _batch_pair(entry.get('number'), entry.get('message') or template)
+
+@app.route('/send_sms/batch', methods=['POST'])
+@require_modem
+def send_sms_batch():
+    """API endpoint to queue one message for many recipients."""
+    priority = request.args.get('priority', PRIORITY_BULK)
+    if priority not in API_PRIORITIES:
+        return jsonify({
+            'status': 'error',
+            'message': 'priority must be one of: {0}'.format(', '.join(API_PRIORITIES))
+        }), 400
+    transliterate = request.args.get('transliterate')
+    if transliterate is not None:
+        transliterate = transliterate.lower() in ('1', 'true', 'yes')
+    try:
+        batch = sms_queue.enqueue_batch(read_batch_items(), priority=priority,
+                                        client=api_client(), transliterate=transliterate)
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': 'Invalid batch payload: {0}'.format(str(e))
+        }), 400
     except Exception as e:
-        logger.error("Failed to send SMS: %s", str(e))
+        logger.error("Failed to queue SMS batch: %s", str(e), exc_info=True)
         return jsonify({
             'status': 'error',
             'message': str(e)
         }), 500
 
+    if not batch:
+        return jsonify({
+            'status': 'error',
+            'message': 'No valid recipients in batch.'
+        }), 400
+    return jsonify({
+        'status': 'success',
+        'message': 'SMS batch queued',
+        'batch_id': batch['batch_id'],
+        'batch': batch
+    }), 202
+
+@app.route('/send_sms/batch/<batch_id>', methods=['GET'])
+def send_sms_batch_status(batch_id):
+    """API endpoint to check the progress of a queued batch."""
+    batch = sms_queue.get_batch(batch_id)
+    if not batch:
+        return jsonify({
+            'status': 'error',
+            'message': 'Batch not found'
+        }), 404
+    return jsonify({
+        'status': 'success',
+        'batch': batch
+    })
+
+@app.route('/send_sms/<job_id>', methods=['GET'])
+def send_sms_status(job_id):
+    """API endpoint to check the status of a queued SMS."""
+    job = sms_queue.get_job(job_id)
+    if not job:
+        return jsonify({
+            'status': 'error',
+            'message': 'Job not found'
+        }), 404
+    return jsonify({
+        'status': 'success',
+        'job': job
+    })
+
+ussd_cache = UssdCache(
+    lambda ussd_code, port: modem_handler.send_ussd(ussd_code, port=port),
+    ttl=Config.USSD_CACHE_TTL,
+    ttls=Config.USSD_CACHE_TTLS
+)
+
 @app.route('/send_ussd', methods=['POST'])
+@require_modem
 def send_ussd():
     """API endpoint to send USSD commands."""
     try:
@@ -152,20 +453,20 @@ def send_ussd():
                 'message': 'USSD code is required.'
             }), 400
 
+        max_age = request.args.get('max_age', data.get('max_age'))
+        if max_age is not None:
+            try:
+                max_age = float(max_age)
+            except (TypeError, ValueError):
+                return jsonify({
+                    'status': 'error',
+                    'message': 'max_age must be a number of seconds.'
+                }), 400
+
         logger.info("Received USSD request with code: %s", ussd_code)
-        response = modem_handler.send_ussd(ussd_code)
+        response = ussd_cache.send(ussd_code, port=data.get('modem'), max_age=max_age)
         
         logger.info("USSD response: %s", response)
-        try:
-            # Emit with namespace and error handling
-            socketio.emit('ussd_response', 
-                         {'response': response.get('response')},
-                         namespace='/',
-                         broadcast=True)
-            logger.info("USSD response emitted successfully")
-        except Exception as e:
-            logger.error("Failed to emit USSD response: {}".format(str(e)))
-        
         return jsonify(response)
 
     except Exception as e:
@@ -175,17 +476,96 @@ def send_ussd():
             'message': str(e)
         }), 500
 
+@app.route('/modems', methods=['GET'])
+def modems():
+    """Report health and load of every modem in the pool."""
+    return jsonify({
+        'status': 'success',
+        'modems': modem_handler.status()
+    })
+
+@app.route('/modem/status', methods=['GET'])
+def modem_status():
+    """Serve the cached network status of every modem."""
+    return jsonify({
+        'status': 'success',
+        'modems': modem_handler.network_status()
+    })
+
+def optional_arg(name, convert):
+    """
+    Read an optional query parameter.
+
+    Args:
+        name: Query parameter name
+        convert: Type to convert the value to
+
+    Raises ValueError naming the parameter if the value does not convert,
+    where request.args.get(type=...) would silently drop it.
+    """
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return convert(value)
+    except ValueError:
+        raise ValueError("{0} must be {1}, got {2!r}".format(
+            name, 'an integer' if convert is int else 'a number', value))
+
+@app.route('/messages', methods=['GET'])
+@require_auth(auth_manager)
+def messages():
+    """Page through stored message history, newest first."""
+    try:
+        limit = min(int(request.args.get('limit', 50)), Config.MESSAGE_PAGE_MAX)
+        cursor = optional_arg('cursor', int)
+        since = optional_arg('since', float)
+        until = optional_arg('until', float)
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': 'Invalid query parameter: {0}'.format(str(e))
+        }), 400
+
+    rows, next_cursor = message_store.query(
+        direction=request.args.get('direction'),
+        number=request.args.get('number'),
+        since=since,
+        until=until,
+        cursor=cursor,
+        limit=max(1, limit)
+    )
+    return jsonify({
+        'status': 'success',
+        'messages': rows,
+        'next_cursor': next_cursor
+    })
+
 @app.route('/forward_sms', methods=['POST'])
+@require_auth(auth_manager)
 def forward_sms():
-    """Receive SMS data from modem_handler and emit to frontend."""
+    """Receive SMS data from an external source and publish it."""
     try:
         data = request.json
-        socketio.emit('sms_grab', data, namespace='/')
+        modem_events.publish(SMS_RECEIVED, data)
         return jsonify({'status': 'SMS forwarded successfully'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def too_many_requests(retry_after, scope):
+    """Build a 429 response with a Retry-After header."""
+    retry_after = int(math.ceil(retry_after))
+    response = jsonify({
+        'status': 'error',
+        'message': 'Too many requests ({0} limit), retry in {1} seconds'.format(
+            scope, retry_after),
+        'retry_after': retry_after
+    })
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 429
+
 @app.route('/auth/send-code', methods=['POST'])
+@require_modem
 def send_verification():
     """Send verification code to phone number."""
     logger.info("=== New verification code request ===")
@@ -221,6 +601,17 @@ def send_verification():
                 'message': 'Phone number is required'
             }), 400
         
+        # Throttle before any modem work
+        allowed, retry_after, scope = send_code_limiter.check([
+            ('phone', normalize_number(phone_number) or phone_number),
+            ('ip', request.remote_addr),
+            ('global', 'modem')
+        ])
+        if not allowed:
+            logger.warning("Rate limited send-code for %s from %s (%s)",
+                           phone_number, request.remote_addr, scope)
+            return too_many_requests(retry_after, scope)
+
         # Check auth_manager
         if not auth_manager:
             logger.error("auth_manager is None")
@@ -283,6 +674,37 @@ def verify_code():
             'message': str(e)
         }), 500
 
+@app.route('/auth/stats', methods=['GET'])
+def auth_stats():
+    """Report verification code store counters."""
+    return jsonify({
+        'status': 'success',
+        'code_store': code_store.stats(),
+        'token_cache': auth_manager.token_cache.stats(),
+        'send_code_limiter': send_code_limiter.stats()
+    })
+
+@app.route('/ussd/stats', methods=['GET'])
+def ussd_stats():
+    """Report USSD cache and coalescing counters."""
+    return jsonify({
+        'status': 'success',
+        'ussd_cache': ussd_cache.stats()
+    })
+
+@app.route('/auth/revoke', methods=['POST'])
+@require_auth(auth_manager)
+def revoke_token():
+    """Revoke the caller's token, or another token passed in the body."""
+    data = request.get_json(silent=True) or {}
+    token = data.get('token') or request.headers['Authorization'].partition(' ')[2]
+    auth_manager.revoke_token(token)
+    logger.info("Token revoked by %s", request.user_phone)
+    return jsonify({
+        'status': 'success',
+        'message': 'Token revoked'
+    })
+
 @app.route('/protected-resource')
 @require_auth(auth_manager)
 def protected_resource():
@@ -292,35 +714,160 @@ def protected_resource():
         'message': "Hello {0}! This is a protected resource.".format(request.user_phone)
     })
 
-def background_worker():
-    """Background worker to maintain modem connection and process stored SMS."""
-    while True:
-        try:
-            if not modem_handler.modem:
-                modem_handler.connect()
-            modem_handler.process_stored_sms()
-        except Exception as e:
-            logger.error("Background worker error: %s", str(e))
-            try:
-                modem_handler.disconnect()
-            except:
-                pass
-        time.sleep(Config.SMS_PROCESS_INTERVAL)
+@app.route('/sms/queue', methods=['GET'])
+def sms_queue_stats():
+    """Report outbound queue depth and wait times per priority class."""
+    return jsonify({
+        'status': 'success',
+        'classes': sms_queue.stats(),
+        'send_sms_limiter': send_sms_limiter.stats()
+    })
+
+@app.route('/sms/scheduler', methods=['GET'])
+def sms_scheduler_stats():
+    """Report stored SMS scheduler state."""
+    return jsonify({
+        'status': 'success',
+        'scheduler': sms_scheduler.stats()
+    })
+
+@app.route('/sms/delivery', methods=['GET'])
+def sms_delivery_stats():
+    """Report status report matching; per-job state is on /send_sms/<job_id>."""
+    return jsonify({
+        'status': 'success',
+        'delivery': delivery_reports.stats() if delivery_reports is not None else None
+    })
+
+@app.route('/webhooks/stats', methods=['GET'])
+def webhooks_stats():
+    """Report inbound SMS webhook delivery per endpoint."""
+    return jsonify({
+        'status': 'success',
+        'webhooks': webhooks.stats() if webhooks is not None else {}
+    })
+
+@app.route('/sms/routes', methods=['GET'])
+def sms_routes():
+    """Report inbound SMS routing and per-rule hits, most used first."""
+    return jsonify({
+        'status': 'success',
+        'routes': route_stats(request.args.get('limit', type=int))
+    })
+
+@app.route('/sms/routes/reload', methods=['POST'])
+@require_auth(auth_manager)
+def sms_routes_reload():
+    """Reload the routing rules file now instead of waiting for the watcher."""
+    try:
+        stats = reload_routes()
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 409
+    return jsonify({'status': 'success', 'routes': stats})
+
+@app.route('/sms/reassembly', methods=['GET'])
+def sms_reassembly_stats():
+    """Report concatenated SMS reassembly state."""
+    return jsonify({
+        'status': 'success',
+        'reassembly': modem_handler.reassembly_stats()
+    })
+
+metrics.gauge('event_bus_pending', 'Events waiting per bus subscriber',
+              ['topic', 'subscriber'],
+              func=lambda: dict(((s['topic'], s['name']), s['pending'])
+                                for s in event_bus.stats()))
+metrics.gauge('event_bus_dropped', 'Events dropped per bus subscriber',
+              ['topic', 'subscriber'],
+              func=lambda: dict(((s['topic'], s['name']), s['dropped'])
+                                for s in event_bus.stats()))
+metrics.gauge('message_store_pending', 'Messages waiting to be written',
+              func=lambda: message_store.stats()['pending'])
+metrics.gauge('ussd_in_flight', 'USSD sessions currently running',
+              func=lambda: ussd_cache.stats()['in_flight'])
+
+@app.route('/debug/modem-trace', methods=['GET'])
+@require_auth(auth_manager)
+def modem_trace():
+    """Dump recorded AT traffic as JSON lines or Chrome trace format."""
+    limit = request.args.get('limit', type=int)
+    if request.args.get('format') == 'chrome':
+        return Response(modem_tracer.dump_chrome(limit), mimetype='application/json')
+    return Response(modem_tracer.dump_jsonl(limit), mimetype='application/x-ndjson')
+
+@app.route('/debug/modem-trace', methods=['POST'])
+@require_auth(auth_manager)
+def modem_trace_control():
+    """Enable, disable or clear AT tracing at runtime."""
+    data = request.get_json(silent=True) or {}
+    if 'enabled' in data:
+        enabled = modem_tracer.set_enabled(bool(data['enabled']))
+        logger.info("Modem tracing %s", "enabled" if enabled else "disabled")
+    if data.get('clear'):
+        modem_tracer.clear()
+    return jsonify(dict(modem_tracer.stats(), status='success'))
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Expose metrics in Prometheus text format."""
+    return Response(metrics.REGISTRY.render(),
+                    mimetype='text/plain; version=0.0.4')
+
+@app.route('/metrics/modem', methods=['GET'])
+def modem_metrics_endpoint():
+    """Expose the modem daemon's metrics; the same as /metrics in single-process mode."""
+    if modem_client is None:
+        return metrics_endpoint()
+    return Response(modem_client.call('metrics.render'),
+                    mimetype='text/plain; version=0.0.4')
+
+@app.route('/socketio/stats', methods=['GET'])
+def socketio_stats():
+    """Fan-out counters, lagging clients and active feeds."""
+    stats = socket_fanout.stats()
+    stats['async_mode'] = socketio.async_mode
+    if modem_client is not None:
+        stats['modem_client'] = modem_client.stats()
+    return jsonify(stats)
+
+def _feed_filter(data):
+    data = data if isinstance(data, dict) else {}
+    events = data.get('events')
+    if isinstance(events, str):
+        events = [events]
+    return events, data.get('modem'), data.get('prefix'), data.get('route')
 
 @socketio.on('connect')
 def handle_connect():
-    """Handle WebSocket connection."""
-    global thread
-    with thread_lock:
-        if thread is None:
-            thread = Thread(target=background_worker)
-            thread.daemon = True
-            thread.start()
+    """Handle WebSocket connection; the query string may carry a filter."""
+    events = request.args.get('events')
+    socket_fanout.connect(
+        request.sid,
+        events=events.split(',') if events else None,
+        modem=request.args.get('modem'),
+        prefix=request.args.get('prefix'),
+        route=request.args.get('route')
+    )
     logger.info("Client connected")
 
+@socketio.on('subscribe')
+def handle_subscribe(data):
+    """Switch the client to the feed matching {events, modem, prefix, route}."""
+    feed = socket_fanout.subscribe(request.sid, *_feed_filter(data))
+    return feed.describe() if feed else None
+
+@socketio.on('events_ack')
+def handle_events_ack(data):
+    """Client processed every frame up to data['seq']."""
+    if isinstance(data, dict) and isinstance(data.get('seq'), int):
+        socket_fanout.ack(request.sid, data['seq'])
+
 @socketio.on('disconnect')
 def handle_disconnect():
     """Handle WebSocket disconnection."""
+    socket_fanout.disconnect(request.sid)
     logger.info("Client disconnected")
 
 if __name__ == '__main__':
@@ -332,5 +879,11 @@ if __name__ == '__main__':
             debug=Config.DEBUG
         )
     finally:
-        if modem_handler:
-            modem_handler.disconnect()
\ No newline at end of file
+        if modem_service:
+            modem_service.stop()
+        if modem_client:
+            modem_client.close()
+        event_bus.close()
+        socket_fanout.stop()
+        message_store.close()
+        code_store.stop_sweeper()
\ No newline at end of file
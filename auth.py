@@ -4,13 +4,200 @@ from flask import jsonify, request
 import jwt
 import random
 import time
+from collections import OrderedDict
 from functools import wraps
+from threading import Lock
+from code_store import CodeStore
+from sms_queue import PRIORITY_AUTH
+import hashlib
 import logging
+import sqlite3
+import metrics
 
 logger = logging.getLogger(__name__)
 
+CODES_SENT = metrics.counter(
+    'auth_codes_sent_total', 'Verification code SMS sent', ['reused'])
+CODE_VERIFICATIONS = metrics.counter(
+    'auth_code_verifications_total', 'Verification attempts by result', ['result'])
+TOKEN_CHECKS = metrics.counter(
+    'auth_token_checks_total', 'require_auth token checks by result', ['result'])
+
+class TokenCache:
+    def __init__(self, capacity=10000):
+        """
+        Initialize the verified-token cache.
+
+        Args:
+            capacity: Maximum number of verified tokens kept (LRU eviction)
+        """
+        self.capacity = capacity
+        self._lock = Lock()
+        self._tokens = OrderedDict()  # digest -> (payload, exp)
+        self._revoked = {}  # digest -> exp
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._tokens)
+
+    @staticmethod
+    def digest(token):
+        if not isinstance(token, bytes):
+            token = token.encode('utf-8')
+        return hashlib.sha256(token).hexdigest()
+
+    def get(self, token):
+        """Return the cached payload of a verified, unexpired token, or None."""
+        key = self.digest(token)
+        with self._lock:
+            entry = self._tokens.get(key)
+            if entry is None or time.time() >= entry[1]:
+                if entry is not None:
+                    del self._tokens[key]
+                self.misses += 1
+                return None
+            self._tokens.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, token, payload):
+        """Cache the payload of a token that passed verification."""
+        exp = payload.get('exp')
+        if exp is None:
+            return
+        key = self.digest(token)
+        with self._lock:
+            self._tokens[key] = (payload, exp)
+            self._tokens.move_to_end(key)
+            while len(self._tokens) > self.capacity:
+                self._tokens.popitem(last=False)
+                self.evictions += 1
+
+    def revoke(self, token, exp=None):
+        """Reject token from now on, until its own expiry."""
+        key = self.digest(token)
+        with self._lock:
+            entry = self._tokens.pop(key, None)
+            if exp is None:
+                exp = entry[1] if entry else time.time() + 24 * 60 * 60
+            self._revoked[key] = exp
+            self._prune_revoked()
+
+    def is_revoked(self, token):
+        with self._lock:
+            return self.digest(token) in self._revoked
+
+    def _prune_revoked(self):
+        now = time.time()
+        for key in [k for k, exp in self._revoked.items() if exp <= now]:
+            del self._revoked[key]
+
+    def stats(self):
+        with self._lock:
+            self._prune_revoked()
+            return {
+                'size': len(self._tokens),
+                'capacity': self.capacity,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'revoked': len(self._revoked)
+            }
+
+class SharedTokenCache(TokenCache):
+    def __init__(self, db_path, capacity=10000, refresh_interval=1.0):
+        """
+        Initialize a token cache whose revocations are shared through SQLite.
+
+        Verified tokens are still cached per process, and so is the set of
+        revoked digests. The set is reloaded from the shared table when
+        SQLite reports another connection wrote to the file, checked at
+        most every refresh_interval seconds, so a revocation made on one
+        worker applies on all of them within that time.
+
+        Args:
+            db_path: Path of the SQLite file shared by all workers
+            capacity: Maximum number of verified tokens kept (LRU eviction)
+            refresh_interval: Seconds between checks for other workers'
+                revocations
+        """
+        TokenCache.__init__(self, capacity)
+        self.db_path = db_path
+        self.refresh_interval = refresh_interval
+        self._version = None  # PRAGMA data_version the set was loaded at
+        self._refresh_at = 0
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=5)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS revoked_tokens ("
+                " digest TEXT PRIMARY KEY,"
+                " expiry REAL NOT NULL)"
+            )
+
+    def get(self, token):
+        payload = TokenCache.get(self, token)
+        if payload is None:
+            return None
+        key = self.digest(token)
+        with self._lock:
+            self._refresh()
+            if key in self._revoked:
+                self._tokens.pop(key, None)
+                return None
+        return payload
+
+    def revoke(self, token, exp=None):
+        key = self.digest(token)
+        with self._lock:
+            entry = self._tokens.pop(key, None)
+            if exp is None:
+                exp = entry[1] if entry else time.time() + 24 * 60 * 60
+            with self._db:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO revoked_tokens (digest, expiry) VALUES (?, ?)",
+                    (key, exp)
+                )
+            self._revoked[key] = exp
+            self._prune_revoked()
+
+    def is_revoked(self, token):
+        with self._lock:
+            self._refresh()
+            return self.digest(token) in self._revoked
+
+    def _refresh(self):
+        # data_version only changes when another connection commits, so an
+        # unchanged file costs one pragma and no table read
+        now = time.monotonic()
+        if now < self._refresh_at:
+            return
+        self._refresh_at = now + self.refresh_interval
+        version = self._db.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._version:
+            return
+        self._version = version
+        self._revoked = dict(self._db.execute(
+            "SELECT digest, expiry FROM revoked_tokens WHERE expiry > ?", (time.time(),)))
+
+    def _prune_revoked(self):
+        TokenCache._prune_revoked(self)
+        with self._db:
+            self._db.execute("DELETE FROM revoked_tokens WHERE expiry <= ?", (time.time(),))
+
+    def stats(self):
+        stats = TokenCache.stats(self)
+        with self._lock:
+            stats['revoked'] = self._db.execute(
+                "SELECT COUNT(*) FROM revoked_tokens").fetchone()[0]
+        return stats
+
 class AuthManager:
-    def __init__(self, modem_handler, secret_key, code_ttl=300):
+    def __init__(self, modem_handler, secret_key, code_ttl=300, code_store=None,
+                 token_cache_size=10000, sms_queue=None, token_cache=None):
         """
         Initialize Auth Manager.
         
@@ -18,11 +205,24 @@ class AuthManager:
             modem_handler: ModemHandler instance for sending SMS
             secret_key: Secret key for JWT tokens
             code_ttl: Time-to-live for verification codes in seconds (default 5 minutes)
+            code_store: CodeStore holding pending codes (default in-memory)
+            token_cache_size: Number of verified JWTs cached by require_auth
+            sms_queue: Optional SmsQueue; codes then go out in the auth
+                priority class and are dropped once they would arrive expired
+            token_cache: TokenCache to use instead of a per-process one,
+                e.g. a SharedTokenCache when several workers serve requests
         """
         self.modem_handler = modem_handler
         self.secret_key = secret_key
         self.code_ttl = code_ttl
-        self._verification_codes = {}  # Store codes in memory
+        self.code_store = code_store if code_store is not None else CodeStore()
+        self.token_cache = (token_cache if token_cache is not None
+                            else TokenCache(token_cache_size))
+        self.sms_queue = sms_queue
+        metrics.gauge('auth_code_store_size', 'Verification codes held',
+                      func=lambda: len(self.code_store))
+        metrics.gauge('auth_token_cache_size', 'Verified tokens cached',
+                      func=lambda: len(self.token_cache))
 
         # Log initial state
         logger.info("AuthManager initialized with:")
@@ -47,41 +247,61 @@ class AuthManager:
                     'message': 'SMS service unavailable - no modem handler'
                 }
             
-            # Generate code
-            logger.debug("Generating verification code...")
-            code = self.generate_verification_code()
-            expiry = time.time() + self.code_ttl
-            logger.debug("Code will expire at: %s", 
-                        time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(expiry)))
-            
-            # Store code
-            logger.debug("Storing code in memory...")
-            self._verification_codes[phone_number] = {
-                'code': code,
-                'expiry': expiry
-            }
-            logger.debug("Current stored codes: %s", 
-                        list(self._verification_codes.keys()))
+            # Reuse a still-valid code so retries do not invalidate the first SMS
+            stored = self.code_store.get(phone_number)
+            resent = bool(stored and stored['expiry'] > time.time())
+            if resent:
+                logger.info("Resending still-valid code for %s", phone_number)
+                code = stored['code']
+                expiry = stored['expiry']
+            else:
+                # Generate code
+                logger.debug("Generating verification code...")
+                code = self.generate_verification_code()
+                expiry = time.time() + self.code_ttl
+                logger.debug("Code will expire at: %s", 
+                            time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(expiry)))
+                
+                # Store code
+                logger.debug("Storing code...")
+                self.code_store.set(phone_number, code, expiry)
+                logger.debug("Current stored codes: %d", len(self.code_store))
             
             # Prepare message
             message = "Your code: {0}".format(code)
             logger.debug("Prepared SMS message: %s", message)
             
+            if self.sms_queue is not None:
+                # Ahead of all other traffic, and never delivered after expiry
+                job = self.sms_queue.enqueue(phone_number, message, priority=PRIORITY_AUTH,
+                                             client='auth', deadline=expiry)
+                logger.info("Verification code queued as job %s", job['job_id'])
+                CODES_SENT.labels(str(resent).lower()).inc()
+                return {
+                    'status': 'success',
+                    'message': 'Verification code queued',
+                    'expires_in': int(expiry - time.time()),
+                    'resent': resent,
+                    'job_id': job['job_id']
+                }
+
             # Send SMS
             logger.info("Attempting to send SMS via modem_handler...")
             
             try:
-                self.modem_handler.send_sms(phone_number, message)
+                self.modem_handler.send_sms(phone_number, message, sensitive=True)
                 logger.info("SMS sent successfully")
             except Exception as sms_error:
                 logger.error("SMS sending failed: %s", str(sms_error), exc_info=True)
                 raise Exception("Failed to send SMS: " + str(sms_error))
             
             logger.info("Verification code sent successfully")
+            CODES_SENT.labels(str(resent).lower()).inc()
             return {
                 'status': 'success',
                 'message': 'Verification code sent',
-                'expires_in': self.code_ttl
+                'expires_in': int(expiry - time.time()),
+                'resent': resent
             }
             
         except Exception as e:
@@ -90,7 +310,7 @@ class AuthManager:
             logger.error("Current state:")
             logger.error(" - Modem handler: %s", type(self.modem_handler))
             logger.error(" - Number of stored codes: %d", 
-                        len(self._verification_codes))
+                        len(self.code_store))
             return {
                 'status': 'error',
                 'message': str(e)
@@ -98,29 +318,33 @@ class AuthManager:
     
     def verify_code(self, phone_number, code):
         """Verify the provided code for the phone number."""
-        stored = self._verification_codes.get(phone_number)
+        stored = self.code_store.get(phone_number)
         
         if not stored:
+            CODE_VERIFICATIONS.labels('not_found').inc()
             return {
                 'status': 'error',
                 'message': 'Code not found'
             }
             
         if time.time() > stored['expiry']:
-            self._verification_codes.pop(phone_number)
+            self.code_store.pop(phone_number)
+            CODE_VERIFICATIONS.labels('expired').inc()
             return {
                 'status': 'error',
                 'message': 'Code expired'
             }
             
         if stored['code'] != code:
+            CODE_VERIFICATIONS.labels('invalid').inc()
             return {
                 'status': 'error',
                 'message': 'Invalid code'
             }
             
         # Code is valid - remove it and generate JWT
-        self._verification_codes.pop(phone_number)
+        self.code_store.pop(phone_number)
+        CODE_VERIFICATIONS.labels('success').inc()
         
         token = jwt.encode(
             {
@@ -137,31 +361,44 @@ class AuthManager:
             'message': 'Phone number verified successfully'
         }
 
+    def decode_token(self, token):
+        """Return the payload of a valid token, using the verified-token cache."""
+        payload = self.token_cache.get(token)
+        if payload is not None:
+            return payload
+        if self.token_cache.is_revoked(token):
+            raise jwt.InvalidTokenError('Token has been revoked')
+        payload = jwt.decode(token, self.secret_key, algorithms=['HS256'])
+        self.token_cache.put(token, payload)
+        return payload
+
+    def revoke_token(self, token):
+        """Revoke a token so require_auth rejects it even if cached."""
+        exp = None
+        try:
+            exp = jwt.decode(token, options={'verify_signature': False}).get('exp')
+        except Exception:
+            pass
+        self.token_cache.revoke(token, exp)
+
 def require_auth(auth_manager):
     """Decorator to protect API endpoints."""
     def decorator(f):
         @wraps(f)
         def decorated(*args, **kwargs):
-            token = None
-            
-            if 'Authorization' in request.headers:
-                auth_header = request.headers['Authorization']
-                try:
-                    token = auth_header.split(" ")[1]
-                except IndexError:
-                    return jsonify({'message': 'Token is missing'}), 401
+            auth_header = request.headers.get('Authorization', '')
+            token = auth_header.partition(' ')[2]
 
             if not token:
+                TOKEN_CHECKS.labels('missing').inc()
                 return jsonify({'message': 'Token is missing'}), 401
 
             try:
-                data = jwt.decode(
-                    token, 
-                    auth_manager.secret_key,
-                    algorithms=['HS256']
-                )
+                data = auth_manager.decode_token(token)
                 request.user_phone = data['phone']
+                TOKEN_CHECKS.labels('valid').inc()
             except Exception as e:
+                TOKEN_CHECKS.labels('invalid').inc()
                 return jsonify({
                     'message': 'Token is invalid: {0}'.format(str(e))
                 }), 401
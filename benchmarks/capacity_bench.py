@@ -0,0 +1,297 @@
+# benchmarks/capacity_bench.py
+"""
+Concurrent-connection capacity of the web tier, per async mode.
+
+Starts the modem daemon on the simulated modem and then one web server per
+async mode, all in split mode. Each run holds --connections requests open
+at once, each waiting on a slow USSD answer, and reports how many were
+served, how long the web process takes to answer /healthz meanwhile, and
+how many OS threads it needed.
+
+    python benchmarks/capacity_bench.py --connections 1000
+    python benchmarks/capacity_bench.py --modes threading,eventlet --output capacity.json
+
+Modes whose package is not installed are reported as skipped.
+"""
+from __future__ import print_function
+from threading import Thread
+import argparse
+import errno
+import json
+import os
+import selectors
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+MODES = ('threading', 'eventlet', 'gevent')
+
+
+def configure(args):
+    """Simulated modem with slow USSD and a scratch directory, in every process."""
+    from config import Config
+    from fake_modem import DEFAULT_LATENCY
+    Config.MODEM_BACKEND = 'fake'
+    Config.MODEM_PORTS = ['sim0']
+    latency = dict((command, 0.001) for command in DEFAULT_LATENCY)
+    latency['AT+CUSD'] = ('uniform', args.ussd_latency, args.ussd_latency)
+    Config.FAKE_MODEM_LATENCY = latency
+    Config.SMS_QUEUE_DB = os.path.join(args.workdir, 'sms_queue.db')
+    Config.MESSAGE_STORE_DB = os.path.join(args.workdir, 'messages.db')
+    Config.CODE_STORE_BACKEND = 'sqlite'
+    Config.CODE_STORE_DB = os.path.join(args.workdir, 'codes.db')
+    Config.MODEM_DAEMON_SOCKET = args.socket
+    Config.MODEM_DAEMON_TIMEOUT = args.timeout
+    return Config
+
+
+def serve_daemon(args):
+    configure(args)
+    import modem_daemon
+    modem_daemon.main()
+
+
+def serve_web(args):
+    Config = configure(args)
+    Config.ASYNC_MODE = args.mode
+    import logging
+    import app
+    logging.getLogger().setLevel(logging.WARNING)
+    app.socketio.run(app.app, host='127.0.0.1', port=args.port,
+                     allow_unsafe_werkzeug=True, log_output=False)
+
+
+def mode_available(mode):
+    if mode == 'threading':
+        return True
+    try:
+        __import__(mode)
+        return True
+    except ImportError:
+        return False
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def http_request(port, method, path, body=None, timeout=5):
+    """One HTTP/1.0 request; returns (status, seconds) or (None, seconds)."""
+    started = time.time()
+    try:
+        sock = socket.create_connection(('127.0.0.1', port), timeout=timeout)
+        sock.sendall(_request_bytes(method, path, body))
+        data = b''
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+        sock.close()
+        return _status(data), time.time() - started
+    except (OSError, socket.error):
+        return None, time.time() - started
+
+
+def _request_bytes(method, path, body=None):
+    body = json.dumps(body).encode('utf-8') if body is not None else b''
+    head = '{0} {1} HTTP/1.0\r\nHost: 127.0.0.1\r\nContent-Type: application/json\r\n' \
+           'Content-Length: {2}\r\n\r\n'.format(method, path, len(body))
+    return head.encode('ascii') + body
+
+
+def _status(data):
+    try:
+        return int(data.split(b' ', 2)[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def os_threads(pid):
+    try:
+        with open('/proc/{0}/status'.format(pid)) as f:
+            for line in f:
+                if line.startswith('Threads:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return None
+
+
+def hold_connections(port, count, body, timeout):
+    """
+    Open count connections at once from one thread and wait for every reply.
+
+    Returns a dict of status code -> responses, None counting connections
+    that failed or timed out.
+    """
+    selector = selectors.DefaultSelector()
+    payload = _request_bytes('POST', '/send_ussd', body)
+    results = {}
+    for _ in range(count):
+        sock = socket.socket()
+        sock.setblocking(False)
+        err = sock.connect_ex(('127.0.0.1', port))
+        if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            results[None] = results.get(None, 0) + 1
+            sock.close()
+            continue
+        selector.register(sock, selectors.EVENT_WRITE, {'out': payload, 'in': b''})
+
+    deadline = time.time() + timeout
+    while selector.get_map() and time.time() < deadline:
+        for key, events in selector.select(timeout=0.5):
+            sock, state = key.fileobj, key.data
+            try:
+                if events & selectors.EVENT_WRITE:
+                    sent = sock.send(state['out'])
+                    state['out'] = state['out'][sent:]
+                    if not state['out']:
+                        selector.modify(sock, selectors.EVENT_READ, state)
+                    continue
+                chunk = sock.recv(65536)
+            except (OSError, socket.error):
+                chunk, state['in'] = b'', b''
+            if chunk:
+                state['in'] += chunk
+                continue
+            status = _status(state['in'])
+            results[status] = results.get(status, 0) + 1
+            selector.unregister(sock)
+            sock.close()
+    for key in list(selector.get_map().values()):
+        results[None] = results.get(None, 0) + 1
+        key.fileobj.close()
+    selector.close()
+    return results
+
+
+def wait_until(check, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if check():
+            return True
+        time.sleep(0.2)
+    return False
+
+
+def bench_mode(args, mode, env):
+    port = free_port()
+    log = open(os.path.join(args.workdir, 'web-{0}.log'.format(mode)), 'w')
+    web = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--role', 'web',
+                            '--mode', mode, '--port', str(port)] + common_args(args),
+                           env=env, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        if not wait_until(lambda: http_request(port, 'GET', '/readyz')[0] == 200, 60):
+            return {'mode': mode, 'error': 'web server did not become ready'}
+        idle_threads = os_threads(web.pid)
+
+        body = {'ussd_code': '*100#', 'max_age': 0}
+        probes = []
+        peak = [idle_threads or 0]
+        done = []
+
+        def probe():
+            while not done:
+                status, seconds = http_request(port, 'GET', '/healthz', timeout=args.timeout)
+                probes.append(seconds if status == 200 else None)
+                peak[0] = max(peak[0], os_threads(web.pid) or 0)
+                time.sleep(0.1)
+
+        prober = Thread(target=probe)
+        prober.daemon = True
+        prober.start()
+        started = time.time()
+        results = hold_connections(port, args.connections, body, args.timeout)
+        duration = time.time() - started
+        done.append(True)
+        prober.join()
+
+        answered = [p for p in probes if p is not None]
+        answered.sort()
+        return {
+            'mode': mode,
+            'connections': args.connections,
+            'ok': results.get(200, 0),
+            'failed': sum(n for status, n in results.items() if status != 200),
+            'statuses': dict((str(k), v) for k, v in results.items()),
+            'duration': round(duration, 3),
+            'healthz_p50': answered[len(answered) // 2] if answered else None,
+            'healthz_max': answered[-1] if answered else None,
+            'healthz_failed': len(probes) - len(answered),
+            'threads_idle': idle_threads,
+            'threads_peak': peak[0]
+        }
+    finally:
+        web.terminate()
+        web.wait()
+        log.close()
+
+
+def common_args(args):
+    return ['--socket', args.socket, '--workdir', args.workdir,
+            '--ussd-latency', str(args.ussd_latency), '--timeout', str(args.timeout)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--connections', type=int, default=500)
+    parser.add_argument('--modes', default=','.join(MODES))
+    parser.add_argument('--ussd-latency', type=float, default=2.0)
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--output', help="Also write the results to this JSON file")
+    parser.add_argument('--role', choices=('daemon', 'web'), help=argparse.SUPPRESS)
+    parser.add_argument('--mode', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--socket', help=argparse.SUPPRESS)
+    parser.add_argument('--workdir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.role == 'daemon':
+        return serve_daemon(args)
+    if args.role == 'web':
+        return serve_web(args)
+
+    args.workdir = tempfile.mkdtemp(prefix='gsm-capacity-')
+    args.socket = os.path.join(args.workdir, 'modem.sock')
+    env = dict(os.environ)
+    env.pop('ASYNC_MODE', None)
+    env.pop('MODEM_DAEMON_SOCKET', None)
+    log = open(os.path.join(args.workdir, 'daemon.log'), 'w')
+    daemon = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--role', 'daemon']
+                              + common_args(args), env=env, stdout=log,
+                              stderr=subprocess.STDOUT)
+    results = []
+    try:
+        if not wait_until(lambda: os.path.exists(args.socket), 30):
+            sys.exit("Modem daemon did not start")
+        for mode in args.modes.split(','):
+            if not mode_available(mode):
+                result = {'mode': mode, 'skipped': '{0} is not installed'.format(mode)}
+            else:
+                result = bench_mode(args, mode, env)
+            print(json.dumps(result))
+            results.append(result)
+    finally:
+        daemon.terminate()
+        daemon.wait()
+        log.close()
+        shutil.rmtree(args.workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,296 @@
+# benchmarks/gateway_bench.py
+"""
+End-to-end throughput benchmark against the simulated modem backend.
+
+Drives the HTTP API through Flask's test client at a fixed concurrency and
+prints one JSON object per scenario with throughput and latency percentiles.
+
+    python benchmarks/gateway_bench.py --concurrency 8 --requests 200
+    python benchmarks/gateway_bench.py --scenario send_ussd --output results.json
+"""
+from __future__ import print_function
+from threading import Lock, Thread
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from config import Config  # noqa: E402
+from fake_modem import DEFAULT_LATENCY  # noqa: E402
+from webhook_stub import StubWebhookServer  # noqa: E402
+
+SCENARIOS = ('send_sms', 'send_ussd', 'auth_send_code', 'auth_verify_code', 'sms_grab',
+             'webhooks')
+
+# Stub consumers for the webhooks scenario: one healthy, one slow and flaky
+STUBS = {}
+
+
+def configure(args, workdir):
+    """Point the app at the simulated modem and a scratch directory."""
+    Config.MODEM_BACKEND = 'fake'
+    Config.MODEM_PORTS = ['sim{0}'.format(i) for i in range(args.modems)]
+    Config.FAKE_MODEM_CMS500_RATE = args.cms500_rate
+    if args.fast:
+        latency = dict((command, 0.001) for command in DEFAULT_LATENCY)
+        latency['AT+CMGS'] = ('uniform', 0.005, 0.02)
+        latency['AT+CUSD'] = ('uniform', 0.02, 0.05)
+        Config.FAKE_MODEM_LATENCY = latency
+    Config.SMS_QUEUE_DB = os.path.join(workdir, 'sms_queue.db')
+    Config.MESSAGE_STORE_DB = os.path.join(workdir, 'messages.db')
+    Config.CODE_STORE_DB = os.path.join(workdir, 'codes.db')
+    Config.SMS_QUEUE_RETRY_DELAY = 0.1
+    big = (10 ** 9, 1)
+    Config.SEND_CODE_LIMIT_PER_PHONE = big
+    Config.SEND_CODE_LIMIT_PER_IP = big
+    Config.SEND_CODE_LIMIT_GLOBAL = big
+
+    STUBS['fast'] = StubWebhookServer().start()
+    STUBS['slow'] = StubWebhookServer(delay=args.webhook_delay,
+                                      failure_rate=args.webhook_failure_rate).start()
+    Config.WEBHOOKS = [{'name': name, 'url': stub.url} for name, stub in STUBS.items()]
+    Config.WEBHOOK_SPOOL_DIR = os.path.join(workdir, 'webhook_spool')
+    Config.WEBHOOK_BATCH_WINDOW = 0.05
+    Config.WEBHOOK_RETRY_BASE = 0.1
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+def run_concurrent(total, concurrency, request_func):
+    """Call request_func(i) total times from concurrency threads."""
+    latencies = []
+    errors = [0]
+    lock = Lock()
+    counter = iter(range(total))
+
+    def worker():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            start = time.time()
+            try:
+                ok = request_func(i)
+            except Exception:
+                ok = False
+            elapsed = time.time() - start
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors[0] += 1
+
+    started = time.time()
+    threads = [Thread(target=worker) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, errors[0], time.time() - started
+
+
+def summarize(name, args, latencies, errors, duration, **extra):
+    result = {
+        'scenario': name,
+        'concurrency': args.concurrency,
+        'requests': args.requests,
+        'ok': len(latencies),
+        'errors': errors,
+        'duration': round(duration, 4),
+        'throughput': round(len(latencies) / duration, 2) if duration else None,
+        'p50': percentile(latencies, 50),
+        'p99': percentile(latencies, 99)
+    }
+    result.update(extra)
+    return result
+
+
+def bench_send_sms(app_module, args):
+    client = app_module.app.test_client()
+    job_ids = []
+
+    def request_func(i):
+        r = client.post('/send_sms', json={
+            'number': '+2613400{0:05d}'.format(i), 'message': 'Benchmark {0}'.format(i)})
+        if r.status_code == 202:
+            job_ids.append(r.get_json()['job_id'])
+            return True
+        return False
+
+    latencies, errors, duration = run_concurrent(args.requests, args.concurrency, request_func)
+
+    # Wait for the queue to drain to report delivery throughput too
+    queue = app_module.sms_queue
+    deadline = time.time() + args.timeout
+    jobs = []
+    while time.time() < deadline:
+        jobs = [queue.get_job(job_id) for job_id in job_ids]
+        if all(job['status'] in ('sent', 'failed') for job in jobs):
+            break
+        time.sleep(0.05)
+    sent = [j for j in jobs if j['status'] == 'sent']
+    end_to_end = [j['updated_at'] - j['created_at'] for j in sent]
+    send_throughput = None
+    if sent:
+        window = max(j['updated_at'] for j in sent) - min(j['created_at'] for j in sent)
+        send_throughput = round(len(sent) / window, 2) if window else None
+    return summarize('send_sms', args, latencies, errors, duration,
+                     sent=len(sent),
+                     send_throughput=send_throughput,
+                     send_p50=percentile(end_to_end, 50),
+                     send_p99=percentile(end_to_end, 99))
+
+
+def bench_send_ussd(app_module, args):
+    client = app_module.app.test_client()
+
+    def request_func(i):
+        r = client.post('/send_ussd?max_age={0}'.format(args.ussd_max_age),
+                        json={'ussd_code': Config.DEFAULT_USSD_STRING})
+        return r.status_code == 200 and r.get_json()['status'] == 'success'
+
+    latencies, errors, duration = run_concurrent(args.requests, args.concurrency, request_func)
+    return summarize('send_ussd', args, latencies, errors, duration,
+                     ussd_cache=app_module.ussd_cache.stats())
+
+
+def bench_auth_send_code(app_module, args):
+    client = app_module.app.test_client()
+
+    def request_func(i):
+        r = client.post('/auth/send-code',
+                        json={'phone_number': '+2613300{0:05d}'.format(i)})
+        return r.status_code == 200
+
+    latencies, errors, duration = run_concurrent(args.requests, args.concurrency, request_func)
+    return summarize('auth_send_code', args, latencies, errors, duration)
+
+
+def bench_auth_verify_code(app_module, args):
+    client = app_module.app.test_client()
+    store = app_module.code_store
+    numbers = ['+2613200{0:05d}'.format(i) for i in range(args.requests)]
+    expiry = time.time() + 600
+    for number in numbers:
+        store.set(number, '123456', expiry)
+
+    def request_func(i):
+        r = client.post('/auth/verify-code',
+                        json={'phone_number': numbers[i], 'code': '123456'})
+        return r.status_code == 200 and 'token' in r.get_json()
+
+    latencies, errors, duration = run_concurrent(args.requests, args.concurrency, request_func)
+    return summarize('auth_verify_code', args, latencies, errors, duration)
+
+
+def bench_sms_grab(app_module, args):
+    """Inbound SMS from +CMTI injection to the sms_grab Socket.IO event."""
+    client = app_module.socketio.test_client(app_module.app, query_string='events=sms_grab')
+    client.get_received()
+    modems = [h.modem for h in app_module.modem_handler.handlers]
+    injected = {}
+    received = {}
+
+    started = time.time()
+    for i in range(args.requests):
+        number = '+2613100{0:05d}'.format(i)
+        injected[number] = time.time()
+        modems[i % len(modems)].inject_sms(number, 'Inbound {0}'.format(i))
+
+    deadline = time.time() + args.timeout
+    while len(received) < args.requests and time.time() < deadline:
+        for packet in client.get_received():
+            if packet['name'] != 'events':
+                continue
+            frame = packet['args'][0]
+            for item in frame['events']:
+                number = item['data'].get('number')
+                if number in injected and number not in received:
+                    received[number] = time.time()
+            client.emit('events_ack', {'seq': frame['seq']})
+        time.sleep(0.005)
+    duration = time.time() - started
+    latencies = [received[n] - injected[n] for n in received]
+    client.disconnect()
+    return summarize('sms_grab', args, latencies, args.requests - len(latencies), duration)
+
+
+def bench_webhooks(app_module, args):
+    """Inbound SMS from +CMTI injection to a healthy webhook, beside a slow one."""
+    modems = [h.modem for h in app_module.modem_handler.handlers]
+    injected = {}
+    started = time.time()
+    for i in range(args.requests):
+        number = '+2613200{0:05d}'.format(i)
+        injected[number] = time.time()
+        modems[i % len(modems)].inject_sms(number, 'Webhook {0}'.format(i))
+
+    fast, slow = STUBS['fast'], STUBS['slow']
+    deadline = time.time() + args.timeout
+    while len(set(injected) & set(fast.received)) < args.requests and time.time() < deadline:
+        time.sleep(0.01)
+    duration = time.time() - started
+    latencies = [fast.received[n] - injected[n] for n in injected if n in fast.received]
+    return summarize('webhooks', args, latencies, args.requests - len(latencies), duration,
+                     fast=fast.stats(), slow=slow.stats(),
+                     endpoints=app_module.webhooks.stats())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS,
+                        help='Scenario to run (repeatable, default: all)')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--modems', type=int, default=2)
+    parser.add_argument('--cms500-rate', type=float, default=0.0)
+    parser.add_argument('--ussd-max-age', type=float, default=0)
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--webhook-delay', type=float, default=0.5,
+                        help='Response delay of the slow webhook stub')
+    parser.add_argument('--webhook-failure-rate', type=float, default=0.2,
+                        help='Share of POSTs the slow webhook stub fails')
+    parser.add_argument('--fast', action='store_true',
+                        help='Use millisecond modem latencies to measure software overhead')
+    parser.add_argument('--output', help='Also write results as JSON to this file')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='gateway-bench-')
+    configure(args, workdir)
+
+    import logging
+    logging.disable(logging.WARNING)
+    import app as app_module
+
+    deadline = time.time() + args.timeout
+    while not app_module.modem_supervisor.ready:
+        if time.time() > deadline:
+            sys.exit("Simulated modem did not become ready")
+        time.sleep(0.05)
+
+    results = []
+    for name in args.scenario or SCENARIOS:
+        result = globals()['bench_' + name](app_module, args)
+        print(json.dumps(result))
+        sys.stdout.flush()
+        results.append(result)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+# benchmarks/router_bench.py
+"""
+Inbound SMS routing cost against the number of rules.
+
+Builds rule sets of increasing size (keywords and sender prefixes) and
+prints one JSON object per size with compile time and per-message match
+latency, which should stay flat as the rule count grows.
+
+    python benchmarks/router_bench.py --sizes 10,1000,10000 --messages 20000
+"""
+from __future__ import print_function
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sms_router import RuleSet  # noqa: E402
+
+WORDS = ('code', 'stop', 'promo', 'balance', 'yes', 'no', 'help', 'info', 'win', 'offer')
+
+
+def make_rules(count, rng):
+    rules = [{'name': 'stop', 'route': 'opt_out', 'keywords': ['stop', 'unsubscribe'],
+              'match': 'first_word', 'priority': 0, 'final': True}]
+    for i in range(count - 1):
+        rule = {'name': 'rule{0}'.format(i), 'route': 'campaign{0}'.format(i % 50)}
+        if i % 3:
+            rule['keywords'] = ['{0}{1}'.format(rng.choice(WORDS), i)]
+        if i % 3 != 1:
+            rule['senders'] = ['2613{0}'.format(i)]
+        rules.append(rule)
+    return rules
+
+
+def make_messages(count, rules, rng):
+    messages = []
+    for _ in range(count):
+        rule = rng.choice(rules)
+        words = [rng.choice(WORDS) for _ in range(rng.randint(5, 25))]
+        if rule.get('keywords') and rng.random() < 0.5:
+            words.insert(rng.randint(0, len(words)), rule['keywords'][0])
+        sender = '+' + rule['senders'][0] + '0001' if rule.get('senders') else '+261320000001'
+        messages.append((sender, ' '.join(words)))
+    return messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='10,100,1000,10000')
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    for size in [int(s) for s in args.sizes.split(',')]:
+        rules = make_rules(size, rng)
+        started = time.time()
+        ruleset = RuleSet(rules)
+        compile_seconds = time.time() - started
+        messages = make_messages(args.messages, rules, rng)
+
+        matched = 0
+        started = time.time()
+        for number, text in messages:
+            if ruleset.match(number, text):
+                matched += 1
+        duration = time.time() - started
+        print(json.dumps({
+            'rules': size,
+            'compile_seconds': round(compile_seconds, 4),
+            'messages': len(messages),
+            'matched': matched,
+            'match_us': round(duration / len(messages) * 1e6, 2),
+            'throughput': round(len(messages) / duration, 1)
+        }))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+# benchmarks/webhook_stub.py
+"""
+Local HTTP server standing in for a webhook consumer.
+
+Records every batch it accepts and can be made slow or flaky:
+
+    python benchmarks/webhook_stub.py --port 8081 --delay 0.5 --failure-rate 0.2
+"""
+from __future__ import print_function
+from threading import Lock, Thread
+import argparse
+import json
+import random
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubWebhookServer:
+    def __init__(self, port=0, delay=0.0, failure_rate=0.0):
+        """
+        Initialize the stub.
+
+        Args:
+            port: Port to listen on (0 picks a free one)
+            delay: Seconds to wait before answering each POST
+            failure_rate: Share of POSTs answered with HTTP 503
+        """
+        self.delay = delay
+        self.failure_rate = failure_rate
+        self.batches = []
+        self.received = {}  # message number -> time first received
+        self.failures = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                status = stub._handle(body)
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self._server = _Server(('127.0.0.1', port), Handler)
+        self.port = self._server.server_address[1]
+        self.url = 'http://127.0.0.1:{0}/hook'.format(self.port)
+        self._thread = None
+
+    def _handle(self, body):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.delay:
+                time.sleep(self.delay)
+            if random.random() < self.failure_rate:
+                with self._lock:
+                    self.failures += 1
+                return 503
+            batch = json.loads(body.decode('utf-8'))
+            now = time.time()
+            with self._lock:
+                self.batches.append(batch)
+                for message in batch.get('messages', []):
+                    self.received.setdefault(message.get('number'), now)
+            return 200
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def start(self):
+        self._thread = Thread(target=self._server.serve_forever, name='webhook-stub')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'batches': len(self.batches),
+                'messages': len(self.received),
+                'failures': self.failures,
+                'max_in_flight': self.max_in_flight
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--delay', type=float, default=0.0)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    stub = StubWebhookServer(args.port, args.delay, args.failure_rate).start()
+    print("Listening on {0}".format(stub.url))
+    try:
+        while True:
+            time.sleep(5)
+            print(json.dumps(stub.stats()))
+    except KeyboardInterrupt:
+        stub.stop()
+
+
+if __name__ == '__main__':
+    main()
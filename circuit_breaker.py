@@ -0,0 +1,71 @@
+# circuit_breaker.py
+"""Consecutive-failure circuit breaker."""
+from threading import Lock
+import time
+
+BREAKER_CLOSED = 'closed'  # calls go through
+BREAKER_OPEN = 'open'  # calls fail fast until the owner's probe succeeds and resets it
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=3):
+        """
+        Initialize the breaker.
+
+        Args:
+            failure_threshold: Consecutive failures that open the circuit
+        """
+        self.failure_threshold = failure_threshold
+        self.state = BREAKER_CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.reason = None
+        self.trips = 0
+        self._lock = Lock()
+
+    @property
+    def closed(self):
+        return self.state == BREAKER_CLOSED
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+
+    def record_failure(self, reason=None):
+        """Count a failure; returns True if it opened the circuit."""
+        with self._lock:
+            self.failures += 1
+            if self.state == BREAKER_CLOSED and self.failures >= self.failure_threshold:
+                self._open(reason)
+                return True
+            return False
+
+    def trip(self, reason=None):
+        """Open the circuit now, e.g. when the device is gone."""
+        with self._lock:
+            if self.state == BREAKER_CLOSED:
+                self._open(reason)
+
+    def _open(self, reason):
+        self.state = BREAKER_OPEN
+        self.opened_at = time.time()
+        self.reason = reason
+        self.trips += 1
+
+    def reset(self):
+        """Close the circuit after a successful probe."""
+        with self._lock:
+            self.state = BREAKER_CLOSED
+            self.failures = 0
+            self.opened_at = None
+            self.reason = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'failures': self.failures,
+                'opened_at': self.opened_at,
+                'reason': self.reason,
+                'trips': self.trips
+            }
@@ -0,0 +1,229 @@
+# code_store.py
+"""Bounded, expiring storage for phone verification codes."""
+from threading import Event, Lock, Thread
+import heapq
+import logging
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+class CodeStore:
+    def __init__(self, capacity=100000):
+        """
+        Initialize an in-memory code store.
+
+        Args:
+            capacity: Maximum number of codes held; when full, the code
+                closest to expiry is evicted to make room
+        """
+        self.capacity = capacity
+        self._lock = Lock()
+        self._codes = {}  # phone -> {'code', 'expiry'}
+        self._expiries = []  # heap of (expiry, phone); stale entries skipped lazily
+        self._sweeper = None
+        self._stop = Event()
+        self.counters = {
+            'stored': 0,
+            'hits': 0,
+            'misses': 0,
+            'expired': 0,
+            'evicted': 0
+        }
+
+    def __len__(self):
+        with self._lock:
+            return len(self._codes)
+
+    def _pop_soonest(self):
+        """Remove and return the live entry with the earliest expiry."""
+        while self._expiries:
+            expiry, phone = heapq.heappop(self._expiries)
+            stored = self._codes.get(phone)
+            if stored and stored['expiry'] == expiry:
+                del self._codes[phone]
+                return phone, stored
+        return None, None
+
+    def _compact(self):
+        """Drop stale heap entries left behind by replaced or removed codes."""
+        if len(self._expiries) > 2 * len(self._codes) + 1024:
+            self._expiries = [(v['expiry'], k) for k, v in self._codes.items()]
+            heapq.heapify(self._expiries)
+
+    def set(self, phone, code, expiry):
+        """Store a code for phone, replacing any previous one."""
+        with self._lock:
+            if phone not in self._codes and len(self._codes) >= self.capacity:
+                self._sweep_locked(time.time())
+                if len(self._codes) >= self.capacity:
+                    evicted, _ = self._pop_soonest()
+                    self.counters['evicted'] += 1
+                    logger.warning("Code store full, evicted code for %s", evicted)
+            self._codes[phone] = {'code': code, 'expiry': expiry}
+            heapq.heappush(self._expiries, (expiry, phone))
+            self.counters['stored'] += 1
+            self._compact()
+
+    def get(self, phone):
+        """Return the stored entry for phone, or None."""
+        with self._lock:
+            stored = self._codes.get(phone)
+            self.counters['hits' if stored else 'misses'] += 1
+            return dict(stored) if stored else None
+
+    def pop(self, phone):
+        """Remove and return the stored entry for phone, or None."""
+        with self._lock:
+            return self._codes.pop(phone, None)
+
+    def _sweep_locked(self, now):
+        removed = 0
+        while self._expiries and self._expiries[0][0] <= now:
+            expiry, phone = heapq.heappop(self._expiries)
+            stored = self._codes.get(phone)
+            if stored and stored['expiry'] == expiry:
+                del self._codes[phone]
+                removed += 1
+        self.counters['expired'] += removed
+        return removed
+
+    def sweep(self):
+        """Remove every expired code; returns how many were removed."""
+        with self._lock:
+            return self._sweep_locked(time.time())
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['size'] = len(self._codes)
+            stats['capacity'] = self.capacity
+            return stats
+
+    def start_sweeper(self, interval=60):
+        """Periodically sweep expired codes from a background thread."""
+        if self._sweeper:
+            return
+        self._stop.clear()
+        self._sweeper = Thread(target=self._sweep_loop, args=(interval,),
+                               name='code-store-sweeper')
+        self._sweeper.daemon = True
+        self._sweeper.start()
+
+    def _sweep_loop(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                removed = self.sweep()
+                if removed:
+                    logger.info("Swept %d expired verification codes", removed)
+            except Exception as e:
+                logger.error("Code store sweep failed: %s", str(e))
+
+    def stop_sweeper(self):
+        self._stop.set()
+        if self._sweeper:
+            self._sweeper.join(timeout=5)
+            self._sweeper = None
+
+
+class SqliteCodeStore(CodeStore):
+    def __init__(self, db_path, capacity=100000, mmap_size=64 * 1024 * 1024):
+        """
+        Initialize a code store shared between processes through SQLite.
+
+        Args:
+            db_path: Path of the SQLite file shared by all workers
+            capacity: Maximum number of codes held
+            mmap_size: Bytes of the database file to memory-map
+        """
+        CodeStore.__init__(self, capacity)
+        self.db_path = db_path
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=5)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA mmap_size={0:d}".format(mmap_size))
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS verification_codes ("
+                " phone TEXT PRIMARY KEY,"
+                " code TEXT NOT NULL,"
+                " expiry REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_verification_codes_expiry"
+                " ON verification_codes (expiry)"
+            )
+
+    def __len__(self):
+        with self._lock:
+            return self._count()
+
+    def _count(self):
+        return self._db.execute("SELECT COUNT(*) FROM verification_codes").fetchone()[0]
+
+    def set(self, phone, code, expiry):
+        with self._lock, self._db:
+            exists = self._db.execute(
+                "SELECT 1 FROM verification_codes WHERE phone = ?", (phone,)
+            ).fetchone()
+            if not exists and self._count() >= self.capacity:
+                self._sweep_locked(time.time())
+                if self._count() >= self.capacity:
+                    self._db.execute(
+                        "DELETE FROM verification_codes WHERE phone IN ("
+                        " SELECT phone FROM verification_codes"
+                        " ORDER BY expiry LIMIT 1)"
+                    )
+                    self.counters['evicted'] += 1
+            self._db.execute(
+                "INSERT OR REPLACE INTO verification_codes (phone, code, expiry)"
+                " VALUES (?, ?, ?)",
+                (phone, code, expiry)
+            )
+            self.counters['stored'] += 1
+
+    def get(self, phone):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT code, expiry FROM verification_codes WHERE phone = ?",
+                (phone,)
+            ).fetchone()
+            self.counters['hits' if row else 'misses'] += 1
+            return {'code': row[0], 'expiry': row[1]} if row else None
+
+    def pop(self, phone):
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT code, expiry FROM verification_codes WHERE phone = ?",
+                (phone,)
+            ).fetchone()
+            if not row:
+                return None
+            self._db.execute(
+                "DELETE FROM verification_codes WHERE phone = ?", (phone,)
+            )
+            return {'code': row[0], 'expiry': row[1]}
+
+    def _sweep_locked(self, now):
+        removed = self._db.execute(
+            "DELETE FROM verification_codes WHERE expiry <= ?", (now,)
+        ).rowcount
+        self.counters['expired'] += removed
+        return removed
+
+    def sweep(self):
+        with self._lock, self._db:
+            return self._sweep_locked(time.time())
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['size'] = self._count()
+            stats['capacity'] = self.capacity
+            return stats
+
+
+def create_code_store(config):
+    """Build the code store selected by config.CODE_STORE_BACKEND."""
+    if config.CODE_STORE_BACKEND == 'sqlite':
+        return SqliteCodeStore(config.CODE_STORE_DB, capacity=config.CODE_STORE_CAPACITY)
+    return CodeStore(capacity=config.CODE_STORE_CAPACITY)
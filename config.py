@@ -1,5 +1,6 @@
 # config.py
 """Configuration settings for the SMS gateway application."""
+import os
 
 class Config:
     # Flask settings
@@ -7,14 +8,146 @@ class Config:
     DEBUG = False
     HOST = '0.0.0.0'
     PORT = 5000
+    # Server concurrency model: 'threading', 'eventlet' or 'gevent'; None lets
+    # Flask-SocketIO pick. The green modes serve thousands of connections
+    # without a thread each and need split mode (MODEM_DAEMON_SOCKET), so
+    # serial I/O stays in modem_daemon.py
+    ASYNC_MODE = os.environ.get('ASYNC_MODE')
 
     # Modem settings
     MODEM_PORT = '/dev/ttyUSB2'
+    MODEM_PORTS = [MODEM_PORT]  # e.g. ['/dev/ttyUSB2', '/dev/ttyUSB6']
     MODEM_BAUDRATE = 115200
     MODEM_PIN = None
+    MODEM_BACKEND = 'gsmmodem'  # 'fake' for the simulated modem in fake_modem.py
     DEFAULT_USSD_STRING = '#357#'
+    USSD_CACHE_TTL = 30  # seconds a successful USSD answer is reused
+    USSD_CACHE_TTLS = {DEFAULT_USSD_STRING: 60}  # per-code overrides, 0 disables
+    MODEM_HEALTH_INTERVAL = 30
+    MODEM_INIT_RETRY_INTERVAL = 5
+    MODEM_INIT_MAX_RETRY_INTERVAL = 60
+    MODEM_RETRY_AFTER = 5  # Retry-After sent while the modem is not ready
+    # Recovery once up: a modem failing MODEM_BREAKER_THRESHOLD operations in a
+    # row, or whose device disappears, leaves rotation and is reconnected with
+    # jittered exponential backoff; device presence is checked every
+    # MODEM_HOTPLUG_INTERVAL seconds
+    MODEM_BREAKER_THRESHOLD = 3
+    MODEM_HOTPLUG_INTERVAL = 1
+    MODEM_RECONNECT_INTERVAL = 1
+    MODEM_RECONNECT_MAX_INTERVAL = 30
+    MODEM_DOWN_AFTER = 5  # failed attempts before the state is 'down'
+    MODEM_REGISTRATION_TIMEOUT = 30
+    # Seconds a caller waits on a modem operation before it counts as a
+    # breaker failure; keep below MODEM_DAEMON_TIMEOUT
+    MODEM_CALL_TIMEOUT = 45
+    # Where a re-plugged modem may reappear under a new name
+    MODEM_DEVICE_GLOBS = ['/dev/serial/by-id/*', '/dev/ttyUSB*']
+    MODEM_TRACE_ENABLED = False  # toggle at runtime with POST /debug/modem-trace
+    MODEM_TRACE_BUFFER = 10000
+
+    # Split mode: modem_daemon.py owns the modems and web workers talk to it
+    # over this Unix socket; None runs everything in one process
+    MODEM_DAEMON_SOCKET = os.environ.get('MODEM_DAEMON_SOCKET')  # e.g. '/run/gsm-modem.sock'
+    MODEM_DAEMON_TIMEOUT = 60
+    MODEM_DAEMON_WORKERS = 8  # daemon threads running calls; modem calls do not hold one
+    # Socket file permissions; the web workers' user needs read and write
+    MODEM_DAEMON_SOCKET_MODE = 0o660
+    NETWORK_STATUS_TTL = 60
+    NETWORK_STATUS_REFRESH_INTERVAL = 20
 
     # Server settings
     SERVER_URL = "http://localhost:5000/sms"
     SOCKET_RETRY_INTERVAL = 3
-    SMS_PROCESS_INTERVAL = 10
+
+    # Socket.IO fan-out: events are batched into one frame per window or batch size
+    SOCKETIO_BATCH_WINDOW = 0.05
+    SOCKETIO_BATCH_SIZE = 100
+    SOCKETIO_CLIENT_BUFFER = 50  # unacknowledged frames before a client is skipped
+    SOCKETIO_ACK_TIMEOUT = 30  # seconds before an unacknowledged frame stops counting
+    SOCKETIO_MAX_PENDING = 10000
+
+    # Stored SMS fallback polling (seconds); +CMTI notifications trigger immediately
+    SMS_POLL_MIN_INTERVAL = 2
+    SMS_POLL_MAX_INTERVAL = 60
+    SMS_POLL_BACKOFF = 2.0
+
+    # Concatenated inbound SMS: parts are held until complete or this many seconds pass
+    SMS_REASSEMBLY_TIMEOUT = 120
+    SMS_REASSEMBLY_MAX_BYTES = 256 * 1024  # text buffered across incomplete messages
+
+    # Outbound queue settings
+    SMS_QUEUE_DB = 'sms_queue.db'
+    SMS_QUEUE_MAX_ATTEMPTS = 3
+    SMS_QUEUE_RETRY_DELAY = 5
+    SMS_QUEUE_WORKERS = None  # defaults to one worker per modem
+    # Fair-queuing weights per API client (X-Client-Id header, else remote
+    # address) within a priority class; unlisted clients weigh 1
+    SMS_CLIENT_WEIGHTS = {}
+    # Replace Unicode punctuation with GSM-7 look-alikes so a stray curly quote
+    # does not send the whole message as UCS-2 (70 instead of 160 characters)
+    SMS_TRANSLITERATE = False
+    # With SMS_TRANSLITERATE, also drop accents from letters outside GSM-7
+    # (a-acute becomes a); this alters the wording, so it is opt-in
+    SMS_TRANSLITERATE_ACCENTS = False
+
+    # Delivery reports: request a status report for every sent SMS and match it
+    # to its job; jobs without a final report after the TTL become 'unknown'
+    SMS_DELIVERY_REPORTS = True
+    SMS_DELIVERY_REPORT_TTL = 86400
+    SMS_DELIVERY_MAX_TRACKED = 100000
+    SMS_DELIVERY_SWEEP_INTERVAL = 60
+    SMS_DELIVERY_EARLY_WINDOW = 30  # seconds a report arriving before its send returned is held
+
+    # Inbound SMS routing rules (see sms_router.py); the file is reloaded when
+    # it changes. None leaves inbound SMS untagged
+    SMS_ROUTES_FILE = os.environ.get('SMS_ROUTES_FILE')  # e.g. 'sms_routes.json'
+    SMS_ROUTES_RELOAD_INTERVAL = 5
+
+    # Inbound SMS webhooks, e.g. [{'name': 'crm', 'url': 'http://crm.local/sms',
+    # 'concurrency': 4, 'routes': ['otp']}]; 'routes' limits an endpoint to SMS
+    # tagged with those routes, and each entry may override the WEBHOOK_* defaults
+    WEBHOOKS = []
+    WEBHOOK_SPOOL_DIR = 'webhook_spool'  # failed batches wait here for a retry
+    WEBHOOK_CONCURRENCY = 2  # requests in flight per endpoint
+    WEBHOOK_BATCH_SIZE = 20
+    WEBHOOK_BATCH_WINDOW = 0.5
+    WEBHOOK_TIMEOUT = 10
+    WEBHOOK_RETRY_BASE = 1  # doubles per attempt up to WEBHOOK_RETRY_MAX
+    WEBHOOK_RETRY_MAX = 300
+    WEBHOOK_MAX_AGE = 86400  # undelivered batches are dropped after this
+
+    # Event bus settings
+    EVENT_BUS_QUEUE_SIZE = 1000
+
+    # Message history settings
+    MESSAGE_STORE_DB = 'messages.db'
+    MESSAGE_STORE_BATCH_SIZE = 100
+    MESSAGE_STORE_FLUSH_INTERVAL = 0.5
+    MESSAGE_PAGE_MAX = 500
+
+    # Verification code settings
+    # 'sqlite' shares codes and token revocations between workers; split
+    # mode (MODEM_DAEMON_SOCKET) refuses to start without it
+    CODE_STORE_BACKEND = os.environ.get('CODE_STORE_BACKEND', 'memory')
+    CODE_STORE_DB = 'codes.db'
+    CODE_STORE_CAPACITY = 100000
+    CODE_STORE_SWEEP_INTERVAL = 60
+    TOKEN_CACHE_SIZE = 10000
+    # Seconds before a token revoked on another worker is rejected here
+    TOKEN_REVOCATION_REFRESH = 1.0
+
+    # /auth/send-code limits as (requests, per seconds)
+    SEND_CODE_LIMIT_PER_PHONE = (3, 600)
+    SEND_CODE_LIMIT_PER_IP = (20, 600)
+    SEND_CODE_LIMIT_GLOBAL = (60, 60)
+    # /send_sms limit per caller address as (SMS parts, per seconds); None disables
+    SEND_SMS_SEGMENT_LIMIT_PER_CLIENT = None
+
+    # Simulated modem (MODEM_BACKEND = 'fake'); latencies per AT command as
+    # seconds or ('uniform', lo, hi) / ('normal', mu, sigma) / ('lognormal', mu, sigma)
+    FAKE_MODEM_LATENCY = {}
+    FAKE_MODEM_CMS500_RATE = 0.0
+    FAKE_MODEM_USSD_TIMEOUT_RATE = 0.0
+    FAKE_MODEM_DELIVERY_FAILURE_RATE = 0.0
+    FAKE_MODEM_USSD_RESPONSE = 'Your balance is 1000'
+    FAKE_MODEM_NETWORK = 'Simulated'
@@ -0,0 +1,232 @@
+# delivery_reports.py
+"""Matching of SMS status reports (+CDS) to the messages they are about."""
+from collections import OrderedDict
+from threading import Event, Lock, Thread
+import logging
+import time
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DELIVERY_PENDING = 'pending'
+DELIVERY_DELIVERED = 'delivered'
+DELIVERY_FAILED = 'failed'
+DELIVERY_UNKNOWN = 'unknown'  # no report arrived before the entry was evicted
+
+DELIVERY_SECONDS = metrics.histogram(
+    'sms_delivery_latency_seconds', 'Time from send to the final status report',
+    ['status'], buckets=(1, 2.5, 5, 10, 30, 60, 120, 300, 900, 3600, 21600, 86400))
+REPORTS = metrics.counter(
+    'sms_status_reports_total', 'Status reports received, by outcome', ['result'])
+EVICTED = metrics.counter(
+    'sms_delivery_evicted_total', 'Tracked messages dropped without a final report',
+    ['reason'])
+
+
+def report_status(status):
+    """
+    Map a TP-Status value (3GPP TS 23.040) to a delivery state.
+
+    0x00-0x1F: transaction completed, 0x20-0x3F: the SC is still trying,
+    anything above: permanent error or the SC gave up.
+    """
+    if status is None:
+        return DELIVERY_UNKNOWN
+    if status < 0x20:
+        return DELIVERY_DELIVERED
+    if status < 0x40:
+        return DELIVERY_PENDING
+    return DELIVERY_FAILED
+
+
+def _same_number(a, b):
+    # Reports may use national or international format for the same number
+    a = ''.join(c for c in str(a or '') if c.isdigit())[-9:]
+    b = ''.join(c for c in str(b or '') if c.isdigit())[-9:]
+    return not a or not b or a == b
+
+
+class DeliveryTracker:
+    def __init__(self, callback, ttl=86400, max_tracked=100000, sweep_interval=60,
+                 early_window=30, max_early=1000):
+        """
+        Initialize the tracker.
+
+        Args:
+            callback: Callable receiving a delivery dict whenever a tracked
+                message reaches a final state or is evicted
+            ttl: Seconds to wait for a final report before giving up
+            max_tracked: Messages tracked at once; the oldest is evicted
+            sweep_interval: Seconds between expiry sweeps
+            early_window: Seconds an unmatched report is held in case it
+                arrived before its message was tracked
+            max_early: Unmatched reports held at once; the oldest is dropped
+        """
+        self.callback = callback
+        self.ttl = ttl
+        self.max_tracked = max_tracked
+        self.sweep_interval = sweep_interval
+        self.early_window = early_window
+        self.max_early = max_early
+        # (modem, reference) -> entry; references are per modem and wrap at
+        # 256, so a reused reference replaces the older entry
+        self._tracked = OrderedDict()
+        # (modem, reference) -> (received_at, report) for reports that beat
+        # track(): a fast +CDS can arrive before sendSms has returned
+        self._early = OrderedDict()
+        self._lock = Lock()
+        self._stop = Event()
+        self._thread = None
+        self.tracked = 0
+        self.matched = 0
+        self.unmatched = 0
+        self.evicted = 0
+
+    def track(self, modem, reference, job_id, number):
+        """Remember a sent message until its status report arrives."""
+        key = (modem, reference)
+        entry = {'job_id': job_id, 'number': number, 'sent_at': time.time()}
+        with self._lock:
+            replaced = self._tracked.pop(key, None)
+            self._tracked[key] = entry
+            self.tracked += 1
+            overflow = []
+            while len(self._tracked) > self.max_tracked:
+                overflow.append(self._tracked.popitem(last=False)[1])
+            early = self._early.pop(key, None)
+        if replaced is not None:
+            self._evict(replaced, 'reused')
+        for old in overflow:
+            self._evict(old, 'capacity')
+        if early is not None:
+            self.handle_report(modem, early[1])
+
+    def handle_report(self, modem, report):
+        """
+        Match a status report to its message in O(1).
+
+        Args:
+            modem: Port of the modem the report arrived on
+            report: Object with reference, deliveryStatus and number, like
+                gsmmodem.modem.StatusReport (its 'status' is the storage
+                status of the report SMS, not the TP-Status)
+        """
+        key = (modem, getattr(report, 'reference', None))
+        state = report_status(getattr(report, 'deliveryStatus', None))
+        with self._lock:
+            entry = self._tracked.get(key)
+            if entry is None or not _same_number(entry['number'],
+                                                 getattr(report, 'number', None)):
+                entry = None
+            elif state != DELIVERY_PENDING:
+                del self._tracked[key]
+        if entry is None:
+            self._hold_early(key, report)
+            return None
+        if state == DELIVERY_PENDING:
+            REPORTS.labels('pending').inc()
+            return None
+
+        self.matched += 1
+        REPORTS.labels(state).inc()
+        latency = time.time() - entry['sent_at']
+        DELIVERY_SECONDS.labels(state).observe(latency)
+        return self._notify(entry, state, latency,
+                            getattr(report, 'deliveryStatus', None))
+
+    def _hold_early(self, key, report):
+        with self._lock:
+            self._early.pop(key, None)
+            self._early[key] = (time.time(), report)
+            dropped = 0
+            while len(self._early) > self.max_early:
+                self._early.popitem(last=False)
+                dropped += 1
+        self._unmatched(dropped)
+
+    def _unmatched(self, count):
+        if count:
+            self.unmatched += count
+            REPORTS.labels('unmatched').inc(count)
+            logger.info("%d status report(s) matched no sent message", count)
+
+    def _notify(self, entry, state, latency=None, code=None):
+        delivery = {
+            'job_id': entry['job_id'],
+            'number': entry['number'],
+            'delivery_status': state,
+            'latency': latency,
+            'status_code': code
+        }
+        try:
+            self.callback(delivery)
+        except Exception as e:
+            logger.error("Delivery callback failed: %s", str(e))
+        return delivery
+
+    def _evict(self, entry, reason):
+        self.evicted += 1
+        EVICTED.labels(reason).inc()
+        self._notify(entry, DELIVERY_UNKNOWN)
+
+    def sweep(self):
+        """Evict messages whose report is overdue; returns how many."""
+        now = time.time()
+        cutoff = now - self.ttl
+        expired = []
+        stale = 0
+        with self._lock:
+            while self._early:
+                key, (received_at, _) = next(iter(self._early.items()))
+                if received_at > now - self.early_window:
+                    break
+                del self._early[key]
+                stale += 1
+            # Entries are in send order, so expired ones are at the front
+            while self._tracked:
+                key, entry = next(iter(self._tracked.items()))
+                if entry['sent_at'] > cutoff:
+                    break
+                del self._tracked[key]
+                expired.append(entry)
+        self._unmatched(stale)
+        for entry in expired:
+            self._evict(entry, 'expired')
+        return len(expired)
+
+    def start(self):
+        if self._thread:
+            return
+
+        def _run():
+            while not self._stop.wait(self.sweep_interval):
+                try:
+                    count = self.sweep()
+                    if count:
+                        logger.info("Evicted %d messages without a status report", count)
+                except Exception as e:
+                    logger.error("Delivery report sweep failed: %s", str(e))
+
+        self._stop.clear()
+        self._thread = Thread(target=_run, name='delivery-report-sweeper')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._tracked)
+            early = len(self._early)
+        return {
+            'pending': pending,
+            'early_reports': early,
+            'tracked': self.tracked,
+            'matched': self.matched,
+            'unmatched': self.unmatched,
+            'evicted': self.evicted
+        }
@@ -0,0 +1,141 @@
+# event_bus.py
+"""In-process publish/subscribe bus with bounded per-subscriber queues."""
+from threading import Lock, Thread
+import logging
+
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+logger = logging.getLogger(__name__)
+
+# Topics
+SMS_RECEIVED = 'sms.received'
+SMS_SENT = 'sms.sent'
+SMS_NOTIFIED = 'sms.notified'
+USSD_EXCHANGE = 'ussd.exchange'
+SMS_STATUS = 'sms.status'  # outbound job status changes
+SMS_BATCH_STATUS = 'sms.batch_status'  # outbound batch progress
+SMS_DELIVERY = 'sms.delivery'  # status report matched to a sent job
+
+_STOP = object()
+
+
+class Subscription:
+    def __init__(self, topic, handler, maxsize, name):
+        """
+        Initialize a subscription.
+
+        Args:
+            topic: Topic the handler listens to
+            handler: Callable invoked with each published payload
+            maxsize: Capacity of the pending queue; events beyond it are dropped
+            name: Name used in logs and stats
+        """
+        self.topic = topic
+        self.handler = handler
+        self.name = name
+        self.delivered = 0
+        self.dropped = 0
+        self.errors = 0
+        self._queue = queue.Queue(maxsize)
+        self._thread = Thread(target=self._run, name='bus-{0}'.format(name))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def offer(self, data):
+        """Queue an event without blocking; return False if it was dropped."""
+        try:
+            self._queue.put_nowait(data)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 100 == 0:
+                logger.warning("Subscriber %s is full, %d events dropped",
+                               self.name, self.dropped)
+            return False
+
+    def _run(self):
+        while True:
+            data = self._queue.get()
+            if data is _STOP:
+                break
+            try:
+                self.handler(data)
+                self.delivered += 1
+            except Exception as e:
+                self.errors += 1
+                logger.error("Subscriber %s failed: %s", self.name, str(e), exc_info=True)
+
+    def close(self):
+        """Stop the delivery thread after it drains pending events."""
+        self._queue.put(_STOP)
+        self._thread.join(timeout=5)
+
+    def stats(self):
+        return {
+            'topic': self.topic,
+            'name': self.name,
+            'pending': self._queue.qsize(),
+            'delivered': self.delivered,
+            'dropped': self.dropped,
+            'errors': self.errors
+        }
+
+
+class EventBus:
+    def __init__(self, default_maxsize=1000):
+        """
+        Initialize the event bus.
+
+        Args:
+            default_maxsize: Queue capacity for subscribers that do not set one
+        """
+        self.default_maxsize = default_maxsize
+        self._lock = Lock()
+        self._subscriptions = {}
+
+    def subscribe(self, topic, handler, maxsize=None, name=None):
+        """Register a handler that runs on its own thread and queue."""
+        subscription = Subscription(
+            topic, handler,
+            maxsize or self.default_maxsize,
+            name or getattr(handler, '__name__', repr(handler))
+        )
+        with self._lock:
+            self._subscriptions.setdefault(topic, []).append(subscription)
+        logger.info("Subscribed %s to %s", subscription.name, topic)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Remove a subscription and stop its thread."""
+        with self._lock:
+            subscribers = self._subscriptions.get(subscription.topic, [])
+            if subscription in subscribers:
+                subscribers.remove(subscription)
+        subscription.close()
+
+    def publish(self, topic, data):
+        """Hand an event to every subscriber of topic; never blocks."""
+        with self._lock:
+            subscribers = list(self._subscriptions.get(topic, ()))
+        delivered = 0
+        for subscription in subscribers:
+            if subscription.offer(data):
+                delivered += 1
+        return delivered
+
+    def stats(self):
+        """Delivery counters for every subscription."""
+        with self._lock:
+            subscribers = [s for subs in self._subscriptions.values() for s in subs]
+        return [s.stats() for s in subscribers]
+
+    def close(self):
+        """Stop every subscription."""
+        with self._lock:
+            subscribers = [s for subs in self._subscriptions.values() for s in subs]
+            self._subscriptions = {}
+        for subscription in subscribers:
+            subscription.close()
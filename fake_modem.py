@@ -0,0 +1,294 @@
+# fake_modem.py
+"""Simulated GSM modem implementing the GsmModem subset ModemHandler uses."""
+from datetime import datetime
+from threading import Lock, Thread, Timer
+import itertools
+import logging
+import random
+import time
+
+try:
+    from gsmmodem.exceptions import TimeoutException
+except ImportError:  # gsmmodem is optional with the simulated backend
+    class TimeoutException(Exception):
+        """Raised when the simulated modem does not answer in time."""
+
+logger = logging.getLogger(__name__)
+
+CTRL_Z = chr(26)  # ends the message body after AT+CMGS
+
+DEFAULT_LATENCY = {
+    'default': ('uniform', 0.01, 0.03),
+    'AT+COPS?': ('uniform', 0.05, 0.15),
+    'AT+CSQ': ('uniform', 0.05, 0.1),
+    'AT+CMGS': ('lognormal', -0.7, 0.4),  # median ~0.5 s
+    'AT+CUSD': ('uniform', 1.5, 4.0),
+    'AT+CMGR': ('uniform', 0.05, 0.1),
+    'AT+CMGL': ('uniform', 0.1, 0.3),
+    'AT+CMGD': ('uniform', 0.03, 0.06),
+    '+CDS': ('uniform', 1.0, 5.0),  # send to status report
+}
+
+
+# Simulated USB presence for hot-plug testing. Every device counts as present
+# until it is unplugged; devices plugged in at runtime are also listed.
+_unplugged = set()
+_plugged = []
+
+
+def unplug(device):
+    """Make a device vanish; modems open on it fail like a pulled USB stick."""
+    _unplugged.add(device)
+
+
+def plug(device):
+    """Make a device (re)appear, possibly under a new name."""
+    _unplugged.discard(device)
+    if device not in _plugged:
+        _plugged.append(device)
+
+
+def device_present(device):
+    return device not in _unplugged
+
+
+def list_devices():
+    return [device for device in _plugged if device not in _unplugged]
+
+
+class FakeCmsError(Exception):
+    def __init__(self, code):
+        Exception.__init__(self, "+CMS ERROR: {0} (CMS {0})".format(code))
+        self.code = code
+
+
+class FakeReceivedSms:
+    def __init__(self, number, text, sms_time=None, udh=None):
+        self.number = number
+        self.text = text
+        self.time = sms_time or datetime.now()
+        self.udh = udh or []
+
+
+class FakeConcatenation:
+    """Concatenation header element, shaped like gsmmodem.pdu.Concatenation."""
+
+    def __init__(self, reference, parts, number):
+        self.id = 0x00
+        self.reference = reference
+        self.parts = parts
+        self.number = number
+
+
+class FakeSentSms:
+    def __init__(self, number, text, reference):
+        self.number = number
+        self.text = text
+        self.reference = reference
+        self.status = 0
+
+
+class FakeStatusReport:
+    """Status report, shaped like gsmmodem.modem.StatusReport."""
+    DELIVERED = 0
+    FAILED = 68
+    STATUS_RECEIVED_UNREAD = 0  # storage status of the report SMS itself
+
+    def __init__(self, reference, number, delivery_status):
+        self.reference = reference
+        self.number = number
+        self.status = self.STATUS_RECEIVED_UNREAD
+        self.deliveryStatus = delivery_status
+        self.timeFinalized = datetime.now()
+
+
+class FakeUssd:
+    def __init__(self, message, session_active=False):
+        self.message = message
+        self.sessionActive = session_active
+
+    def cancel(self):
+        self.sessionActive = False
+
+
+class FakeGsmModem:
+    def __init__(self, port, baudrate=115200, smsReceivedCallbackFunc=None,
+                 smsStatusReportCallback=None, config=None, **kwargs):
+        """
+        Initialize the simulated modem.
+
+        Args:
+            port: Name reported in logs and traces (no device is opened)
+            baudrate: Ignored
+            smsReceivedCallbackFunc: Called with each received SMS
+            smsStatusReportCallback: Called with simulated delivery reports
+            config: Configuration object with FAKE_MODEM_* settings
+        """
+        self.port = port
+        self.smsReceivedCallback = smsReceivedCallbackFunc
+        self.smsStatusReportCallback = smsStatusReportCallback
+        self.latency = dict(DEFAULT_LATENCY)
+        self.latency.update(getattr(config, 'FAKE_MODEM_LATENCY', None) or {})
+        self.cms500_rate = getattr(config, 'FAKE_MODEM_CMS500_RATE', 0.0)
+        self.ussd_timeout_rate = getattr(config, 'FAKE_MODEM_USSD_TIMEOUT_RATE', 0.0)
+        self.delivery_failure_rate = getattr(config, 'FAKE_MODEM_DELIVERY_FAILURE_RATE', 0.0)
+        self.ussd_response = getattr(config, 'FAKE_MODEM_USSD_RESPONSE', 'Your balance is 1000')
+        self.network = getattr(config, 'FAKE_MODEM_NETWORK', 'Simulated')
+        self.notifyCallback = self._handleModemNotification
+        self.alive = False
+        self.sent = []
+        self._serial = Lock()  # one command on the line at a time, like a real port
+        self._storage = {}
+        self._indices = itertools.count(1)
+        self._references = itertools.count(1)
+
+    # Serial simulation
+
+    def _delay(self, command):
+        spec = self.latency.get(command, self.latency['default'])
+        if isinstance(spec, (int, float)):
+            return float(spec)
+        kind, a, b = spec
+        if kind == 'uniform':
+            return random.uniform(a, b)
+        if kind == 'normal':
+            return max(0.0, random.gauss(a, b))
+        if kind == 'lognormal':
+            return random.lognormvariate(a, b)
+        raise ValueError("Unknown latency distribution: {0}".format(kind))
+
+    def _exchange(self, command, response):
+        if self.port in _unplugged:
+            raise IOError("[Errno 5] Input/output error: '{0}'".format(self.port))
+        key = command.split('=')[0] if '=' in command else command
+        with self._serial:
+            time.sleep(self._delay(key))
+        return response
+
+    def write(self, data, waitForResponse=True, timeout=10, parseError=True,
+              writeTerm='\r', expectedResponseTermSeq=None):
+        if writeTerm == CTRL_Z:
+            return self._exchange('+CMGS', ['+CMGS: 0', 'OK'])  # message body
+        if data == 'AT+CPMS?':
+            used = len(self._storage)
+            return self._exchange(data, [
+                '+CPMS: "SM",{0},30,"SM",{0},30,"SM",{0},30'.format(used), 'OK'])
+        if data == 'AT+COPS?':
+            return self._exchange(data, ['+COPS: 0,0,"{0}",2'.format(self.network), 'OK'])
+        if data == 'AT+CSQ':
+            return self._exchange(data, ['+CSQ: 20,99', 'OK'])
+        return self._exchange(data, ['OK'])
+
+    def _handleModemNotification(self, lines):
+        """Default URC handler; ModemHandler wraps notifyCallback."""
+        return None
+
+    # GsmModem API
+
+    def connect(self, pin=None):
+        self.write('ATZ')
+        self.alive = True
+        logger.info("Simulated modem %s connected", self.port)
+
+    def close(self):
+        self.alive = False
+
+    @property
+    def networkName(self):
+        return self.write('AT+COPS?')[0].split('"')[1]
+
+    @property
+    def signalStrength(self):
+        return int(self.write('AT+CSQ')[0][6:].split(',')[0])
+
+    def waitForNetworkCoverage(self, timeout=None):
+        return self.signalStrength
+
+    def sendSms(self, destination, text, waitForDeliveryReport=False, deliveryTimeout=15):
+        # Two writes like gsmmodem in text mode: the command, then the body
+        self.write('AT+CMGS="{0}"'.format(destination), expectedResponseTermSeq='> ')
+        self.write(text, writeTerm=CTRL_Z)
+        if random.random() < self.cms500_rate:
+            raise FakeCmsError(500)
+        sms = FakeSentSms(destination, text, next(self._references) % 256)
+        self.sent.append(sms)
+        if self.smsStatusReportCallback:
+            delivery_status = (FakeStatusReport.FAILED
+                               if random.random() < self.delivery_failure_rate
+                               else FakeStatusReport.DELIVERED)
+            timer = Timer(self._delay('+CDS'), self.inject_status_report,
+                          (sms.reference, destination, delivery_status))
+            timer.daemon = True
+            timer.start()
+        return sms
+
+    def sendUssd(self, ussdString, responseTimeout=15):
+        self._exchange('AT+CUSD', None)
+        if random.random() < self.ussd_timeout_rate:
+            raise TimeoutException()
+        return FakeUssd(self.ussd_response)
+
+    def readStoredSms(self, index, memory=None):
+        return self._exchange('AT+CMGR', self._storage[index])
+
+    def deleteStoredSms(self, index, memory=None):
+        self._exchange('AT+CMGD', None)
+        self._storage.pop(index, None)
+
+    def listStoredSms(self, status=None, delete=False):
+        messages = self._exchange('AT+CMGL', list(self._storage.items()))
+        if delete:
+            for index, _ in messages:
+                self._storage.pop(index, None)
+        return [sms for _, sms in messages]
+
+    def processStoredSms(self, unreadOnly=False):
+        for sms in self.listStoredSms(delete=True):
+            if self.smsReceivedCallback:
+                self.smsReceivedCallback(sms)
+
+    # Traffic injection
+
+    def inject_sms(self, number, text, udh=None):
+        """Store an inbound SMS and announce it with +CMTI, like the network."""
+        index = next(self._indices)
+        self._storage[index] = FakeReceivedSms(number, text, udh=udh)
+        self.notifyCallback(['+CMTI: "SM",{0}'.format(index)])
+        return index
+
+    def inject_status_report(self, reference, number,
+                             delivery_status=FakeStatusReport.DELIVERED):
+        """Deliver a status report carrying a TP-Status for a message reference."""
+        if self.alive and self.smsStatusReportCallback:
+            self.smsStatusReportCallback(FakeStatusReport(reference, number, delivery_status))
+
+    def inject_long_sms(self, number, text, part_length=153, order=None, reference=None):
+        """
+        Store a concatenated SMS as separate parts, as a long message arrives.
+
+        Args:
+            number: Sender number
+            text: Full message text
+            part_length: Characters per part (153 for GSM-7 with a header)
+            order: Part numbers to deliver, in order; omit some to simulate loss
+            reference: Concatenation reference (random if omitted)
+        """
+        chunks = [text[i:i + part_length] for i in range(0, len(text), part_length)] or ['']
+        reference = random.randint(0, 255) if reference is None else reference
+        indices = []
+        for part in order or range(1, len(chunks) + 1):
+            udh = [FakeConcatenation(reference, len(chunks), part)]
+            indices.append(self.inject_sms(number, chunks[part - 1], udh=udh))
+        return indices
+
+    def inject_burst(self, count, interval=0.0, number_prefix='+26134000', text='Burst {0}'):
+        """Deliver count synthetic SMS from a background thread."""
+        def _run():
+            for i in range(count):
+                self.inject_sms('{0}{1:04d}'.format(number_prefix, i), text.format(i))
+                if interval:
+                    time.sleep(interval)
+        thread = Thread(target=_run, name='fake-modem-burst')
+        thread.daemon = True
+        thread.start()
+        return thread
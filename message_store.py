@@ -0,0 +1,183 @@
+# message_store.py
+"""Persistent SQLite history of inbound, outbound and USSD messages."""
+from threading import Thread, local
+import logging
+import sqlite3
+import time
+
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+logger = logging.getLogger(__name__)
+
+DIRECTION_INBOUND = 'inbound'
+DIRECTION_OUTBOUND = 'outbound'
+DIRECTION_USSD = 'ussd'
+
+_STOP = object()
+
+
+class MessageStore:
+    def __init__(self, db_path, batch_size=100, flush_interval=0.5, max_pending=10000):
+        """
+        Initialize the message store.
+
+        Args:
+            db_path: Path of the SQLite database file
+            batch_size: Maximum rows written per transaction
+            flush_interval: Seconds the writer waits to fill a batch
+            max_pending: Capacity of the write queue; records beyond it are dropped
+        """
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.dropped = 0
+        self._pending = queue.Queue(max_pending)
+        self._local = local()
+
+        db = self._connection()
+        db.execute("PRAGMA journal_mode=WAL")
+        with db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " direction TEXT NOT NULL,"
+                " number TEXT,"
+                " text TEXT,"
+                " status TEXT,"
+                " modem TEXT,"
+                " created_at REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS idx_messages_number"
+                       " ON messages (number, id)")
+            db.execute("CREATE INDEX IF NOT EXISTS idx_messages_direction"
+                       " ON messages (direction, id)")
+            db.execute("CREATE INDEX IF NOT EXISTS idx_messages_created"
+                       " ON messages (created_at)")
+
+        self._writer = Thread(target=self._write_loop, name='message-store-writer')
+        self._writer.daemon = True
+        self._writer.start()
+        logger.info("MessageStore initialized with db=%s", db_path)
+
+    def _connection(self):
+        """Per-thread connection; WAL lets readers run beside the writer."""
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.db_path)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def record(self, direction, data):
+        """Queue a message for writing; never blocks the caller."""
+        row = (
+            direction,
+            data.get('number'),
+            data.get('text'),
+            data.get('status'),
+            data.get('modem'),
+            time.time()
+        )
+        try:
+            self._pending.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+            logger.warning("Message store queue full, %d records dropped", self.dropped)
+
+    def record_inbound(self, data):
+        self.record(DIRECTION_INBOUND, dict(data, status='received'))
+
+    def record_outbound(self, data):
+        self.record(DIRECTION_OUTBOUND, data)
+
+    def record_ussd(self, data):
+        self.record(DIRECTION_USSD, data)
+
+    def _write_loop(self):
+        db = self._connection()
+        while True:
+            row = self._pending.get()
+            if row is _STOP:
+                break
+            batch = [row]
+            deadline = time.time() + self.flush_interval
+            stop = False
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    row = self._pending.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if row is _STOP:
+                    stop = True
+                    break
+                batch.append(row)
+            try:
+                with db:
+                    db.executemany(
+                        "INSERT INTO messages (direction, number, text, status,"
+                        " modem, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                        batch
+                    )
+                self.written += len(batch)
+            except Exception as e:
+                logger.error("Failed to write %d messages: %s", len(batch), str(e))
+            if stop:
+                break
+
+    def query(self, direction=None, number=None, since=None, until=None,
+              cursor=None, limit=50):
+        """
+        Return messages newest first, paginated with a keyset cursor.
+
+        Returns:
+            Tuple of (messages, next_cursor); next_cursor is None on the last page
+        """
+        clauses = []
+        params = []
+        if direction:
+            clauses.append("direction = ?")
+            params.append(direction)
+        if number:
+            clauses.append("number = ?")
+            params.append(number)
+        if since is not None:
+            clauses.append("created_at >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("created_at < ?")
+            params.append(until)
+        if cursor is not None:
+            clauses.append("id < ?")
+            params.append(cursor)
+
+        sql = ("SELECT id, direction, number, text, status, modem, created_at"
+               " FROM messages")
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY id DESC LIMIT ?"
+        params.append(limit + 1)
+
+        rows = self._connection().execute(sql, params).fetchall()
+        messages = [dict(row) for row in rows[:limit]]
+        next_cursor = messages[-1]['id'] if len(rows) > limit else None
+        return messages, next_cursor
+
+    def stats(self):
+        return {
+            'pending': self._pending.qsize(),
+            'written': self.written,
+            'dropped': self.dropped
+        }
+
+    def close(self):
+        """Flush pending writes and stop the writer."""
+        self._pending.put(_STOP)
+        self._writer.join(timeout=5)
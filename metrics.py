@@ -0,0 +1,242 @@
+# metrics.py
+"""Minimal metrics registry exposed in Prometheus text format."""
+from functools import wraps
+from threading import Lock
+import bisect
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(k, _escape(v)) for k, v in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = Lock()
+        self._children = {}
+
+    def labels(self, *values, **kwargs):
+        """Return the child metric for the given label values."""
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = ['# HELP {0} {1}'.format(self.name, self.documentation),
+                 '# TYPE {0} {1}'.format(self.name, self.kind)]
+        for name, labels, value in self._samples():
+            lines.append('{0}{1} {2}'.format(name, labels, _format_value(value)))
+        return '\n'.join(lines)
+
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        # A lost update under a race costs less than a lock on every hot-path call
+        self.value += amount
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def _samples(self):
+        for key, child in sorted(self._children.items()):
+            yield self.name, _format_labels(self.labelnames, key), child.value
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), func=None):
+        """
+        A gauge whose value is set directly or computed at scrape time.
+
+        Args:
+            func: Optional callable returning a number, or a dict mapping
+                label value tuples to numbers
+        """
+        _Metric.__init__(self, name, documentation, labelnames)
+        self.func = func
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def set(self, value):
+        self.labels().value = value
+
+    def _samples(self):
+        if self.func is None:
+            for key, child in sorted(self._children.items()):
+                yield self.name, _format_labels(self.labelnames, key), child.value
+            return
+        try:
+            value = self.func()
+        except Exception as e:
+            logger.warning("Gauge %s callback failed: %s", self.name, str(e))
+            return
+        if isinstance(value, dict):
+            for key, v in sorted(value.items()):
+                if not isinstance(key, tuple):
+                    key = (key,)
+                yield self.name, _format_labels(self.labelnames, key), v
+        elif value is not None:
+            yield self.name, '', value
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self):
+        return _Timer(self)
+
+
+class _Timer:
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.time() - self.start)
+        return False
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        _Metric.__init__(self, name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def _samples(self):
+        for key, child in sorted(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), child.counts):
+                cumulative += count
+                yield (self.name + '_bucket',
+                       _format_labels(self.labelnames, key, ('le', _format_value(float(bound)))),
+                       cumulative)
+            yield self.name + '_sum', _format_labels(self.labelnames, key), child.sum
+            yield self.name + '_count', _format_labels(self.labelnames, key), child.count
+
+
+class Registry:
+    def __init__(self):
+        self._lock = Lock()
+        self._metrics = {}
+
+    def register(self, metric):
+        """Add a metric, or return the one already registered under its name."""
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def unregister(self, name):
+        with self._lock:
+            self._metrics.pop(name, None)
+
+    def render(self):
+        """Render every metric in Prometheus text exposition format."""
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        return '\n'.join(m.render() for m in metrics) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def counter(name, documentation, labelnames=()):
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name, documentation, labelnames=(), func=None):
+    return REGISTRY.register(Gauge(name, documentation, labelnames, func))
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+def timed(metric, *label_values):
+    """Decorator observing the call duration in a histogram child."""
+    def decorator(f):
+        child = metric.labels(*label_values)
+
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            start = time.time()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                child.observe(time.time() - start)
+        return wrapper
+    return decorator
@@ -0,0 +1,316 @@
+# modem_daemon.py
+"""
+Modem-owner process for split mode.
+
+Only one process can open the serial ports. In split mode this daemon owns
+them, together with the outbound queue, stored SMS processing and message
+history, and serves any number of web workers over a Unix socket:
+
+    export MODEM_DAEMON_SOCKET=/run/gsm-modem.sock CODE_STORE_BACKEND=sqlite
+    python modem_daemon.py
+    gunicorn -k eventlet -w 4 app:app    # or ASYNC_MODE=eventlet python app.py
+
+Calls are served by a small pool of threads. Modem calls such as USSD are
+parked on the modem's own I/O thread and answered when it finishes, so no
+daemon thread sits waiting on the serial port.
+
+Send rate limits are kept in the daemon; verification codes and token
+revocations are shared by the workers through the SQLite code store.
+
+Web workers subscribe to the event stream. Every worker receives every event
+for its own Socket.IO clients, and each event is marked for handling on
+exactly one worker, chosen round-robin. Browsers must stay on one worker,
+either with the websocket-only transport index.html uses or sticky sessions.
+"""
+from threading import Lock, Thread
+from event_bus import (EventBus, SMS_RECEIVED, SMS_SENT, SMS_STATUS,
+                       SMS_BATCH_STATUS, SMS_DELIVERY, USSD_EXCHANGE)
+from message_store import MessageStore
+from modem_executor import ModemCall
+from modem_ipc import SUBSCRIBE, recv_frame, send_frame, encode_frame
+from modem_service import ModemService
+from modem_trace import ModemTracer
+from config import Config
+import logging
+import os
+import signal
+import socket
+import sys
+
+try:
+    import queue
+    import socketserver
+except ImportError:  # Python 2
+    import Queue as queue
+    import SocketServer as socketserver
+
+logger = logging.getLogger(__name__)
+
+# Events forwarded to web workers
+STREAM_TOPICS = (SMS_RECEIVED, SMS_SENT, USSD_EXCHANGE, SMS_STATUS, SMS_BATCH_STATUS,
+                 SMS_DELIVERY)
+
+
+class _Stream:
+    def __init__(self, sock, send_timeout):
+        self.sock = sock
+        self.lock = Lock()
+        sock.settimeout(send_timeout)
+
+    def send(self, payload):
+        with self.lock:
+            self.sock.sendall(payload)
+
+
+class ModemDaemon:
+    def __init__(self, path, methods, event_bus, topics=STREAM_TOPICS, send_timeout=5,
+                 workers=8, mode=0o660):
+        """
+        Initialize the daemon.
+
+        Args:
+            path: Unix socket path to listen on
+            methods: Dict mapping method names to callables; a method may
+                return a ModemCall, which is answered once it completes
+            event_bus: Bus whose topics are streamed to web workers
+            topics: Topics forwarded on the event stream
+            send_timeout: Seconds a worker may block an event write before
+                its stream is dropped
+            workers: Threads running calls and writing replies
+            mode: Permission bits for the socket file; anyone who can
+                connect can send SMS and read history
+        """
+        self.path = path
+        self.methods = methods
+        self.event_bus = event_bus
+        self.topics = topics
+        self.send_timeout = send_timeout
+        self.workers = workers
+        self.mode = mode
+        self.calls = 0
+        self.errors = 0
+        self.parked = 0  # modem calls waiting for their modem
+        self._tasks = queue.Queue()
+        self._worker_threads = []
+        self._streams = []
+        self._streams_lock = Lock()
+        self._next_worker = 0
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)  # stale socket from a previous run
+        daemon = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                daemon._serve(self.request)
+
+        self._server = socketserver.ThreadingUnixStreamServer(
+            self.path, Handler, bind_and_activate=False)
+        self._server.server_bind()
+        os.chmod(self.path, self.mode)  # before listen(), so no one connects first
+        self._server.server_activate()
+        self._server.daemon_threads = True
+        for topic in self.topics:
+            self.event_bus.subscribe(topic, self._forwarder(topic),
+                                     name='daemon-stream-{0}'.format(topic))
+        for i in range(self.workers):
+            thread = Thread(target=self._work, name='modem-daemon-worker-{0}'.format(i))
+            thread.daemon = True
+            thread.start()
+            self._worker_threads.append(thread)
+        self._thread = Thread(target=self._server.serve_forever, name='modem-daemon')
+        self._thread.daemon = True
+        self._thread.start()
+        logger.info("Modem daemon listening on %s", self.path)
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+        for _ in self._worker_threads:
+            self._tasks.put(None)
+        self._worker_threads = []
+        with self._streams_lock:
+            streams, self._streams = self._streams, []
+        for stream in streams:
+            stream.sock.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def _serve(self, sock):
+        send_lock = Lock()
+
+        def reply(request_id, frame):
+            if request_id is not None:
+                frame['i'] = request_id
+            try:
+                with send_lock:
+                    send_frame(sock, frame)
+            except (OSError, socket.error) as e:
+                logger.warning("Could not reply to web worker: %s", str(e))
+
+        while True:
+            try:
+                request = recv_frame(sock)
+            except Exception as e:
+                logger.warning("Dropping daemon connection: %s", str(e))
+                return
+            if request is None:
+                return
+            method = request.get('m')
+            if method == SUBSCRIBE:
+                self._stream(sock)
+                return
+            args = (method, request.get('a') or [], request.get('k') or {},
+                    request.get('i'), reply)
+            if request.get('i') is None:
+                self._call(*args)  # legacy client: one call at a time
+            else:
+                self._tasks.put(lambda args=args: self._call(*args))
+
+    def _work(self):
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                return
+            try:
+                task()
+            except Exception as e:
+                logger.error("Daemon worker error: %s", str(e), exc_info=True)
+
+    def _call(self, method, args, kwargs, request_id, reply):
+        self.calls += 1
+        func = self.methods.get(method)
+        if func is None:
+            self.errors += 1
+            reply(request_id, {'e': "Unknown method: {0}".format(method), 'k': 'ValueError'})
+            return
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            reply(request_id, self._error(method, e))
+            return
+        if isinstance(result, ModemCall):
+            # Answered when the modem finishes; the reply is written by a
+            # worker so a slow web worker never stalls the modem thread
+            self.parked += 1
+            result.add_done_callback(
+                lambda call: self._tasks.put(lambda: self._finish(method, call, request_id, reply)))
+            return
+        reply(request_id, {'r': result})
+
+    def _finish(self, method, call, request_id, reply):
+        self.parked -= 1
+        error = call.exception()
+        reply(request_id, self._error(method, error) if error is not None
+              else {'r': call.result()})
+
+    def _error(self, method, error):
+        self.errors += 1
+        logger.error("Daemon call %s failed: %s", method, str(error))
+        return {'e': str(error), 'k': type(error).__name__}
+
+    def _stream(self, sock):
+        stream = _Stream(sock, self.send_timeout)
+        with self._streams_lock:
+            self._streams.append(stream)
+            count = len(self._streams)
+        logger.info("Web worker subscribed to events (%d connected)", count)
+        try:
+            # Workers never send on a stream; an empty read means it closed
+            while True:
+                try:
+                    if not sock.recv(1):
+                        break
+                except socket.timeout:
+                    continue
+        except (OSError, socket.error):
+            pass
+        finally:
+            self._drop(stream)
+
+    def _drop(self, stream):
+        with self._streams_lock:
+            if stream not in self._streams:
+                return
+            self._streams.remove(stream)
+            count = len(self._streams)
+        stream.sock.close()
+        logger.info("Web worker event stream closed (%d connected)", count)
+
+    def _forwarder(self, topic):
+        def forward(data):
+            with self._streams_lock:
+                streams = list(self._streams)
+                if not streams:
+                    return
+                worker = self._next_worker % len(streams)
+                self._next_worker += 1
+            # Encode once; only the 'w' flag differs between workers
+            broadcast = encode_frame({'t': topic, 'd': data})
+            work = encode_frame({'t': topic, 'd': data, 'w': True})
+            for i, stream in enumerate(streams):
+                try:
+                    stream.send(work if i == worker else broadcast)
+                except (OSError, socket.error) as e:
+                    logger.warning("Dropping slow or closed worker stream: %s", str(e))
+                    self._drop(stream)
+        return forward
+
+    def stats(self):
+        with self._streams_lock:
+            workers = len(self._streams)
+        return {
+            'path': self.path,
+            'workers': workers,
+            'calls': self.calls,
+            'errors': self.errors,
+            'parked': self.parked,
+            'queued': self._tasks.qsize()
+        }
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    if not Config.MODEM_DAEMON_SOCKET:
+        sys.exit("Set MODEM_DAEMON_SOCKET to run the modem daemon")
+
+    event_bus = EventBus(default_maxsize=Config.EVENT_BUS_QUEUE_SIZE)
+    message_store = MessageStore(
+        Config.MESSAGE_STORE_DB,
+        batch_size=Config.MESSAGE_STORE_BATCH_SIZE,
+        flush_interval=Config.MESSAGE_STORE_FLUSH_INTERVAL
+    )
+    tracer = ModemTracer(
+        capacity=Config.MODEM_TRACE_BUFFER,
+        enabled=Config.MODEM_TRACE_ENABLED
+    )
+    service = ModemService(Config, event_bus, message_store=message_store, tracer=tracer)
+    methods = service.methods()
+    daemon = ModemDaemon(Config.MODEM_DAEMON_SOCKET, methods, event_bus,
+                         workers=Config.MODEM_DAEMON_WORKERS,
+                         mode=Config.MODEM_DAEMON_SOCKET_MODE)
+    methods['daemon.stats'] = daemon.stats
+
+    daemon.start()
+    service.start()
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        signal.pause()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.stop()
+        service.stop()
+        event_bus.close()
+        message_store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+# modem_executor.py
+"""Dedicated I/O thread that runs every serial operation of one modem."""
+from collections import deque
+from threading import Condition, Event, Lock, Thread, current_thread
+import logging
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+WAIT_SECONDS = metrics.histogram(
+    'modem_call_wait_seconds', 'Time modem calls spend queued for the modem thread',
+    ['modem'])
+
+
+class ModemCallTimeout(RuntimeError):
+    """Raised by ModemCall.result when the call is still running after the timeout."""
+
+
+class ModemCall:
+    """Result of a call submitted to a ModemExecutor."""
+
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.submitted_at = time.time()
+        self._done = Event()
+        self._lock = Lock()
+        self._callbacks = []
+        self._finished = False
+        self._result = None
+        self._error = None
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """Wait for the call and return its result or raise its exception."""
+        if not self._done.wait(timeout):
+            raise ModemCallTimeout("Modem call {0} still running after {1}s".format(
+                getattr(self.func, '__name__', 'call'), timeout))
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    def exception(self):
+        return self._error
+
+    def add_done_callback(self, callback):
+        """Call callback(call) once done; at once if it already is."""
+        with self._lock:
+            if not self._finished:
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def _run(self):
+        try:
+            self._result = self.func(*self.args, **self.kwargs)
+        except Exception as e:
+            self._error = e
+        self._set_done()
+
+    def _set_done(self):
+        with self._lock:
+            self._finished = True
+            callbacks, self._callbacks = self._callbacks, []
+        # Callbacks run before waiters wake, so bookkeeping done in them is
+        # settled by the time result() returns
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception as e:
+                logger.error("Modem call callback failed: %s", str(e), exc_info=True)
+        self._done.set()
+
+
+class ModemExecutor:
+    def __init__(self, name):
+        """
+        Initialize the executor; its thread starts on the first call.
+
+        Args:
+            name: Modem port, used for the thread name and metrics
+        """
+        self.name = name
+        self.calls = 0
+        self.busy_seconds = 0.0
+        self._queue = deque()
+        self._cond = Condition()
+        self._current = None
+        self._current_started = None
+        self._running = False
+        self._thread = None
+        self._wait_seconds = WAIT_SECONDS.labels(name)
+
+    def on_thread(self):
+        """True when called from the executor's own thread."""
+        return self._thread is not None and current_thread() is self._thread
+
+    def submit(self, func, *args, **kwargs):
+        """Queue func for the modem thread and return its ModemCall."""
+        call = ModemCall(func, args, kwargs)
+        if self.on_thread():
+            # Nested call from a running operation: queueing it would deadlock
+            call._run()
+            return call
+        with self._cond:
+            if not self._running:
+                self._start()
+            self._queue.append(call)
+            self._cond.notify()
+        return call
+
+    def call(self, func, *args, **kwargs):
+        """Run func on the modem thread and return its result."""
+        return self.submit(func, *args, **kwargs).result()
+
+    def _start(self):
+        # Caller holds _cond
+        self._running = True
+        self._thread = Thread(target=self._run, name='modem-io-{0}'.format(self.name))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and not self._queue:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                call = self._queue.popleft()
+                started = time.time()
+                self._current = call
+                self._current_started = started
+            self._wait_seconds.observe(started - call.submitted_at)
+            call._run()
+            with self._cond:
+                self._current = None
+                self.calls += 1
+                self.busy_seconds += time.time() - started
+
+    def stop(self, timeout=5):
+        """Finish queued calls and stop the thread."""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None and not self.on_thread():
+            thread.join(timeout)
+
+    def stats(self):
+        with self._cond:
+            current = self._current
+            return {
+                'queued': len(self._queue),
+                'running': getattr(current.func, '__name__', 'call') if current else None,
+                'running_for': time.time() - self._current_started if current else None,
+                'calls': self.calls,
+                'busy_seconds': round(self.busy_seconds, 3)
+            }
@@ -1,44 +1,121 @@
 # modem_handler.py
 """GSM modem handling module."""
 from __future__ import print_function
-from gsmmodem.modem import GsmModem
-from gsmmodem.exceptions import TimeoutException
+try:
+    from gsmmodem.modem import GsmModem
+    from gsmmodem.exceptions import TimeoutException
+except ImportError:  # only the simulated backend is usable
+    GsmModem = None
+    from fake_modem import TimeoutException
 from datetime import datetime
+from collections import deque
+import glob
+import os
+from threading import Event, Thread
+from network_status import NetworkStatusCache
+from event_bus import SMS_RECEIVED, SMS_SENT, SMS_NOTIFIED, USSD_EXCHANGE
+from metrics import timed
+from modem_executor import ModemExecutor
+from modem_trace import traced
+from sms_reassembly import concat_info
+import metrics
 import logging
 import json
-import requests
 import time
 
 logger = logging.getLogger(__name__)
 
+REDACTED_TEXT = '[redacted]'  # stands in for the text of sensitive messages in events
+
+OPERATION_SECONDS = metrics.histogram(
+    'modem_operation_duration_seconds',
+    'Duration of ModemHandler operations', ['operation'])
+OPERATION_ERRORS = metrics.counter(
+    'modem_operation_errors_total',
+    'ModemHandler operations that failed', ['operation'])
+SEND_SMS_AT_SECONDS = metrics.histogram(
+    'modem_sendsms_at_duration_seconds',
+    'Duration of the GsmModem.sendSms exchange alone, without the network pre-check')
+CMS500_RETRIES = metrics.counter(
+    'modem_cms500_retries_total', 'CMS 500 errors retried by send_sms')
+
+def list_devices(config):
+    """Serial devices a re-enumerated modem may show up as."""
+    if getattr(config, 'MODEM_BACKEND', 'gsmmodem') == 'fake':
+        import fake_modem
+        return fake_modem.list_devices()
+    devices = []
+    for pattern in getattr(config, 'MODEM_DEVICE_GLOBS', ()):
+        devices.extend(sorted(glob.glob(pattern)))
+    return devices
+
+
 class ModemHandler:
     # def __init__(self, config, socketio=None):
     #     """Initialize the modem handler with configuration."""
     #     self.config = config
     #     self.modem = None
     #     self.socketio = socketio
-    def __init__(self, config, socketio, sms_callback=None):
+    def __init__(self, config, socketio, sms_callback=None, port=None, event_bus=None,
+                 tracer=None, reassembler=None, delivery_tracker=None, router=None):
         """Initialize the modem handler with configuration."""
         self.config = config
+        self.port = port or config.MODEM_PORT
+        self.device = self.port  # differs from port after USB re-enumeration
         self.modem = None
         self.socketio = socketio
         self.external_sms_callback = sms_callback
+        self.event_bus = event_bus
+        self.tracer = tracer
+        self.reassembler = reassembler  # joins concatenated SMS before delivery
+        self.delivery_tracker = delivery_tracker  # matches status reports to sends
+        self.router = router  # tags inbound SMS with the routes their content matches
+        # Every AT exchange runs on this modem's own thread, one at a time
+        self.executor = ModemExecutor(self.port)
+        self.network_cache = NetworkStatusCache(
+            getattr(config, 'NETWORK_STATUS_TTL', 60))
+        self._poller = None
+        self._poller_stop = Event()
+        self._poller_wake = Event()
+        self._new_sms = deque()  # (memory, index) from +CMTI, read by the scheduler
+        self.received_count = 0
         logger.info("ModemHandler initialized with config: PORT=%s, BAUDRATE=%s", 
-                   config.MODEM_PORT, config.MODEM_BAUDRATE)
+                   self.port, config.MODEM_BAUDRATE)
 
+    def run(self, func, *args, **kwargs):
+        """Run func on this modem's I/O thread and return its result."""
+        if self.tracer is not None:
+            # Commands sent from the I/O thread are traced under the caller's operation
+            func = self.tracer.carry_operation(func)
+        return self.executor.call(func, *args, **kwargs)
+
+    @timed(OPERATION_SECONDS, 'check_network_status')
     def check_network_status(self):
-        """Check GSM network registration status."""
+        """Check GSM network registration status, served from cache when fresh."""
+        if not self.modem:
+            return False, "Modem not connected"
+
+        cached = self.network_cache.get()
+        if cached is not None:
+            return cached
+        return self.refresh_network_status()
+
+    @timed(OPERATION_SECONDS, 'refresh_network_status')
+    @traced('refresh_network_status')
+    def refresh_network_status(self):
+        """Query registration and signal over serial and update the cache."""
         try:
             if not self.modem:
                 return False, "Modem not connected"
 
             # Check if registered to network
-            network_name = self.modem.networkName
-            signal_strength = self.modem.signalStrength
+            network_name, signal_strength = self.run(
+                lambda: (self.modem.networkName, self.modem.signalStrength))
+            self.network_cache.update(network_name, signal_strength)
             
-            logger.info("Network Status:")
-            logger.info(" - Network: %s", network_name)
-            logger.info(" - Signal Strength: %s", signal_strength)
+            logger.debug("Network Status:")
+            logger.debug(" - Network: %s", network_name)
+            logger.debug(" - Signal Strength: %s", signal_strength)
             
             if not network_name:
                 return False, "Not registered to network"
@@ -47,34 +124,146 @@ class ModemHandler:
             
         except Exception as e:
             logger.error("Error checking network status: %s", str(e))
+            self.network_cache.invalidate(str(e))
             return False, str(e)
 
+    def _status_report_callback(self):
+        if self.delivery_tracker is None:
+            return None
+        return self.handle_status_report
+
+    def _request_status_reports(self):
+        """Ask the SMSC for a status report on every message we send."""
+        if self.delivery_tracker is None:
+            return
+        # In PDU mode gsmmodem sets the request bit itself; text mode needs
+        # it in the first octet of AT+CSMP (0x31 = SUBMIT, VPF relative, SRR)
+        if getattr(self.modem, 'smsTextMode', False):
+            try:
+                self.modem.write('AT+CSMP=49,167,0,0')
+            except Exception as e:
+                logger.warning("Could not request status reports: %s", str(e))
+
+    def handle_status_report(self, report):
+        """Callback for +CDS/+CDSI status reports."""
+        try:
+            logger.info("Status report on %s for reference %s: %s", self.port,
+                        getattr(report, 'reference', None), getattr(report, 'status', None))
+            self.delivery_tracker.handle_report(self.port, report)
+        except Exception as e:
+            logger.error("Error handling status report: %s", str(e))
+
+    def _watch_notifications(self):
+        """
+        Hook unsolicited result codes read by the modem thread.
+
+        +CREG/+CGREG invalidate the network cache. +CMTI new-message
+        indices are queued for read_new_sms() instead of being read
+        inline, and SMS_NOTIFIED wakes the stored-SMS scheduler.
+        """
+        try:
+            self.modem.write('AT+CREG=1')
+        except Exception as e:
+            logger.warning("Could not enable registration reports: %s", str(e))
+
+        notify = self.modem.notifyCallback
+
+        def _notification(lines):
+            if any(line.startswith(('+CREG:', '+CGREG:')) for line in lines):
+                logger.info("Registration change on %s: %s", self.port, lines)
+                self.network_cache.invalidate('registration change')
+                self._poller_wake.set()
+
+            new_sms = [line for line in lines if line.startswith('+CMTI:')]
+            if new_sms:
+                for line in new_sms:
+                    try:
+                        memory, index = line[6:].split(',')
+                        self._new_sms.append((memory.strip().strip('"'), int(index)))
+                    except ValueError:
+                        logger.warning("Unparseable new message notification: %s", line)
+                self._publish(SMS_NOTIFIED, {"count": len(new_sms)})
+                lines = [line for line in lines if not line.startswith('+CMTI:')]
+                if not lines:
+                    return None
+            return notify(lines)
+
+        self.modem.notifyCallback = _notification
+
+    def start_network_poller(self, interval=None):
+        """Keep the network cache fresh from a background thread."""
+        if self._poller:
+            return
+        interval = interval or getattr(self.config, 'NETWORK_STATUS_REFRESH_INTERVAL', 20)
+        self._poller_stop.clear()
+        self._poller = Thread(target=self._poll_network, args=(interval,),
+                              name='network-poller-{0}'.format(self.port))
+        self._poller.daemon = True
+        self._poller.start()
+
+    def _poll_network(self, interval):
+        while not self._poller_stop.is_set():
+            self._poller_wake.wait(interval)
+            self._poller_wake.clear()
+            if self._poller_stop.is_set() or not self.modem:
+                continue
+            self.refresh_network_status()
+
+    def stop_network_poller(self):
+        """Stop the background network poller."""
+        self._poller_stop.set()
+        self._poller_wake.set()
+        if self._poller:
+            self._poller.join(timeout=5)
+            self._poller = None
+
+    @timed(OPERATION_SECONDS, 'connect')
+    @traced('connect')
     def connect(self):
         """Connect to the GSM modem."""
         try:
-            logger.info("Attempting to connect to modem on port %s", self.config.MODEM_PORT)
+            logger.info("Attempting to connect to modem on port %s", self.port)
             
-            import os
-            if not os.path.exists(self.config.MODEM_PORT):
-                logger.error("Modem port %s does not exist!", self.config.MODEM_PORT)
+            if not self.device_present():
+                logger.error("Modem device %s does not exist!", self.device)
                 return False
 
-            self.modem = GsmModem(
-                self.config.MODEM_PORT,
-                self.config.MODEM_BAUDRATE,
-                smsReceivedCallbackFunc=self.handle_sms
-            )
+            if getattr(self.config, 'MODEM_BACKEND', 'gsmmodem') == 'fake':
+                from fake_modem import FakeGsmModem
+                self.modem = FakeGsmModem(
+                    self.device,
+                    self.config.MODEM_BAUDRATE,
+                    smsReceivedCallbackFunc=self.handle_sms,
+                    smsStatusReportCallback=self._status_report_callback(),
+                    config=self.config
+                )
+            else:
+                if GsmModem is None:
+                    logger.error("gsmmodem is not installed")
+                    return False
+
+                self.modem = GsmModem(
+                    self.device,
+                    self.config.MODEM_BAUDRATE,
+                    smsReceivedCallbackFunc=self.handle_sms,
+                    smsStatusReportCallback=self._status_report_callback()
+                )
+            if self.tracer:
+                self.tracer.attach(self.modem, self.port)
 
             logger.info("Connecting to modem...")
             self.modem.connect(self.config.MODEM_PIN)
+            self._request_status_reports()
+            self._watch_notifications()
+            self.start_network_poller()
 
             # Wait for network registration
             
-            max_wait = 30  # seconds
+            max_wait = getattr(self.config, 'MODEM_REGISTRATION_TIMEOUT', 30)
             start_time = time.time()
             
             while time.time() - start_time < max_wait:
-                network_status, message = self.check_network_status()
+                network_status, message = self.refresh_network_status()
                 if network_status:
                     logger.info("Network registered: %s", message)
                     return True
@@ -87,8 +276,12 @@ class ModemHandler:
             return True
         except Exception as e:
             logger.error("Failed to connect to modem: %s", str(e))
+            OPERATION_ERRORS.labels('connect').inc()
+            # Leave no half-open handle behind for the next attempt
+            self.disconnect()
             return False
 
+    @traced('wait_for_network')
     def wait_for_network(self, timeout=30):
         """Wait for network registration with timeout."""
         start_time = time.time()
@@ -97,6 +290,7 @@ class ModemHandler:
                 if self.modem.waitForNetworkCoverage(timeout=5):
                     network_name = self.modem.networkName
                     signal = self.modem.signalStrength
+                    self.network_cache.update(network_name, signal)
                     logger.info("Network registered: %s (Signal: %s)", network_name, signal)
                     return True
             except Exception as e:
@@ -108,21 +302,51 @@ class ModemHandler:
         logger.error("Timeout waiting for network registration")
         return False
 
+    def device_present(self, device=None):
+        """True if the serial device (default: the current one) exists."""
+        device = device or self.device
+        if getattr(self.config, 'MODEM_BACKEND', 'gsmmodem') == 'fake':
+            import fake_modem
+            return fake_modem.device_present(device)
+        return os.path.exists(device)
+
     def disconnect(self):
         """Safely disconnect from the modem."""
+        self.stop_network_poller()
+        self.network_cache.invalidate('disconnected')
         if self.modem:
             try:
                 self.modem.close()
                 logger.info("Modem disconnected")
             except Exception as e:
                 logger.error("Error disconnecting modem: %s", str(e))
+            finally:
+                self.modem = None
+
+    def _publish(self, topic, data):
+        """Publish an event on the bus, if one is attached."""
+        if self.event_bus:
+            data.setdefault("modem", self.port)
+            data.setdefault("time", datetime.now().isoformat())
+            self.event_bus.publish(topic, data)
+
+    @timed(OPERATION_SECONDS, 'send_sms')
+    @traced('send_sms')
+    def send_sms(self, number, message, sensitive=False):
+        """
+        Send an SMS message; returns the modem port and message reference.
 
-    def send_sms(self, number, message):
-        """Send an SMS message."""
+        Args:
+            number: Destination number
+            message: Message text
+            sensitive: The text is a secret such as a verification code; it is
+                left out of the SMS_SENT event and so out of message history
+        """
         if not self.modem:
             logger.error("Cannot send SMS: Modem not connected")
             raise RuntimeError("Modem not connected")
 
+        published_text = REDACTED_TEXT if sensitive else message
         try:
             # Check network status first
             network_ok, status_msg = self.check_network_status()
@@ -136,12 +360,24 @@ class ModemHandler:
                 try:
                     logger.info("Sending SMS to %s (attempt %d/%d)", 
                               number, attempt + 1, max_retries)
-                    self.modem.sendSms(number, message)
+                    with SEND_SMS_AT_SECONDS.time():
+                        sent = self.modem.sendSms(number, message)
+                    reference = getattr(sent, 'reference', None)
                     logger.info("SMS sent successfully")
-                    return True
+                    self._publish(SMS_SENT, {
+                        "number": number,
+                        "text": published_text,
+                        "status": "sent",
+                        "reference": reference
+                    })
+                    # For long messages this is the last part's reference
+                    return {"modem": self.port, "reference": reference}
                 except Exception as e:
+                    self.network_cache.invalidate(str(e))
+                    self._poller_wake.set()
                     if "CMS 500" in str(e):
                         logger.warning("CMS 500 error, retrying...")
+                        CMS500_RETRIES.inc()
                         time.sleep(2)  # Wait before retry
                         continue
                     raise  # Re-raise if it's a different error
@@ -150,6 +386,13 @@ class ModemHandler:
             
         except Exception as e:
             logger.error("Failed to send SMS: %s", str(e), exc_info=True)
+            OPERATION_ERRORS.labels('send_sms').inc()
+            self._publish(SMS_SENT, {
+                "number": number,
+                "text": published_text,
+                "status": "failed",
+                "error": str(e)
+            })
             raise
         
         # try:
@@ -167,30 +410,49 @@ class ModemHandler:
             logger.info("From: %s", sms.number)
             logger.info("Time: %s", sms.time)
             logger.info("Message: %s", sms.text)
+            self.received_count += 1
             
             # Prepare data
             data = {
                 "number": sms.number,
                 "time": sms.time.isoformat() if hasattr(sms.time, 'isoformat') else str(sms.time),
-                "text": sms.text
+                "text": sms.text,
+                "modem": self.port
             }
             
-            # Send to app.py REST endpoint
-            try:
-                response = requests.post('http://localhost:5000/forward_sms', json=data)
-                if response.status_code == 200:
-                    logger.info("SMS data forwarded successfully")
-                else:
-                    logger.error("Failed to forward SMS: %s", response.text)
-            except Exception as e:
-                logger.error("Error forwarding SMS: %s", str(e))
-            
+            # Parts of a long message are held until the rest arrive
+            info = concat_info(sms)
+            if info is not None and self.reassembler is not None:
+                logger.info("Part %d/%d of concatenated SMS %s", info[2], info[1], info[0])
+                self.reassembler.add(data, info)
+                return data
+
+            self.deliver_sms(data)
             return data
 
         except Exception as e:
             logger.error("Error handling SMS: %s", str(e))
             return None
 
+    def deliver_sms(self, data):
+        """Hand a complete inbound SMS to subscribers."""
+        if self.router is not None:
+            try:
+                routes = self.router.route(data)
+                if routes:
+                    logger.info("SMS from %s routed to %s", data.get('number'), ', '.join(routes))
+            except Exception as e:
+                # Deliver unrouted rather than lose the message
+                logger.error("Error routing SMS: %s", str(e), exc_info=True)
+        # Hand off to subscribers without blocking the modem read thread
+        if self.event_bus:
+            delivered = self.event_bus.publish(SMS_RECEIVED, data)
+            logger.info("SMS data published to %d subscriber(s)", delivered)
+        elif self.external_sms_callback:
+            self.external_sms_callback(data)
+
+    @timed(OPERATION_SECONDS, 'send_ussd')
+    @traced('send_ussd')
     def send_ussd(self, ussd_string):
         """Send a USSD command and get the response."""
         if not self.modem:
@@ -209,22 +471,73 @@ class ModemHandler:
             if response.sessionActive:
                 logger.info("USSD session active, canceling session")
                 response.cancel()
-                
-            return result
         except TimeoutException:
             logger.error("USSD request timed out for command: %s", ussd_string)
-            return {"status": "timeout", "response": "USSD request timed out"}
+            result = {"status": "timeout", "response": "USSD request timed out"}
         except Exception as e:
             logger.error("Error sending USSD command: %s - %s", ussd_string, str(e))
-            return {"status": "error", "response": str(e)}
+            result = {"status": "error", "response": str(e)}
 
+        result["modem"] = self.port
+        if result["status"] != "success":
+            OPERATION_ERRORS.labels('send_ussd').inc()
+
+        self._publish(USSD_EXCHANGE, {
+            "number": ussd_string,
+            "text": result["response"],
+            "status": result["status"]
+        })
+        return result
+
+    @timed(OPERATION_SECONDS, 'read_new_sms')
+    @traced('read_new_sms')
+    def read_new_sms(self):
+        """Read and delete only the storage indices announced by +CMTI."""
+        if not self.modem:
+            raise RuntimeError("Modem not connected")
+
+        count = 0
+        while self._new_sms:
+            memory, index = self._new_sms.popleft()
+            try:
+                sms = self.run(self._take_stored_sms, index, memory)
+            except Exception as e:
+                logger.error("Error reading stored SMS %s:%d: %s", memory, index, str(e))
+                continue
+            self.handle_sms(sms)
+            count += 1
+        return count
+
+    def _take_stored_sms(self, index, memory):
+        sms = self.modem.readStoredSms(index, memory)
+        self.modem.deleteStoredSms(index, memory)
+        return sms
+
+    def stored_sms_count(self):
+        """Number of messages in the preferred storage, from AT+CPMS?."""
+        for line in self.run(self.modem.write, 'AT+CPMS?'):
+            if line.startswith('+CPMS:'):
+                return int(line[6:].split(',')[1])
+        return None
+
+    @timed(OPERATION_SECONDS, 'process_stored_sms')
+    @traced('process_stored_sms')
     def process_stored_sms(self):
-        """Process any stored SMS messages."""
+        """Process unread stored SMS messages; returns how many were handled."""
         if not self.modem:
             raise RuntimeError("Modem not connected")
         
         try:
-            self.modem.processStoredSms(True)
+            try:
+                if self.stored_sms_count() == 0:
+                    return 0
+            except Exception as e:
+                logger.debug("Storage occupancy check failed: %s", str(e))
+
+            before = self.received_count
+            self.run(self.modem.processStoredSms, True)
+            return self.received_count - before
         except Exception as e:
             logger.error("Error processing stored SMS: %s", str(e))
+            OPERATION_ERRORS.labels('process_stored_sms').inc()
             raise
\ No newline at end of file
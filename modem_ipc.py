@@ -0,0 +1,343 @@
+# modem_ipc.py
+"""Framed IPC between web workers and the modem daemon over a Unix socket."""
+from threading import Event, Lock, Thread
+import json
+import logging
+import socket
+import struct
+import time
+
+logger = logging.getLogger(__name__)
+
+# Every frame is a 4-byte big-endian length followed by compact JSON:
+#   request  {"i": id, "m": method, "a": [args], "k": {kwargs}}
+#   reply    {"i": id, "r": result} or {"i": id, "e": message, "k": exception class}
+# Replies come back in completion order and are matched to requests by id;
+# a request without an id is answered before the next one is read
+#   event    {"t": topic, "d": data, "w": true for the one worker that handles it}
+HEADER = struct.Struct('>I')
+MAX_FRAME = 16 * 1024 * 1024
+
+SUBSCRIBE = 'subscribe'
+
+
+class ModemDaemonError(RuntimeError):
+    """The daemon failed to run a call."""
+
+
+class ModemDaemonUnavailable(ModemDaemonError):
+    """The daemon socket could not be reached."""
+
+
+# Exceptions re-raised with their own type so callers can keep catching them
+_REMOTE_ERRORS = {
+    'ValueError': ValueError,
+    'KeyError': KeyError,
+    'RuntimeError': RuntimeError
+}
+
+
+def encode_frame(obj):
+    body = json.dumps(obj, separators=(',', ':'), default=str).encode('utf-8')
+    return HEADER.pack(len(body)) + body
+
+
+def send_frame(sock, obj):
+    sock.sendall(encode_frame(obj))
+
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def recv_frame(sock):
+    """Read one frame; returns None when the peer closed the connection."""
+    header = _recv_exact(sock, HEADER.size)
+    if header is None:
+        return None
+    size, = HEADER.unpack(header)
+    if size > MAX_FRAME:
+        raise ModemDaemonError("Frame of {0} bytes exceeds the limit".format(size))
+    body = _recv_exact(sock, size)
+    if body is None:
+        return None
+    return json.loads(body.decode('utf-8'))
+
+
+class _PendingCall:
+    def __init__(self):
+        self.event = Event()
+        self.reply = None  # stays None if the connection is lost
+
+
+class ModemClient:
+    def __init__(self, path, timeout=60):
+        """
+        Initialize the client.
+
+        All calls share one connection and are matched to their replies by
+        id, so any number can be in flight without a socket or thread each.
+        Under eventlet or gevent a waiting call only parks its greenlet.
+
+        Args:
+            path: Unix socket the daemon listens on
+            timeout: Seconds to wait for a reply
+        """
+        self.path = path
+        self.timeout = timeout
+        self._sock = None
+        self._pending = {}  # request id -> _PendingCall
+        self._next_id = 0
+        self._lock = Lock()
+        self._send_lock = Lock()
+        self._stop = Event()
+        self._stream_thread = None
+
+    def _connect(self, timeout):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(self.path)
+        except (OSError, socket.error) as e:
+            sock.close()
+            raise ModemDaemonUnavailable(
+                "Modem daemon not reachable at {0}: {1}".format(self.path, str(e)))
+        return sock
+
+    def _connection(self):
+        # Caller holds _lock
+        if self._sock is None:
+            sock = self._connect(self.timeout)
+            sock.settimeout(None)  # the reader waits for replies indefinitely
+            self._sock = sock
+            reader = Thread(target=self._read_replies, args=(sock,),
+                            name='modem-daemon-replies')
+            reader.daemon = True
+            reader.start()
+        return self._sock
+
+    def _read_replies(self, sock):
+        reason = "closed by the daemon"
+        try:
+            while True:
+                reply = recv_frame(sock)
+                if reply is None:
+                    break
+                with self._lock:
+                    pending = self._pending.pop(reply.get('i'), None)
+                if pending is not None:  # None if the caller already timed out
+                    pending.reply = reply
+                    pending.event.set()
+        except Exception as e:
+            reason = str(e)
+        self._drop_connection(sock, reason)
+
+    def _drop_connection(self, sock, reason):
+        """Forget a broken connection and fail the calls waiting on it."""
+        with self._lock:
+            if self._sock is not sock:
+                return
+            self._sock = None
+            pending, self._pending = self._pending, {}
+        sock.close()
+        if not self._stop.is_set():
+            logger.warning("Modem daemon connection lost: %s", reason)
+        for call in pending.values():
+            call.event.set()
+
+    def call(self, method, *args, **kwargs):
+        """Run method in the daemon and return its result."""
+        pending = _PendingCall()
+        with self._lock:
+            sock = self._connection()
+            self._next_id += 1
+            request_id = self._next_id
+            self._pending[request_id] = pending
+        request = {'i': request_id, 'm': method, 'a': list(args)}
+        if kwargs:
+            request['k'] = kwargs
+        try:
+            with self._send_lock:
+                send_frame(sock, request)
+        except (OSError, socket.error) as e:
+            self._drop_connection(sock, str(e))
+
+        if not pending.event.wait(self.timeout):
+            with self._lock:
+                self._pending.pop(request_id, None)
+            raise ModemDaemonUnavailable("Modem daemon call {0} timed out after {1}s".format(
+                method, self.timeout))
+        reply = pending.reply
+        if reply is None:
+            raise ModemDaemonUnavailable("Modem daemon call {0} failed: connection lost".format(
+                method))
+        if 'e' in reply:
+            raise _REMOTE_ERRORS.get(reply.get('k'), ModemDaemonError)(reply['e'])
+        return reply.get('r')
+
+    def stats(self):
+        with self._lock:
+            return {
+                'connected': self._sock is not None,
+                'in_flight': len(self._pending),
+                'calls': self._next_id
+            }
+
+    def stream(self, handler, retry_interval=1):
+        """
+        Receive daemon events on a background thread, reconnecting as needed.
+
+        Args:
+            handler: Callable (topic, data, work) invoked for every event;
+                work is True on exactly one connected worker per event
+            retry_interval: Seconds between reconnection attempts
+        """
+        def _run():
+            while not self._stop.is_set():
+                try:
+                    sock = self._connect(self.timeout)
+                    send_frame(sock, {'m': SUBSCRIBE})
+                    sock.settimeout(None)
+                    logger.info("Subscribed to modem daemon events at %s", self.path)
+                    while True:
+                        frame = recv_frame(sock)
+                        if frame is None:
+                            break
+                        try:
+                            handler(frame['t'], frame['d'], frame.get('w', False))
+                        except Exception as e:
+                            logger.error("Daemon event handler failed: %s", str(e),
+                                         exc_info=True)
+                    sock.close()
+                    logger.warning("Modem daemon event stream closed")
+                except Exception as e:
+                    logger.warning("Modem daemon event stream error: %s", str(e))
+                self._stop.wait(retry_interval)
+
+        self._stream_thread = Thread(target=_run, name='modem-daemon-events')
+        self._stream_thread.daemon = True
+        self._stream_thread.start()
+
+    def close(self):
+        self._stop.set()
+        with self._lock:
+            sock = self._sock
+        if sock is not None:
+            self._drop_connection(sock, "client closed")
+
+
+class RemoteProxy:
+    """Forward method calls to an object the daemon exposes under prefix."""
+
+    def __init__(self, client, prefix):
+        self._client = client
+        self._prefix = prefix
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        method = '{0}.{1}'.format(self._prefix, name)
+        return lambda *args, **kwargs: self._client.call(method, *args, **kwargs)
+
+
+class RemoteModemPool(RemoteProxy):
+    """ModemPool stand-in used by web workers in split mode."""
+
+    def __init__(self, client):
+        RemoteProxy.__init__(self, client, 'modem')
+
+    def send_ussd(self, ussd_string, port=None):
+        return self._client.call('modem.send_ussd', ussd_string, port)
+
+    def check_network_status(self):
+        ok, message = self._client.call('modem.check_network_status')
+        return ok, message
+
+    def is_healthy(self):
+        try:
+            return self._client.call('modem.is_healthy')
+        except ModemDaemonUnavailable:
+            return False
+
+
+class RemoteSupervisor:
+    """ModemSupervisor stand-in; stats are cached briefly to keep probes cheap."""
+
+    def __init__(self, client, cache_ttl=1.0):
+        self._client = client
+        self.cache_ttl = cache_ttl
+        self._cached = None
+        self._cached_at = 0
+
+    def stats(self):
+        now = time.time()
+        if self._cached is None or now - self._cached_at > self.cache_ttl:
+            try:
+                self._cached = self._client.call('supervisor.stats')
+            except ModemDaemonUnavailable as e:
+                self._cached = {
+                    'state': 'unavailable',
+                    'ready': False,
+                    'last_error': str(e),
+                    'next_attempt_at': None
+                }
+            self._cached_at = now
+        return self._cached
+
+    @property
+    def ready(self):
+        return self.stats()['ready']
+
+    @property
+    def state(self):
+        return self.stats()['state']
+
+    def retry_after(self, default=5):
+        next_attempt_at = self.stats().get('next_attempt_at')
+        if next_attempt_at:
+            return max(1, int(next_attempt_at - time.time()) + 1)
+        return default
+
+
+class RemoteSmsQueue(RemoteProxy):
+    """SmsQueue stand-in; jobs are stored and sent by the daemon."""
+
+    def __init__(self, client, batch_chunk=1000):
+        """
+        Args:
+            client: ModemClient connected to the daemon
+            batch_chunk: Batch items sent to the daemon per call
+        """
+        RemoteProxy.__init__(self, client, 'queue')
+        self.batch_chunk = batch_chunk
+
+    def enqueue_batch(self, items, priority=None, client=None, transliterate=None):
+        # Streamed in bounded chunks so a large batch never sits whole in the
+        # worker or in one frame; the daemon queues it at close_batch
+        kwargs = {'client': client, 'transliterate': transliterate}
+        if priority is not None:
+            kwargs['priority'] = priority
+        batch_id = self._client.call('queue.open_batch', **kwargs)
+        try:
+            chunk = []
+            for number, message in items:
+                chunk.append((number, message))
+                if len(chunk) >= self.batch_chunk:
+                    self._client.call('queue.add_to_batch', batch_id, chunk)
+                    chunk = []
+            if chunk:
+                self._client.call('queue.add_to_batch', batch_id, chunk)
+        except Exception:
+            try:
+                self._client.call('queue.abort_batch', batch_id)
+            except Exception as e:
+                logger.warning("Could not abort SMS batch %s: %s", batch_id, str(e))
+            raise
+        return self._client.call('queue.close_batch', batch_id)
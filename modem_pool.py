@@ -0,0 +1,296 @@
+# modem_pool.py
+"""Pool of GSM modems sharing outbound traffic and inbound processing."""
+from threading import Event, Lock, Thread
+from modem_handler import ModemHandler
+from sms_reassembly import SmsReassembler
+from circuit_breaker import CircuitBreaker
+from modem_executor import ModemCallTimeout
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def is_modem_fault(error):
+    """False for errors about the message itself, which say nothing of the modem."""
+    # gsmmodem's CmsError carries type 'CMS'; CMS 500 is retried by send_sms
+    # and only surfaces here once those retries are exhausted
+    if getattr(error, 'type', None) == 'CMS' or type(error).__name__.endswith('CmsError'):
+        return False
+    return True
+
+
+class ModemPool:
+    def __init__(self, config, socketio, sms_callback=None, ports=None, event_bus=None,
+                 tracer=None, delivery_tracker=None, router=None):
+        """
+        Initialize the modem pool.
+
+        Args:
+            config: Configuration object
+            socketio: SocketIO instance passed to every ModemHandler
+            sms_callback: Callback for inbound SMS, shared by all modems
+            ports: Serial ports to manage (defaults to config.MODEM_PORTS)
+            event_bus: EventBus every modem publishes inbound SMS to
+            tracer: Optional ModemTracer shared by all modems
+            delivery_tracker: Optional DeliveryTracker receiving status reports
+            router: Optional SmsRouter tagging inbound SMS with their routes
+        """
+        self.config = config
+        ports = ports or getattr(config, 'MODEM_PORTS', None) or [config.MODEM_PORT]
+        # One reassembler for every modem so the memory cap covers the whole pool
+        self.reassembler = SmsReassembler(
+            self._deliver_reassembled,
+            timeout=getattr(config, 'SMS_REASSEMBLY_TIMEOUT', 120),
+            max_bytes=getattr(config, 'SMS_REASSEMBLY_MAX_BYTES', 256 * 1024)
+        )
+        self.handlers = [
+            ModemHandler(config, socketio, sms_callback=sms_callback, port=port,
+                         event_bus=event_bus, tracer=tracer,
+                         reassembler=self.reassembler,
+                         delivery_tracker=delivery_tracker, router=router)
+            for port in ports
+        ]
+        self._outstanding = dict((h.port, 0) for h in self.handlers)
+        # A modem whose breaker is open stays out of rotation until the
+        # supervisor's probe succeeds; sends fail fast in the meantime
+        self.breakers = dict(
+            (h.port, CircuitBreaker(getattr(config, 'MODEM_BREAKER_THRESHOLD', 3)))
+            for h in self.handlers)
+        self.call_timeout = getattr(config, 'MODEM_CALL_TIMEOUT', 45)
+        self._healthy = set()
+        self._state_lock = Lock()
+        self._stop = Event()
+        self._monitor = None
+        logger.info("ModemPool initialized with ports: %s", ', '.join(ports))
+
+    @property
+    def modem(self):
+        """First connected modem, for callers that only check connectivity."""
+        for handler in self.handlers:
+            if handler.modem:
+                return handler.modem
+        return None
+
+    def _set_healthy(self, handler, healthy):
+        with self._state_lock:
+            was_healthy = handler.port in self._healthy
+            if healthy:
+                self._healthy.add(handler.port)
+            else:
+                self._healthy.discard(handler.port)
+        if was_healthy and not healthy:
+            logger.warning("Modem %s taken out of rotation", handler.port)
+        elif healthy and not was_healthy:
+            logger.info("Modem %s put into rotation", handler.port)
+
+    def in_rotation(self, handler):
+        with self._state_lock:
+            return handler.port in self._healthy
+
+    def take_out(self, handler, reason):
+        """Open the modem's breaker and stop routing work to it."""
+        self.breakers[handler.port].trip(reason)
+        self._set_healthy(handler, False)
+
+    def put_back(self, handler):
+        """Close the modem's breaker after a successful probe."""
+        self.breakers[handler.port].reset()
+        self._set_healthy(handler, True)
+
+    def connect(self):
+        """Connect idle modems in parallel; succeed if at least one is up."""
+        results = dict((h.port, True) for h in self.handlers if h.modem)
+        # Each modem connects on its own I/O thread, so they proceed in parallel
+        calls = [(h.port, h.executor.submit(h.connect))
+                 for h in self.handlers if not h.modem]
+        for port, call in calls:
+            results[port] = call.result()
+
+        for handler in self.handlers:
+            if not results.get(handler.port):
+                logger.error("Failed to connect modem on %s", handler.port)
+        return any(results.values())
+
+    def wait_for_network(self, timeout=30):
+        """Wait for network registration on every connected modem."""
+        registered = False
+        for handler in self.handlers:
+            if handler.modem and handler.run(handler.wait_for_network, timeout):
+                registered = True
+        return registered
+
+    def check_network_status(self):
+        """Refresh health of every modem and summarize the pool."""
+        messages = []
+        for handler in self.handlers:
+            ok, message = handler.run(handler.check_network_status)
+            self._set_healthy(handler, ok and self.breakers[handler.port].closed)
+            messages.append("{0}: {1}".format(handler.port, message))
+
+        with self._state_lock:
+            healthy = len(self._healthy)
+        summary = "{0}/{1} modems healthy ({2})".format(
+            healthy, len(self.handlers), '; '.join(messages))
+        return healthy > 0, summary
+
+    def is_healthy(self):
+        """True if at least one modem is in rotation (no serial I/O)."""
+        with self._state_lock:
+            return bool(self._healthy)
+
+    def _acquire(self, port=None):
+        """Reserve the healthy modem with the least outstanding work."""
+        with self._state_lock:
+            candidates = [h for h in self.handlers if h.port in self._healthy]
+            if port:
+                candidates = [h for h in candidates if h.port == port]
+            if not candidates:
+                raise RuntimeError("No healthy modem available")  # fail fast
+            handler = min(candidates, key=lambda h: self._outstanding[h.port])
+            self._outstanding[handler.port] += 1
+        return handler
+
+    def _release(self, handler):
+        with self._state_lock:
+            self._outstanding[handler.port] -= 1
+
+    def _record_failure(self, handler, error):
+        breaker = self.breakers[handler.port]
+        if breaker.record_failure(str(error)):
+            logger.warning("Circuit opened for modem %s after %d failures: %s",
+                           handler.port, breaker.failures, str(error))
+            self._set_healthy(handler, False)
+
+    def _submit(self, operation, port=None):
+        """Queue operation(handler) on the I/O thread of the least busy healthy modem."""
+        return self._submit_to(self._acquire(port), operation)
+
+    def _submit_to(self, handler, operation):
+        def _finished(call):
+            self._release(handler)
+            error = call.exception()
+            if error is None:
+                self.breakers[handler.port].record_success()
+            elif is_modem_fault(error):
+                self._record_failure(handler, error)
+
+        call = handler.executor.submit(operation, handler)
+        call.add_done_callback(_finished)
+        return call
+
+    def _run(self, operation, port=None):
+        handler = self._acquire(port)
+        call = self._submit_to(handler, operation)
+        try:
+            return call.result(self.call_timeout)
+        except ModemCallTimeout as e:
+            # A wedged modem thread never finishes the call; without this the
+            # breaker would never hear of it
+            self._record_failure(handler, e)
+            raise
+
+    def send_sms(self, number, message, sensitive=False):
+        """Send an SMS through the least busy healthy modem."""
+        return self._run(lambda h: h.send_sms(number, message, sensitive))
+
+    def send_ussd(self, ussd_string, port=None):
+        """Send a USSD command, optionally on a specific modem."""
+        return self._run(lambda h: h.send_ussd(ussd_string), port)
+
+    def submit_ussd(self, ussd_string, port=None):
+        """Like send_ussd, but return the pending ModemCall without waiting."""
+        return self._submit(lambda h: h.send_ussd(ussd_string), port)
+
+    def read_new_sms(self):
+        """Read messages announced by +CMTI on every connected modem."""
+        return self._drain(lambda h: h.read_new_sms())
+
+    def process_stored_sms(self):
+        """Drain unread stored SMS from every connected modem."""
+        return self._drain(lambda h: h.process_stored_sms())
+
+    def _drain(self, operation):
+        count = 0
+        for handler in self.handlers:
+            if not handler.modem:
+                continue
+            try:
+                count += operation(handler)
+            except Exception as e:
+                logger.error("Error processing stored SMS on %s: %s",
+                             handler.port, str(e))
+                self._set_healthy(handler, False)
+        return count
+
+    def _deliver_reassembled(self, data):
+        for handler in self.handlers:
+            if handler.port == data.get('modem'):
+                handler.deliver_sms(data)
+                return
+        self.handlers[0].deliver_sms(data)
+
+    def reassembly_stats(self):
+        """Concatenated SMS reassembly counters."""
+        return self.reassembler.stats()
+
+    def pending_new_sms(self):
+        """+CMTI notifications not yet read, per modem."""
+        return dict((h.port, len(h._new_sms)) for h in self.handlers)
+
+    def status(self):
+        """Per-modem health and load snapshot."""
+        with self._state_lock:
+            return [{
+                'port': h.port,
+                'device': h.device,
+                'connected': h.modem is not None,
+                'healthy': h.port in self._healthy,
+                'outstanding': self._outstanding[h.port],
+                'breaker': self.breakers[h.port].stats(),
+                'executor': h.executor.stats()
+            } for h in self.handlers]
+
+    def network_status(self):
+        """Cached network state of every modem, without touching serial."""
+        return [dict(port=h.port, connected=h.modem is not None,
+                     **h.network_cache.snapshot())
+                for h in self.handlers]
+
+    def start_monitor(self, interval=None):
+        """Start the background health monitor."""
+        if self._monitor:
+            return
+        interval = interval or self.config.MODEM_HEALTH_INTERVAL
+        self._stop.clear()
+        self._monitor = Thread(target=self._monitor_loop, args=(interval,),
+                               name='modem-pool-monitor')
+        self._monitor.daemon = True
+        self._monitor.start()
+
+    def _monitor_loop(self, interval):
+        while not self._stop.wait(interval):
+            for handler in self.handlers:
+                # Disconnected modems and open breakers are the supervisor's
+                if not handler.modem or not self.breakers[handler.port].closed:
+                    continue
+                try:
+                    ok, message = handler.run(handler.check_network_status)
+                    if not ok:
+                        logger.warning("Modem %s unhealthy: %s", handler.port, message)
+                    self._set_healthy(handler, ok)
+                except Exception as e:
+                    logger.error("Health check failed for %s: %s", handler.port, str(e))
+                    self.take_out(handler, str(e))
+
+    def disconnect(self):
+        """Stop monitoring and disconnect every modem."""
+        self._stop.set()
+        if self._monitor:
+            self._monitor.join(timeout=5)
+            self._monitor = None
+        for handler in self.handlers:
+            handler.disconnect()
+            handler.executor.stop()
+            self._set_healthy(handler, False)
+        # Nothing more will arrive; deliver incomplete messages rather than lose them
+        self.reassembler.close()
@@ -0,0 +1,281 @@
+# modem_service.py
+"""The modem-owning side of the gateway: pool, bring-up, stored SMS and outbound queue."""
+from modem_pool import ModemPool
+from modem_handler import list_devices
+from modem_supervisor import ModemSupervisor
+from sms_queue import SmsQueue
+from sms_scheduler import StoredSmsScheduler
+from delivery_reports import DeliveryTracker
+from webhooks import WebhookDispatcher
+from sms_router import SmsRouter
+from rate_limit import RateLimiter
+from event_bus import (SMS_RECEIVED, SMS_SENT, SMS_NOTIFIED, SMS_STATUS,
+                       SMS_BATCH_STATUS, SMS_DELIVERY, USSD_EXCHANGE)
+import metrics
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def initialize_modem(handler):
+    """One bring-up attempt; run by the supervisor off the request path."""
+    logger.info("Initializing modems on %s...", ', '.join(h.port for h in handler.handlers))
+
+    # Try to connect
+    if not handler.connect():
+        logger.error("Failed to connect to any modem")
+        return False
+
+    # Wait for network
+    if not handler.wait_for_network():
+        logger.error("Failed to register with network")
+        return False
+
+    # Check network status
+    status_ok, message = handler.check_network_status()
+    if not status_ok:
+        logger.error("Network status check failed: %s", message)
+        return False
+
+    logger.info("Modem initialized successfully: %s", message)
+    return True
+
+
+class ModemService:
+    def __init__(self, config, event_bus, message_store=None, tracer=None, socketio=None):
+        """
+        Build the components that must live in the process owning the serial ports.
+
+        Args:
+            config: Configuration object
+            event_bus: Bus receiving modem events, job and batch status updates
+            message_store: Optional MessageStore recording every exchange
+            tracer: Optional ModemTracer attached to every modem
+            socketio: SocketIO instance handed to the ModemHandlers, if any
+        """
+        self.config = config
+        self.event_bus = event_bus
+        self.tracer = tracer
+
+        # Status reports arrive on the modem read thread; results go out on the bus
+        self.delivery_tracker = None
+        if config.SMS_DELIVERY_REPORTS:
+            self.delivery_tracker = DeliveryTracker(
+                lambda delivery: event_bus.publish(SMS_DELIVERY, delivery),
+                ttl=config.SMS_DELIVERY_REPORT_TTL,
+                max_tracked=config.SMS_DELIVERY_MAX_TRACKED,
+                sweep_interval=config.SMS_DELIVERY_SWEEP_INTERVAL,
+                early_window=config.SMS_DELIVERY_EARLY_WINDOW
+            )
+
+        # Inbound SMS are tagged with their routes before anyone sees them
+        self.router = None
+        if config.SMS_ROUTES_FILE:
+            self.router = SmsRouter(config.SMS_ROUTES_FILE,
+                                    reload_interval=config.SMS_ROUTES_RELOAD_INTERVAL)
+
+        # The pool is created without touching serial; bring-up runs in the background
+        self.pool = ModemPool(
+            config=config,
+            socketio=socketio,
+            event_bus=event_bus,  # Inbound SMS are published here
+            tracer=tracer,
+            delivery_tracker=self.delivery_tracker,
+            router=self.router
+        )
+        self.supervisor = ModemSupervisor(
+            self.pool,
+            initialize_modem,
+            retry_interval=config.MODEM_INIT_RETRY_INTERVAL,
+            max_retry_interval=config.MODEM_INIT_MAX_RETRY_INTERVAL,
+            on_ready=self._on_modem_ready,
+            check_interval=config.MODEM_HOTPLUG_INTERVAL,
+            reconnect_interval=config.MODEM_RECONNECT_INTERVAL,
+            max_reconnect_interval=config.MODEM_RECONNECT_MAX_INTERVAL,
+            down_after=config.MODEM_DOWN_AFTER,
+            list_devices=lambda: list_devices(config),
+            on_recover=lambda handler: self.scheduler.modem_ready(handler)
+        )
+
+        # Stored SMS are processed from startup, driven by +CMTI notifications
+        self.scheduler = StoredSmsScheduler(
+            lambda: self.pool,
+            min_interval=config.SMS_POLL_MIN_INTERVAL,
+            max_interval=config.SMS_POLL_MAX_INTERVAL,
+            backoff=config.SMS_POLL_BACKOFF
+        )
+        event_bus.subscribe(SMS_NOTIFIED, self.scheduler.notify)
+
+        self.queue = SmsQueue(
+            self.pool,
+            config.SMS_QUEUE_DB,
+            max_attempts=config.SMS_QUEUE_MAX_ATTEMPTS,
+            retry_delay=config.SMS_QUEUE_RETRY_DELAY,
+            status_callback=lambda job: event_bus.publish(SMS_STATUS, job),
+            workers=config.SMS_QUEUE_WORKERS or len(config.MODEM_PORTS),
+            batch_callback=lambda batch: event_bus.publish(SMS_BATCH_STATUS, batch),
+            is_ready=lambda: self.supervisor.ready,
+            client_weights=config.SMS_CLIENT_WEIGHTS,
+            transliterate=config.SMS_TRANSLITERATE,
+            strip_accents=config.SMS_TRANSLITERATE_ACCENTS,
+            delivery_tracker=self.delivery_tracker
+        )
+        if self.delivery_tracker is not None:
+            event_bus.subscribe(SMS_DELIVERY, self.queue.record_delivery)
+
+        # Webhooks live here so a single process owns the retry spool
+        self.webhooks = None
+        if config.WEBHOOKS:
+            self.webhooks = WebhookDispatcher(
+                config.WEBHOOKS,
+                config.WEBHOOK_SPOOL_DIR,
+                concurrency=config.WEBHOOK_CONCURRENCY,
+                batch_size=config.WEBHOOK_BATCH_SIZE,
+                batch_window=config.WEBHOOK_BATCH_WINDOW,
+                timeout=config.WEBHOOK_TIMEOUT,
+                retry_base=config.WEBHOOK_RETRY_BASE,
+                retry_max=config.WEBHOOK_RETRY_MAX,
+                max_age=config.WEBHOOK_MAX_AGE
+            )
+            event_bus.subscribe(SMS_RECEIVED, self.webhooks.publish, name='webhooks')
+
+        # Send limits live here so every web worker draws from the same buckets
+        self.send_code_limiter = RateLimiter()
+        for scope, (count, period) in (('phone', config.SEND_CODE_LIMIT_PER_PHONE),
+                                       ('ip', config.SEND_CODE_LIMIT_PER_IP),
+                                       ('global', config.SEND_CODE_LIMIT_GLOBAL)):
+            self.send_code_limiter.add_limit(scope, float(count) / period, count)
+        # Charged per SMS part, so a long or UCS-2 message costs what it costs the modem
+        self.send_sms_limiter = RateLimiter()
+        if config.SEND_SMS_SEGMENT_LIMIT_PER_CLIENT:
+            count, period = config.SEND_SMS_SEGMENT_LIMIT_PER_CLIENT
+            self.send_sms_limiter.add_limit('client', float(count) / period, count)
+
+        if message_store is not None:
+            event_bus.subscribe(SMS_RECEIVED, message_store.record_inbound)
+            event_bus.subscribe(SMS_SENT, message_store.record_outbound)
+            event_bus.subscribe(USSD_EXCHANGE, message_store.record_ussd)
+
+        metrics.gauge('sms_queue_depth', 'Outbound SMS jobs waiting for a worker',
+                      func=self.queue.depth)
+        metrics.gauge('sms_queue_class_depth', 'Outbound SMS jobs waiting per priority class',
+                      ['priority'],
+                      func=lambda: dict((p, s['depth']) for p, s in self.queue.stats().items()))
+        metrics.gauge('stored_sms_pending_notifications',
+                      'New-message notifications not yet read',
+                      ['modem'], func=self.pool.pending_new_sms)
+        metrics.gauge('stored_sms_seconds_since_pass', 'Seconds since the last stored SMS pass',
+                      func=lambda: time.time() - self.scheduler.last_pass
+                      if self.scheduler.last_pass else None)
+        metrics.gauge('stored_sms_poll_interval_seconds', 'Current fallback polling interval',
+                      func=lambda: self.scheduler.interval)
+        metrics.gauge('sms_reassembly_pending', 'Concatenated SMS waiting for missing parts',
+                      func=lambda: self.pool.reassembler.stats()['pending'])
+        if self.delivery_tracker is not None:
+            metrics.gauge('sms_delivery_pending', 'Sent messages waiting for a status report',
+                          func=lambda: self.delivery_tracker.stats()['pending'])
+        metrics.gauge('modem_ready', '1 when a modem is registered and in rotation',
+                      func=lambda: 1 if self.supervisor.ready else 0)
+        metrics.gauge('modem_breaker_open', '1 while a modem is failed fast by its breaker',
+                      ['modem'],
+                      func=lambda: dict((port, 0 if b.closed else 1)
+                                        for port, b in self.pool.breakers.items()))
+
+    def _on_modem_ready(self, pool):
+        pool.start_monitor()
+        # SMS stored on the SIM before startup are read now, not at the next poll
+        self.scheduler.modem_ready(pool)
+
+    def start(self):
+        self.supervisor.start()
+        self.scheduler.start()
+        self.queue.start()
+        if self.delivery_tracker is not None:
+            self.delivery_tracker.start()
+        if self.webhooks is not None:
+            self.webhooks.start()
+        if self.router is not None:
+            self.router.start()
+
+    def stop(self):
+        self.supervisor.stop()
+        self.scheduler.stop()
+        self.queue.stop()
+        if self.delivery_tracker is not None:
+            self.delivery_tracker.stop()
+        if self.webhooks is not None:
+            self.webhooks.stop()
+        if self.router is not None:
+            self.router.stop()
+        self.pool.disconnect()
+
+    def delivery_stats(self):
+        """Status report matching counters, or None when reports are off."""
+        if self.delivery_tracker is None:
+            return None
+        return self.delivery_tracker.stats()
+
+    def webhook_stats(self):
+        """Per-endpoint webhook counters; empty when none are configured."""
+        if self.webhooks is None:
+            return {}
+        return self.webhooks.stats()
+
+    def route_stats(self, limit=None):
+        """Routing counters and per-rule hits, or None when routing is off."""
+        if self.router is None:
+            return None
+        return dict(self.router.stats(), hits=self.router.hits(limit))
+
+    def reload_routes(self):
+        """Reload the routing rules now; returns the new stats."""
+        if self.router is None:
+            raise RuntimeError("SMS routing is not configured")
+        if not self.router.reload():
+            raise ValueError(self.router.last_error)
+        return self.router.stats()
+
+    def methods(self):
+        """Calls the modem daemon serves to web workers, by name."""
+        methods = {
+            'modem.send_sms': self.pool.send_sms,
+            'modem.send_ussd': self.pool.submit_ussd,  # replied to when the modem answers
+            'modem.check_network_status': self.pool.check_network_status,
+            'modem.is_healthy': self.pool.is_healthy,
+            'modem.status': self.pool.status,
+            'modem.network_status': self.pool.network_status,
+            'modem.pending_new_sms': self.pool.pending_new_sms,
+            'modem.reassembly_stats': self.pool.reassembly_stats,
+            'supervisor.stats': self.supervisor.stats,
+            'queue.enqueue': self.queue.enqueue,
+            'queue.enqueue_batch': self.queue.enqueue_batch,
+            'queue.open_batch': self.queue.open_batch,
+            'queue.add_to_batch': self.queue.add_to_batch,
+            'queue.close_batch': self.queue.close_batch,
+            'queue.abort_batch': self.queue.abort_batch,
+            'queue.get_job': self.queue.get_job,
+            'queue.get_batch': self.queue.get_batch,
+            'queue.depth': self.queue.depth,
+            'queue.stats': self.queue.stats,
+            'scheduler.stats': self.scheduler.stats,
+            'delivery.stats': self.delivery_stats,
+            'webhooks.stats': self.webhook_stats,
+            'routes.stats': self.route_stats,
+            'routes.reload': self.reload_routes,
+            'send_code_limiter.check': self.send_code_limiter.check,
+            'send_code_limiter.stats': self.send_code_limiter.stats,
+            'send_sms_limiter.check': self.send_sms_limiter.check,
+            'send_sms_limiter.stats': self.send_sms_limiter.stats,
+            'bus.publish': self.event_bus.publish,
+            'metrics.render': metrics.REGISTRY.render
+        }
+        if self.tracer is not None:
+            methods.update({
+                'trace.dump_jsonl': self.tracer.dump_jsonl,
+                'trace.dump_chrome': self.tracer.dump_chrome,
+                'trace.stats': self.tracer.stats,
+                'trace.set_enabled': self.tracer.set_enabled,
+                'trace.clear': self.tracer.clear
+            })
+        return methods
@@ -0,0 +1,317 @@
+# modem_supervisor.py
+"""Modem bring-up, recovery and readiness tracking."""
+from threading import Event, Lock, Thread
+import logging
+import os
+import random
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+STATE_STARTING = 'starting'
+STATE_HEALTHY = 'healthy'  # every modem in rotation
+STATE_DEGRADED = 'degraded'  # some modems in rotation
+STATE_RECONNECTING = 'reconnecting'  # none in rotation, recovery under way
+STATE_DOWN = 'down'  # none in rotation, devices gone or recovery keeps failing
+STATE_STOPPED = 'stopped'
+READY_STATES = (STATE_HEALTHY, STATE_DEGRADED)
+
+RECONNECTS = metrics.counter(
+    'modem_reconnects_total', 'Modem recovery attempts by outcome', ['modem', 'result'])
+HOTPLUG_EVENTS = metrics.counter(
+    'modem_hotplug_events_total', 'Modem devices seen disappearing or appearing',
+    ['modem', 'event'])
+
+
+def backoff(attempts, base, maximum):
+    """Exponential delay with full jitter for the given failed attempt count."""
+    return random.uniform(0, min(maximum, base * 2 ** max(0, attempts - 1)))
+
+
+class _Recovery:
+    def __init__(self):
+        self.attempts = 0
+        self.next_attempt = 0
+        self.call = None  # ModemCall of the attempt in progress
+        self.last_error = None
+        self.baseline = None  # devices present when this modem's device went missing
+        self.tried = set()  # re-enumeration candidates that did not work
+
+
+class ModemSupervisor:
+    def __init__(self, handler, initialize, retry_interval=5, max_retry_interval=60,
+                 on_ready=None, check_interval=1, reconnect_interval=1,
+                 max_reconnect_interval=30, down_after=5, list_devices=None,
+                 on_recover=None):
+        """
+        Initialize the supervisor.
+
+        Args:
+            handler: ModemPool (or ModemHandler) to bring up
+            initialize: Callable (handler) -> bool performing one bring-up attempt
+            retry_interval: Seconds before the first retry; doubles on each failure
+            max_retry_interval: Upper bound for the retry interval
+            on_ready: Optional callable (handler) invoked once bring-up succeeds
+            check_interval: Seconds between device presence checks once up
+            reconnect_interval: Base delay between reconnects of one modem
+            max_reconnect_interval: Upper bound for the reconnect delay
+            down_after: Failed reconnects of every modem before the state is 'down'
+            list_devices: Optional callable returning candidate device paths,
+                used to find a modem re-enumerated under another name
+            on_recover: Optional callable (modem handler) invoked when one
+                modem is back in rotation after a recovery
+        """
+        self.handler = handler
+        self.initialize = initialize
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self.on_ready = on_ready
+        self.check_interval = check_interval
+        self.reconnect_interval = reconnect_interval
+        self.max_reconnect_interval = max_reconnect_interval
+        self.down_after = down_after
+        self.list_devices = list_devices
+        self.on_recover = on_recover
+        self.state = STATE_STARTING
+        self.attempts = 0
+        self.last_error = None
+        self.started_at = None
+        self.ready_at = None
+        self.next_attempt_at = None
+        self.transitions = []  # (time, state), most recent last
+        self._handlers = getattr(handler, 'handlers', [handler])
+        self._recovery = dict((h.port, _Recovery()) for h in self._handlers)
+        self._known_devices = set()
+        self._lock = Lock()
+        self._stop = Event()
+        self._thread = None
+
+    @property
+    def ready(self):
+        """True while at least one modem is registered and in rotation."""
+        return self.state in READY_STATES and self.handler.is_healthy()
+
+    def retry_after(self, default=5):
+        """Seconds a client should wait before retrying a modem request."""
+        if self.next_attempt_at:
+            return max(1, int(self.next_attempt_at - time.time()) + 1)
+        return default
+
+    def start(self):
+        """Start bring-up in a background thread and return immediately."""
+        if self._thread:
+            return
+        self.started_at = time.time()
+        self._thread = Thread(target=self._run, name='modem-supervisor')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._set_state(STATE_STOPPED)
+
+    def _set_state(self, state):
+        if state == self.state:
+            return
+        logger.info("Modem supervisor: %s -> %s", self.state, state)
+        self.state = state
+        self.transitions = (self.transitions + [(time.time(), state)])[-20:]
+
+    def _run(self):
+        if self._bring_up():
+            self._known_devices = set(self._devices())
+            self._watch()
+
+    def _bring_up(self):
+        delay = self.retry_interval
+        while not self._stop.is_set():
+            self.attempts += 1
+            self.next_attempt_at = None
+            logger.info("Attempting modem initialization (attempt %d)", self.attempts)
+            try:
+                ok = self.initialize(self.handler)
+                self.last_error = None if ok else 'initialization failed'
+            except Exception as e:
+                logger.error("Error initializing modem: %s", str(e), exc_info=True)
+                ok = False
+                self.last_error = str(e)
+
+            if ok:
+                self.ready_at = time.time()
+                self._update_state()
+                logger.info("Modem ready after %.1f seconds (%d attempt(s))",
+                            self.ready_at - self.started_at, self.attempts)
+                if self.on_ready:
+                    self.on_ready(self.handler)
+                return True
+
+            self._set_state(STATE_DOWN if self.attempts >= self.down_after
+                            else STATE_RECONNECTING)
+            self.next_attempt_at = time.time() + delay
+            logger.warning("Initialization attempt failed, retrying in %s seconds...", delay)
+            if self._stop.wait(delay):
+                return False
+            delay = min(delay * 2, self.max_retry_interval)
+        return False
+
+    # Steady state: watch devices and recover modems that drop out
+
+    def _watch(self):
+        while not self._stop.wait(self.check_interval):
+            try:
+                self._known_devices = set(self._devices())
+                for handler in self._handlers:
+                    self._check(handler)
+                self._update_state()
+            except Exception as e:
+                logger.error("Modem supervision pass failed: %s", str(e), exc_info=True)
+
+    def _devices(self):
+        if not self.list_devices:
+            return []
+        try:
+            return self.list_devices()
+        except Exception as e:
+            logger.warning("Could not list modem devices: %s", str(e))
+            return []
+
+    def _in_rotation(self, handler):
+        in_rotation = getattr(self.handler, 'in_rotation', None)
+        return in_rotation(handler) if in_rotation else self.handler.is_healthy()
+
+    def _take_out(self, handler, reason):
+        take_out = getattr(self.handler, 'take_out', None)
+        if take_out:
+            take_out(handler, reason)
+
+    def _check(self, handler):
+        recovery = self._recovery[handler.port]
+        busy = recovery.call is not None and not recovery.call.done()
+        if handler.modem is not None and not busy and not handler.device_present():
+            # Unplugged: stop sending to it now rather than after timeouts
+            logger.warning("Modem device %s for %s disappeared", handler.device, handler.port)
+            HOTPLUG_EVENTS.labels(handler.port, 'removed').inc()
+            self._take_out(handler, 'device removed')
+            # Closed on the modem's I/O thread, after any call using the port
+            recovery.call = handler.executor.submit(handler.disconnect)
+            recovery.next_attempt = 0
+
+        if self._in_rotation(handler):
+            recovery.attempts = 0
+            return
+        if recovery.call is not None and not recovery.call.done():
+            return
+
+        if not handler.device_present():
+            if recovery.baseline is None:
+                recovery.baseline = set(self._known_devices)
+            device = self._find_device(handler, recovery)
+            if device is None:
+                return
+            HOTPLUG_EVENTS.labels(handler.port, 'added').inc()
+            if device != handler.device:
+                logger.info("Modem %s re-enumerated as %s", handler.port, device)
+            handler.device = device
+            recovery.next_attempt = 0  # it just came back; try right away
+
+        if time.time() < recovery.next_attempt:
+            return
+        # Recovery runs on the modem's own I/O thread, so one stuck modem
+        # never delays the others
+        recovery.call = handler.executor.submit(self._recover, handler, recovery)
+
+    def _find_device(self, handler, recovery):
+        """The configured device if it is back, else a newly appeared one not in use."""
+        if handler.device != handler.port and handler.device_present(handler.port):
+            return handler.port
+        in_use = set(os.path.realpath(h.device) for h in self._handlers
+                     if h is not handler and h.modem is not None)
+        # A modem exposes several ports; try each new one in turn
+        candidates = [d for d in sorted(self._known_devices - recovery.baseline)
+                      if os.path.realpath(d) not in in_use]
+        untried = [d for d in candidates if d not in recovery.tried]
+        if not untried:
+            recovery.tried.clear()
+            untried = candidates
+        if not untried:
+            return None
+        recovery.tried.add(untried[0])
+        return untried[0]
+
+    def _recover(self, handler, recovery):
+        """Reconnect or re-probe one modem; runs on the modem's I/O thread."""
+        try:
+            if handler.modem is None:
+                logger.info("Reconnecting modem %s on %s", handler.port, handler.device)
+                if not handler.connect():
+                    raise RuntimeError("connect failed")
+            ok, message = handler.refresh_network_status()
+            if not ok:
+                raise RuntimeError(message)
+        except Exception as e:
+            recovery.attempts += 1
+            recovery.last_error = str(e)
+            if handler.modem is not None and recovery.attempts >= 2:
+                # Probing a live handle keeps failing; start over from a fresh open
+                handler.disconnect()
+            delay = backoff(recovery.attempts, self.reconnect_interval,
+                            self.max_reconnect_interval)
+            recovery.next_attempt = time.time() + delay
+            RECONNECTS.labels(handler.port, 'failed').inc()
+            logger.warning("Modem %s recovery attempt %d failed (%s), next in %.1fs",
+                           handler.port, recovery.attempts, str(e), delay)
+            return
+
+        put_back = getattr(self.handler, 'put_back', None)
+        if put_back:
+            put_back(handler)
+        recovery.attempts = 0
+        recovery.last_error = None
+        recovery.baseline = None
+        recovery.tried.clear()
+        RECONNECTS.labels(handler.port, 'recovered').inc()
+        logger.info("Modem %s recovered", handler.port)
+        self._update_state()
+        if self.on_recover:
+            self.on_recover(handler)
+
+    def _update_state(self):
+        with self._lock:
+            if self._stop.is_set():
+                return
+            in_rotation = [h for h in self._handlers if self._in_rotation(h)]
+            if len(in_rotation) == len(self._handlers):
+                state = STATE_HEALTHY
+            elif in_rotation:
+                state = STATE_DEGRADED
+            elif all(not h.device_present() or
+                     self._recovery[h.port].attempts >= self.down_after
+                     for h in self._handlers):
+                state = STATE_DOWN
+            else:
+                state = STATE_RECONNECTING
+            if state in READY_STATES:
+                self.next_attempt_at = None
+            else:
+                pending = [self._recovery[h.port].next_attempt for h in self._handlers]
+                self.next_attempt_at = max(time.time(), min(pending))
+            self._set_state(state)
+
+    def stats(self):
+        return {
+            'state': self.state,
+            'ready': self.ready,
+            'attempts': self.attempts,
+            'last_error': self.last_error,
+            'started_at': self.started_at,
+            'ready_at': self.ready_at,
+            'next_attempt_at': self.next_attempt_at,
+            'transitions': self.transitions,
+            'modems': dict((port, {
+                'reconnect_attempts': r.attempts,
+                'last_error': r.last_error,
+                'next_attempt': r.next_attempt or None
+            }) for port, r in self._recovery.items())
+        }
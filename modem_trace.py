@@ -0,0 +1,179 @@
+# modem_trace.py
+"""Opt-in AT command tracing for GsmModem instances."""
+from collections import deque
+from functools import wraps
+from threading import current_thread, local
+import json
+import time
+
+class ModemTracer:
+    def __init__(self, capacity=10000, enabled=False):
+        """
+        Initialize the tracer.
+
+        Args:
+            capacity: Number of events kept in the ring buffer
+            enabled: Whether recording starts enabled; can be toggled at runtime
+        """
+        self.enabled = enabled
+        self._events = deque(maxlen=capacity)
+        self._local = local()
+
+    @property
+    def capacity(self):
+        return self._events.maxlen
+
+    def set_enabled(self, enabled):
+        self.enabled = bool(enabled)
+        return self.enabled
+
+    def current_operation(self):
+        stack = getattr(self._local, 'operations', None)
+        return stack[-1] if stack else None
+
+    def push_operation(self, name):
+        stack = getattr(self._local, 'operations', None)
+        if stack is None:
+            stack = self._local.operations = []
+        stack.append(name)
+
+    def pop_operation(self):
+        self._local.operations.pop()
+
+    def carry_operation(self, func):
+        """
+        Wrap func so it runs under the calling thread's current operation.
+
+        Used when work is handed to a modem's I/O thread, whose own operation
+        stack knows nothing of the caller's.
+        """
+        operation = self.current_operation()
+        if operation is None:
+            return func
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            self.push_operation(operation)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.pop_operation()
+        return wrapper
+
+    def attach(self, modem, port):
+        """Wrap modem.write and the URC callback so they record events."""
+        tracer = self
+        write = modem.write
+        notify = modem.notifyCallback
+        after_cmgs = [False]  # the next write is an SMS body or PDU
+
+        def traced_write(data, *args, **kwargs):
+            # The write after AT+CMGS carries the message itself, which may be
+            # a verification code; only its size is recorded
+            redact, after_cmgs[0] = after_cmgs[0], str(data).upper().startswith('AT+CMGS')
+            if not tracer.enabled:
+                return write(data, *args, **kwargs)
+            start = time.monotonic()
+            response = error = None
+            try:
+                response = write(data, *args, **kwargs)
+                return response
+            except Exception as e:
+                error = str(e)
+                raise
+            finally:
+                tracer._record(port, 'command', start, time.monotonic() - start,
+                               data=data, response=response, error=error, redact=redact)
+
+        def traced_notify(lines):
+            if tracer.enabled:
+                tracer._record(port, 'urc', time.monotonic(), 0, response=lines)
+            return notify(lines)
+
+        modem.write = traced_write
+        modem.notifyCallback = traced_notify
+
+    def _record(self, port, kind, start, duration, data=None, response=None, error=None,
+                redact=False):
+        bytes_out = len(data) if data else 0
+        if redact:
+            data = '<{0} bytes redacted>'.format(bytes_out)
+        if isinstance(response, (list, tuple)):
+            response = list(response)
+        elif response is not None:
+            response = [str(response)]
+        self._events.append({
+            'ts': start,
+            'wall': time.time() - (time.monotonic() - start),
+            'duration': duration,
+            'port': port,
+            'kind': kind,
+            'operation': self.current_operation(),
+            'thread': current_thread().name,
+            'data': data,
+            'response': response,
+            'error': error,
+            'bytes_out': bytes_out,
+            'bytes_in': sum(len(line) for line in response) if response else 0
+        })
+
+    def events(self, limit=None):
+        events = list(self._events)
+        return events[-limit:] if limit else events
+
+    def clear(self):
+        self._events.clear()
+
+    def dump_jsonl(self, limit=None):
+        """Events as JSON lines, oldest first."""
+        return ''.join(json.dumps(event) + '\n' for event in self.events(limit))
+
+    def dump_chrome(self, limit=None):
+        """Events in Chrome trace format (chrome://tracing, Perfetto)."""
+        trace_events = []
+        for event in self.events(limit):
+            entry = {
+                'name': (event['data'] or ', '.join(event['response'] or []))[:80],
+                'cat': event['kind'],
+                'ts': int(event['ts'] * 1e6),
+                'pid': event['port'],
+                'tid': event['operation'] or event['thread'],
+                'args': {
+                    'response': event['response'],
+                    'error': event['error'],
+                    'bytes_out': event['bytes_out'],
+                    'bytes_in': event['bytes_in']
+                }
+            }
+            if event['kind'] == 'command':
+                entry['ph'] = 'X'
+                entry['dur'] = int(event['duration'] * 1e6)
+            else:
+                entry['ph'] = 'i'
+                entry['s'] = 't'
+            trace_events.append(entry)
+        return json.dumps({'traceEvents': trace_events, 'displayTimeUnit': 'ms'})
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'capacity': self.capacity,
+            'events': len(self._events)
+        }
+
+
+def traced(name):
+    """Decorator tagging AT commands issued by a ModemHandler method with name."""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(self, *args, **kwargs):
+            tracer = self.tracer
+            if tracer is None:
+                return f(self, *args, **kwargs)
+            tracer.push_operation(name)
+            try:
+                return f(self, *args, **kwargs)
+            finally:
+                tracer.pop_operation()
+        return wrapper
+    return decorator
@@ -0,0 +1,58 @@
+# network_status.py
+"""Cached GSM network registration state."""
+from threading import Lock
+import time
+
+class NetworkStatusCache:
+    def __init__(self, ttl=60):
+        """
+        Initialize the cache.
+
+        Args:
+            ttl: Seconds a refreshed status stays valid
+        """
+        self.ttl = ttl
+        self._lock = Lock()
+        self._network_name = None
+        self._signal_strength = None
+        self._updated_at = None
+        self._invalidated = None
+
+    def update(self, network_name, signal_strength):
+        """Store a status freshly read from the modem."""
+        with self._lock:
+            self._network_name = network_name
+            self._signal_strength = signal_strength
+            self._updated_at = time.time()
+            self._invalidated = None
+
+    def invalidate(self, reason):
+        """Mark the cached status stale so the next reader refreshes it."""
+        with self._lock:
+            self._invalidated = reason
+
+    def get(self):
+        """Return (ok, message) if the cached status is fresh, else None."""
+        with self._lock:
+            if self._updated_at is None or self._invalidated:
+                return None
+            if time.time() - self._updated_at > self.ttl:
+                return None
+            if not self._network_name:
+                return False, "Not registered to network"
+            return True, "Connected to " + self._network_name
+
+    def snapshot(self):
+        """Current cached state, whether fresh or not."""
+        with self._lock:
+            age = None
+            if self._updated_at is not None:
+                age = time.time() - self._updated_at
+            return {
+                'network': self._network_name,
+                'signal_strength': self._signal_strength,
+                'updated_at': self._updated_at,
+                'age': age,
+                'fresh': age is not None and age <= self.ttl and not self._invalidated,
+                'invalidated': self._invalidated
+            }
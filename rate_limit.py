@@ -0,0 +1,106 @@
+# rate_limit.py
+"""Token-bucket rate limiting for modem-backed endpoints."""
+from collections import OrderedDict
+from threading import Lock
+import time
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        """
+        Initialize a token bucket.
+
+        Args:
+            rate: Tokens added per second
+            capacity: Maximum tokens the bucket holds (burst size)
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.time()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, cost=1, now=None):
+        """Seconds until cost tokens are available (0 if available now)."""
+        self._refill(now or time.time())
+        # A cost above the burst size is let through from a full bucket and
+        # paid back as debt, rather than never fitting
+        cost = min(cost, self.capacity)
+        if self.tokens >= cost:
+            return 0.0
+        if self.rate <= 0:
+            return float('inf')
+        return (cost - self.tokens) / self.rate
+
+    def consume(self, cost=1):
+        self.tokens -= cost
+
+
+class RateLimiter:
+    def __init__(self, max_keys=100000):
+        """
+        Initialize the rate limiter.
+
+        Args:
+            max_keys: Buckets kept per scope; least recently used are dropped
+        """
+        self.max_keys = max_keys
+        self._lock = Lock()
+        self._limits = {}  # scope -> (rate, capacity)
+        self._buckets = {}  # scope -> OrderedDict(key -> TokenBucket)
+        self.allowed = 0
+        self.limited = {}
+
+    def add_limit(self, scope, rate, capacity):
+        """Define a bucket family, e.g. add_limit('phone', 1 / 60.0, 3)."""
+        with self._lock:
+            self._limits[scope] = (rate, capacity)
+            self._buckets[scope] = OrderedDict()
+            self.limited[scope] = 0
+
+    def _bucket(self, scope, key):
+        buckets = self._buckets[scope]
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(*self._limits[scope])
+            buckets[key] = bucket
+            if len(buckets) > self.max_keys:
+                buckets.popitem(last=False)
+        else:
+            buckets.move_to_end(key)
+        return bucket
+
+    def check(self, keys, cost=1):
+        """
+        Take cost tokens from every bucket in keys, or from none of them.
+
+        Args:
+            keys: Iterable of (scope, key) pairs; scopes without a limit are ignored
+            cost: Tokens to take from each bucket
+
+        Returns:
+            Tuple of (allowed, retry_after_seconds, limiting_scope)
+        """
+        now = time.time()
+        with self._lock:
+            buckets = [(scope, self._bucket(scope, key))
+                       for scope, key in keys if scope in self._limits]
+            for scope, bucket in buckets:
+                wait = bucket.wait_time(cost, now)
+                if wait > 0:
+                    self.limited[scope] += 1
+                    return False, wait, scope
+            for _, bucket in buckets:
+                bucket.consume(cost)
+            self.allowed += 1
+            return True, 0.0, None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'allowed': self.allowed,
+                'limited': dict(self.limited),
+                'buckets': dict((scope, len(b)) for scope, b in self._buckets.items())
+            }
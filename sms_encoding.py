@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+# sms_encoding.py
+"""GSM-7 detection, transliteration and segment counting for outbound SMS."""
+import unicodedata
+
+ENCODING_GSM7 = 'gsm7'
+ENCODING_UCS2 = 'ucs2'
+
+# GSM 03.38 default alphabet (escape excluded) and its extension table,
+# whose characters take two septets
+GSM7_BASIC = frozenset(
+    u'@£$¥èéùìòÇ\nØø\rÅå'
+    u'Δ_ΦΓΛΩΠΨΣΘΞÆæßÉ'
+    u' !"#¤%&\'()*+,-./0123456789:;<=>?'
+    u'¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§'
+    u'¿abcdefghijklmnopqrstuvwxyzäöñüà'
+)
+GSM7_EXTENDED = frozenset(u'\f^{}\\[~]|€')
+
+# (single message, per part of a concatenated message) capacity in units
+GSM7_LIMITS = (160, 153)  # septets
+UCS2_LIMITS = (70, 67)  # UTF-16 code units
+
+# Common Unicode punctuation with a GSM-7 look-alike
+TRANSLITERATIONS = {
+    u'\u2018': u"'", u'\u2019': u"'", u'\u201a': u"'", u'\u201b': u"'",
+    u'\u2032': u"'", u'\u00b4': u"'", u'`': u"'", u'\u2039': u"'", u'\u203a': u"'",
+    u'\u201c': u'"', u'\u201d': u'"', u'\u201e': u'"', u'\u201f': u'"',
+    u'\u2033': u'"', u'\u00ab': u'"', u'\u00bb': u'"',
+    u'\u2010': u'-', u'\u2011': u'-', u'\u2012': u'-', u'\u2013': u'-',
+    u'\u2014': u'-', u'\u2015': u'-', u'\u2212': u'-',
+    u'\u2026': u'...', u'\u2022': u'*', u'\u00b7': u'.', u'\u00d7': u'x',
+    u'\u00a0': u' ', u'\u2002': u' ', u'\u2003': u' ', u'\u2009': u' ',
+    u'\u200a': u' ', u'\u202f': u' ', u'\t': u' ',
+    u'\u200b': u'', u'\u200c': u'', u'\u200d': u'', u'\ufeff': u'',
+    u'\u00e7': u'\u00c7',  # GSM-7 only has the capital C-cedilla
+}
+
+
+def is_gsm7(text):
+    """True if text can be sent in the GSM-7 alphabet, extension table included."""
+    return all(c in GSM7_BASIC or c in GSM7_EXTENDED for c in text)
+
+
+def _gsm7_units(text):
+    return [2 if c in GSM7_EXTENDED else 1 for c in text]
+
+
+def _ucs2_units(text):
+    return [2 if ord(c) > 0xFFFF else 1 for c in text]
+
+
+def _count_segments(units, limits):
+    """Number of parts, never splitting an escape sequence or surrogate pair."""
+    single, part = limits
+    if sum(units) <= single:
+        return 1
+    segments, used = 1, 0
+    for size in units:
+        if used + size > part:
+            segments += 1
+            used = 0
+        used += size
+    return segments
+
+
+def _transliterate_char(c, strip_accents=False):
+    if c in GSM7_BASIC or c in GSM7_EXTENDED:
+        return c
+    if c in TRANSLITERATIONS:
+        return TRANSLITERATIONS[c]
+    if not strip_accents:
+        return c
+    # Accented letters outside the alphabet lose their accent, e.g. a-acute -> a
+    base = u''.join(b for b in unicodedata.normalize('NFD', c)
+                    if not unicodedata.combining(b))
+    if base and is_gsm7(base):
+        return base
+    return c
+
+
+def transliterate(text, strip_accents=False):
+    """
+    Replace punctuation outside GSM-7 with look-alikes where one exists.
+
+    Args:
+        text: Message text
+        strip_accents: Also drop the accent of letters outside GSM-7,
+            which changes the wording rather than just the punctuation
+    """
+    return u''.join(_transliterate_char(c, strip_accents) for c in text)
+
+
+def analyze(text):
+    """
+    Describe how text will be encoded on the air.
+
+    Returns:
+        Dict with encoding, units (septets or UTF-16 code units),
+        segments and the characters that force UCS-2, if any
+    """
+    text = text or u''
+    unsupported = sorted(set(c for c in text
+                             if c not in GSM7_BASIC and c not in GSM7_EXTENDED))
+    if unsupported:
+        encoding, units, limits = ENCODING_UCS2, _ucs2_units(text), UCS2_LIMITS
+    else:
+        encoding, units, limits = ENCODING_GSM7, _gsm7_units(text), GSM7_LIMITS
+    return {
+        'encoding': encoding,
+        'units': sum(units),
+        'segments': _count_segments(units, limits),
+        'unsupported': unsupported
+    }
+
+
+def prepare(text, transliterate_text=False, strip_accents=False):
+    """
+    Pick the text to send and analyze it.
+
+    With transliteration the substituted text is used when it fits GSM-7
+    or needs fewer segments; otherwise the original text is kept.
+
+    Args:
+        text: Message text
+        transliterate_text: Try GSM-7 look-alikes for other characters
+        strip_accents: With transliterate_text, also drop accents
+
+    Returns:
+        Tuple of (text, analysis) where analysis also says whether the
+        text was transliterated
+    """
+    info = analyze(text)
+    info['transliterated'] = False
+    if transliterate_text and info['encoding'] == ENCODING_UCS2:
+        candidate = transliterate(text, strip_accents)
+        candidate_info = analyze(candidate)
+        if (candidate_info['encoding'] == ENCODING_GSM7
+                or candidate_info['segments'] < info['segments']):
+            candidate_info['transliterated'] = True
+            return candidate, candidate_info
+    return text, info
+
+
+def segment_count(text):
+    """Number of SMS parts text is sent as."""
+    return analyze(text)['segments']
@@ -0,0 +1,660 @@
+# sms_queue.py
+"""Persistent outbound SMS queue with dedicated modem workers."""
+from threading import Condition, Lock, Thread
+import heapq
+import logging
+import re
+import sqlite3
+import time
+import uuid
+
+from sms_encoding import prepare
+from delivery_reports import DELIVERY_PENDING
+import metrics
+
+logger = logging.getLogger(__name__)
+
+STATUS_QUEUED = 'queued'
+STATUS_SENDING = 'sending'
+STATUS_SENT = 'sent'
+STATUS_FAILED = 'failed'
+STATUS_EXPIRED = 'expired'  # dropped because it could not be sent before its deadline
+
+# Priority classes, served strictly in this order
+PRIORITY_AUTH = 'auth'
+PRIORITY_TRANSACTIONAL = 'transactional'
+PRIORITY_BULK = 'bulk'
+PRIORITIES = (PRIORITY_AUTH, PRIORITY_TRANSACTIONAL, PRIORITY_BULK)
+
+WAIT_SECONDS = metrics.histogram(
+    'sms_queue_wait_seconds', 'Time from enqueue to the first send attempt', ['priority'])
+EXPIRED_JOBS = metrics.counter(
+    'sms_queue_expired_total', 'Jobs dropped because they would miss their deadline',
+    ['priority'])
+QUEUED_SEGMENTS = metrics.counter(
+    'sms_queue_segments_total', 'SMS parts queued for sending', ['encoding'])
+TRANSLITERATED = metrics.counter(
+    'sms_queue_transliterated_total',
+    'Messages switched to GSM-7 look-alike characters to save parts')
+
+OPEN_BATCH_TTL = 600  # seconds an open batch may go without new items before it is dropped
+
+_NUMBER_SEPARATORS = re.compile(r'[\s().\-/]')
+
+
+def normalize_number(number):
+    """Canonicalize a phone number, or return None if it is not one."""
+    if number is None:
+        return None
+    number = _NUMBER_SEPARATORS.sub('', str(number))
+    if number.startswith('00'):
+        number = '+' + number[2:]
+    digits = number[1:] if number.startswith('+') else number
+    if not digits.isdigit() or not 3 <= len(digits) <= 15:
+        return None
+    return number
+
+
+class SmsQueue:
+    def __init__(self, modem_handler, db_path, max_attempts=3, retry_delay=5,
+                 status_callback=None, workers=1, batch_callback=None,
+                 batch_progress_interval=1.0, is_ready=None, client_weights=None,
+                 transliterate=False, delivery_tracker=None, strip_accents=False):
+        """
+        Initialize the SMS queue.
+
+        Args:
+            modem_handler: ModemHandler used by the worker to send messages
+            db_path: Path of the SQLite file holding queued jobs
+            max_attempts: Number of send attempts before a job is failed
+            retry_delay: Seconds to wait before retrying a failed attempt
+            status_callback: Optional callable invoked with the job dict on
+                every status change
+            workers: Number of worker threads (one per modem in a pool)
+            batch_callback: Optional callable invoked with batch progress,
+                at most once per batch_progress_interval seconds per batch
+            batch_progress_interval: Minimum seconds between batch updates
+            is_ready: Optional callable; while it returns False jobs are held
+                back without using up attempts
+            client_weights: Optional dict of fair-queuing weights per client
+                id; clients not listed weigh 1
+            transliterate: Default for replacing Unicode punctuation with
+                GSM-7 look-alikes so messages are not sent as UCS-2
+            delivery_tracker: Optional DeliveryTracker sent jobs are
+                registered with; its results come back via record_delivery
+            strip_accents: When transliterating, also drop accents from
+                letters outside GSM-7
+        """
+        self.modem_handler = modem_handler
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.status_callback = status_callback
+        self.workers = max(1, workers)
+        self.batch_callback = batch_callback
+        self.batch_progress_interval = batch_progress_interval
+        self._batch_reported = {}  # batch_id -> last report time
+        self._open_batches = {}  # batch_id -> intake state, see open_batch
+        self._open_batches_lock = Lock()
+        self.is_ready = is_ready
+        self.client_weights = client_weights or {}
+        self.transliterate = transliterate
+        self.strip_accents = strip_accents
+        self.delivery_tracker = delivery_tracker
+
+        self._db_lock = Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._create_schema()
+
+        # Due jobs wait in one heap per priority class, ordered by their
+        # self-clocked fair queuing finish tag so no client hogs its class; a
+        # job costs one unit per SMS part, as that is what holds the modem
+        self._classes = dict((p, []) for p in PRIORITIES)  # (finish, seq, job_id, client)
+        self._virtual_time = dict((p, 0.0) for p in PRIORITIES)
+        self._last_finish = {}  # (priority, client) -> finish tag of its last job
+        self._delayed = []  # heap of (not_before, seq, job_id, priority, client, cost)
+        self._seq = 0
+        self._send_estimate = 0.0  # moving average of successful send time per part
+        self._class_stats = dict(
+            (p, {'dequeued': 0, 'wait_total': 0.0, 'wait_max': 0.0, 'expired': 0})
+            for p in PRIORITIES)
+        self._cond = Condition()
+        self._running = False
+        self._threads = []
+
+        self._restore_pending()
+        logger.info("SmsQueue initialized with db=%s, max_attempts=%d",
+                    db_path, max_attempts)
+
+    def _create_schema(self):
+        with self._db_lock, self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sms_jobs ("
+                " id TEXT PRIMARY KEY,"
+                " number TEXT NOT NULL,"
+                " message TEXT NOT NULL,"
+                " status TEXT NOT NULL,"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " error TEXT,"
+                " latency REAL,"
+                " created_at REAL NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            self._ensure_column('sms_jobs', 'batch_id', 'TEXT')
+            self._ensure_column('sms_jobs', 'priority',
+                                "TEXT NOT NULL DEFAULT '{0}'".format(PRIORITY_TRANSACTIONAL))
+            self._ensure_column('sms_jobs', 'client', 'TEXT')
+            self._ensure_column('sms_jobs', 'deadline', 'REAL')
+            self._ensure_column('sms_jobs', 'segments', 'INTEGER NOT NULL DEFAULT 1')
+            self._ensure_column('sms_jobs', 'encoding', 'TEXT')
+            self._ensure_column('sms_jobs', 'delivery_status', 'TEXT')
+            self._ensure_column('sms_jobs', 'delivery_latency', 'REAL')
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_sms_jobs_status"
+                " ON sms_jobs (status)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_sms_jobs_batch"
+                " ON sms_jobs (batch_id, status)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sms_batches ("
+                " id TEXT PRIMARY KEY,"
+                " total INTEGER NOT NULL,"
+                " duplicates INTEGER NOT NULL,"
+                " rejected INTEGER NOT NULL,"
+                " created_at REAL NOT NULL)"
+            )
+
+    def _ensure_column(self, table, column, definition):
+        """Add a column to a table created by an older version."""
+        columns = [row[1] for row in
+                   self._db.execute("PRAGMA table_info({0})".format(table))]
+        if column not in columns:
+            self._db.execute("ALTER TABLE {0} ADD COLUMN {1} {2}".format(
+                table, column, definition))
+
+    def _restore_pending(self):
+        """Requeue jobs left queued or mid-send by a previous run."""
+        with self._db_lock, self._db:
+            self._db.execute(
+                "UPDATE sms_jobs SET status = ? WHERE status = ?",
+                (STATUS_QUEUED, STATUS_SENDING)
+            )
+            rows = self._db.execute(
+                "SELECT id, priority, client, segments FROM sms_jobs WHERE status = ?"
+                " ORDER BY created_at",
+                (STATUS_QUEUED,)
+            ).fetchall()
+        self._push_many([(row['id'], row['priority'], row['client'], row['segments'])
+                         for row in rows])
+        if rows:
+            logger.info("Restored %d pending SMS jobs", len(rows))
+
+    def _push(self, job_id, priority, client, cost=1, delay=0):
+        self._push_many([(job_id, priority, client, cost)], delay)
+
+    def _push_many(self, jobs, delay=0):
+        """Hand (job_id, priority, client, cost) tuples to the workers."""
+        if not jobs:
+            return
+        not_before = time.time() + delay
+        with self._cond:
+            for job_id, priority, client, cost in jobs:
+                if priority not in self._classes:
+                    priority = PRIORITY_TRANSACTIONAL
+                if delay:
+                    self._seq += 1
+                    heapq.heappush(self._delayed,
+                                   (not_before, self._seq, job_id, priority, client, cost))
+                else:
+                    self._schedule(job_id, priority, client, cost)
+            self._cond.notify(len(jobs))
+
+    def _schedule(self, job_id, priority, client, cost=1):
+        """Tag a due job with its fair-queuing finish time; caller holds _cond."""
+        key = (priority, client)
+        start = max(self._virtual_time[priority], self._last_finish.get(key, 0.0))
+        finish = start + float(cost or 1) / self.client_weights.get(client, 1.0)
+        self._last_finish[key] = finish
+        self._seq += 1
+        heapq.heappush(self._classes[priority], (finish, self._seq, job_id, client))
+        if len(self._last_finish) > 10000:
+            # Clients whose last job is already served start fresh anyway
+            self._last_finish = dict(
+                (k, f) for k, f in self._last_finish.items()
+                if f > self._virtual_time[k[0]])
+
+    def _update(self, job_id, **fields):
+        fields['updated_at'] = time.time()
+        columns = ', '.join('{0} = ?'.format(name) for name in fields)
+        with self._db_lock, self._db:
+            self._db.execute(
+                "UPDATE sms_jobs SET {0} WHERE id = ?".format(columns),
+                list(fields.values()) + [job_id]
+            )
+        job = self.get_job(job_id)
+        if job and self.status_callback:
+            try:
+                self.status_callback(job)
+            except Exception as e:
+                logger.error("SMS status callback failed: %s", str(e))
+        if job and job['batch_id']:
+            self._report_batch(job['batch_id'])
+        return job
+
+    def _report_batch(self, batch_id):
+        """Send throttled batch progress to batch_callback."""
+        if not self.batch_callback:
+            return
+        now = time.time()
+        batch = self.get_batch(batch_id)
+        if batch['pending']:
+            if now - self._batch_reported.get(batch_id, 0) < self.batch_progress_interval:
+                return
+            self._batch_reported[batch_id] = now
+        else:
+            self._batch_reported.pop(batch_id, None)
+        try:
+            self.batch_callback(batch)
+        except Exception as e:
+            logger.error("SMS batch callback failed: %s", str(e))
+
+    def _prepare(self, message, transliterate, prepared=None):
+        if prepared is not None:
+            message, info = prepared
+        else:
+            if transliterate is None:
+                transliterate = self.transliterate
+            message, info = prepare(message, transliterate, self.strip_accents)
+        if info['transliterated']:
+            TRANSLITERATED.inc()
+        QUEUED_SEGMENTS.labels(info['encoding']).inc(info['segments'])
+        return message, info
+
+    def enqueue(self, number, message, priority=PRIORITY_TRANSACTIONAL, client=None,
+                deadline=None, transliterate=None, prepared=None):
+        """
+        Persist a new job and hand it to the worker.
+
+        Args:
+            number: Destination number
+            message: Message text
+            priority: One of PRIORITIES; higher classes are always served first
+            client: Client id jobs are fair-queued by within their class
+            deadline: Optional epoch time after which the job is dropped
+                as expired instead of being sent
+            transliterate: Override the queue's transliteration default
+            prepared: Optional (text, analysis) the caller already got from
+                sms_encoding.prepare, so the message is not prepared twice
+        """
+        if priority not in PRIORITIES:
+            raise ValueError("Unknown priority: {0}".format(priority))
+        message, info = self._prepare(message, transliterate, prepared)
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._db_lock, self._db:
+            self._db.execute(
+                "INSERT INTO sms_jobs (id, number, message, status, attempts,"
+                " created_at, updated_at, priority, client, deadline, segments, encoding)"
+                " VALUES (?, ?, ?, ?, 0, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, number, message, STATUS_QUEUED, now, now,
+                 priority, client, deadline, info['segments'], info['encoding'])
+            )
+        self._push(job_id, priority, client, info['segments'])
+        logger.info("Queued %s SMS job %s for %s (%d %s part(s))", priority, job_id, number,
+                    info['segments'], info['encoding'])
+        job = self.get_job(job_id)
+        job['transliterated'] = info['transliterated']
+        return job
+
+    def enqueue_batch(self, items, priority=PRIORITY_BULK, client=None, transliterate=None):
+        """
+        Normalize, dedupe and enqueue many messages in one transaction.
+
+        Args:
+            items: Iterable of (number, message) pairs
+            priority: Priority class of every job in the batch
+            client: Client id the batch is fair-queued under
+            transliterate: Override the queue's transliteration default
+
+        Returns:
+            Batch dict with counts, or None if no item was valid
+        """
+        batch_id = self.open_batch(priority, client, transliterate)
+        try:
+            self.add_to_batch(batch_id, items)
+        except Exception:
+            self.abort_batch(batch_id)
+            raise
+        return self.close_batch(batch_id)
+
+    def open_batch(self, priority=PRIORITY_BULK, client=None, transliterate=None):
+        """
+        Start a batch whose items arrive in several add_to_batch calls.
+
+        Nothing is stored or sent until close_batch, so a batch is queued
+        whole or not at all, and duplicates are found across every chunk.
+
+        Returns:
+            Batch id to pass to add_to_batch, close_batch or abort_batch
+        """
+        if priority not in PRIORITIES:
+            raise ValueError("Unknown priority: {0}".format(priority))
+        batch_id = uuid.uuid4().hex
+        now = time.time()
+        with self._open_batches_lock:
+            # Intake abandoned by a client that went away mid-stream
+            for stale in [b for b, state in self._open_batches.items()
+                          if state['touched_at'] < now - OPEN_BATCH_TTL]:
+                logger.warning("Dropping SMS batch %s left open", stale)
+                del self._open_batches[stale]
+            self._open_batches[batch_id] = {
+                'priority': priority,
+                'client': client,
+                'transliterate': transliterate,
+                'created_at': now,
+                'touched_at': now,
+                'seen': set(),
+                'prepared': {},  # batches usually repeat one template
+                'rows': [],
+                'duplicates': 0,
+                'rejected': 0
+            }
+        return batch_id
+
+    def _open_batch(self, batch_id):
+        with self._open_batches_lock:
+            state = self._open_batches.get(batch_id)
+        if state is None:
+            raise ValueError("Unknown or expired batch: {0}".format(batch_id))
+        state['touched_at'] = time.time()
+        return state
+
+    def add_to_batch(self, batch_id, items):
+        """Normalize and dedupe (number, message) pairs into an open batch."""
+        state = self._open_batch(batch_id)
+        seen, prepared, rows = state['seen'], state['prepared'], state['rows']
+        now = state['created_at']
+        for number, message in items:
+            number = normalize_number(number)
+            if not number or not message:
+                state['rejected'] += 1
+                continue
+            if (number, message) in seen:
+                state['duplicates'] += 1
+                continue
+            seen.add((number, message))
+            if message not in prepared:
+                prepared[message] = self._prepare(message, state['transliterate'])
+            text, info = prepared[message]
+            rows.append((uuid.uuid4().hex, number, text, STATUS_QUEUED,
+                         now, now, batch_id, state['priority'], state['client'],
+                         info['segments'], info['encoding']))
+        return len(rows)
+
+    def abort_batch(self, batch_id):
+        """Discard an open batch without queuing any of it."""
+        with self._open_batches_lock:
+            return self._open_batches.pop(batch_id, None) is not None
+
+    def close_batch(self, batch_id):
+        """
+        Store and queue every job of an open batch in one transaction.
+
+        Returns:
+            Batch dict with counts, or None if no item was valid
+        """
+        with self._open_batches_lock:
+            state = self._open_batches.pop(batch_id, None)
+        if state is None:
+            raise ValueError("Unknown or expired batch: {0}".format(batch_id))
+        rows = state['rows']
+        if not rows:
+            return None
+
+        priority, client = state['priority'], state['client']
+        with self._db_lock, self._db:
+            self._db.execute(
+                "INSERT INTO sms_batches (id, total, duplicates, rejected, created_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (batch_id, len(rows), state['duplicates'], state['rejected'],
+                 state['created_at'])
+            )
+            self._db.executemany(
+                "INSERT INTO sms_jobs (id, number, message, status, attempts,"
+                " created_at, updated_at, batch_id, priority, client, segments, encoding)"
+                " VALUES (?, ?, ?, ?, 0, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+        self._push_many([(row[0], priority, client, row[9]) for row in rows])
+        logger.info("Queued SMS batch %s with %d messages (%d duplicates, %d rejected)",
+                    batch_id, len(rows), state['duplicates'], state['rejected'])
+        return self.get_batch(batch_id)
+
+    def get_batch(self, batch_id):
+        """Return aggregate progress of a batch, or None if it does not exist."""
+        with self._db_lock:
+            batch = self._db.execute(
+                "SELECT id, total, duplicates, rejected, created_at"
+                " FROM sms_batches WHERE id = ?",
+                (batch_id,)
+            ).fetchone()
+            if not batch:
+                return None
+            counts = {}
+            segments = 0
+            for status, count, parts in self._db.execute(
+                    "SELECT status, COUNT(*), SUM(segments) FROM sms_jobs"
+                    " WHERE batch_id = ? GROUP BY status",
+                    (batch_id,)):
+                counts[status] = count
+                segments += parts or 0
+        sent = counts.get(STATUS_SENT, 0)
+        failed = counts.get(STATUS_FAILED, 0)
+        expired = counts.get(STATUS_EXPIRED, 0)
+        return {
+            'batch_id': batch['id'],
+            'total': batch['total'],
+            'duplicates': batch['duplicates'],
+            'rejected': batch['rejected'],
+            'sent': sent,
+            'failed': failed,
+            'expired': expired,
+            'pending': batch['total'] - sent - failed - expired,
+            'segments': segments,
+            'created_at': batch['created_at']
+        }
+
+    def get_job(self, job_id):
+        """Return the public view of a job, or None if it does not exist."""
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT id, number, status, attempts, error, latency,"
+                " created_at, updated_at, batch_id, priority, deadline, segments, encoding,"
+                " delivery_status, delivery_latency"
+                " FROM sms_jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+        if not row:
+            return None
+        return {
+            'job_id': row['id'],
+            'number': row['number'],
+            'status': row['status'],
+            'attempts': row['attempts'],
+            'error': row['error'],
+            'latency': row['latency'],
+            'created_at': row['created_at'],
+            'updated_at': row['updated_at'],
+            'batch_id': row['batch_id'],
+            'priority': row['priority'],
+            'deadline': row['deadline'],
+            'segments': row['segments'],
+            'encoding': row['encoding'],
+            'delivery_status': row['delivery_status'],
+            'delivery_latency': row['delivery_latency']
+        }
+
+    def depth(self):
+        """Number of jobs waiting for the worker."""
+        with self._cond:
+            return len(self._delayed) + sum(len(h) for h in self._classes.values())
+
+    def stats(self):
+        """Per-class queue depth, wait times and expiries."""
+        with self._cond:
+            depth = dict((p, len(self._classes[p])) for p in PRIORITIES)
+            for entry in self._delayed:
+                depth[entry[3]] += 1
+        result = {}
+        for priority in PRIORITIES:
+            stats = self._class_stats[priority]
+            result[priority] = {
+                'depth': depth[priority],
+                'dequeued': stats['dequeued'],
+                'wait_avg': stats['wait_total'] / stats['dequeued']
+                if stats['dequeued'] else None,
+                'wait_max': stats['wait_max'],
+                'expired': stats['expired']
+            }
+        return result
+
+    def start(self):
+        """Start the modem worker threads."""
+        if self._running:
+            return
+        self._running = True
+        for i in range(self.workers):
+            thread = Thread(target=self._worker, name='sms-queue-worker-{0}'.format(i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+        logger.info("SMS queue started with %d worker(s)", self.workers)
+
+    def stop(self):
+        """Stop the worker; pending jobs stay persisted for the next run."""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+
+    def _next_job(self):
+        with self._cond:
+            while self._running:
+                now = time.time()
+                while self._delayed and self._delayed[0][0] <= now:
+                    _, _, job_id, priority, client, cost = heapq.heappop(self._delayed)
+                    self._schedule(job_id, priority, client, cost)
+                for priority in PRIORITIES:
+                    heap = self._classes[priority]
+                    if heap:
+                        finish, _, job_id, _ = heapq.heappop(heap)
+                        self._virtual_time[priority] = finish
+                        return job_id
+                self._cond.wait(self._delayed[0][0] - now if self._delayed else None)
+        return None
+
+    def _worker(self):
+        while self._running:
+            job_id = self._next_job()
+            if job_id is None:
+                break
+            try:
+                self._process(job_id)
+            except Exception as e:
+                logger.error("SMS queue worker error on job %s: %s",
+                             job_id, str(e), exc_info=True)
+
+    def _process(self, job_id):
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT number, message, attempts, created_at, priority, client,"
+                " deadline, segments FROM sms_jobs WHERE id = ? AND status = ?",
+                (job_id, STATUS_QUEUED)
+            ).fetchone()
+        if not row:
+            return
+        priority = row['priority']
+        deadline = row['deadline']
+        segments = row['segments'] or 1
+
+        if self._would_miss(deadline, segments=segments):
+            self._expire(job_id, priority)
+            return
+
+        if self.is_ready and not self.is_ready():
+            self._push(job_id, priority, row['client'], segments, self.retry_delay)
+            return
+
+        if not row['attempts']:
+            wait = time.time() - row['created_at']
+            stats = self._class_stats[priority]
+            stats['dequeued'] += 1
+            stats['wait_total'] += wait
+            stats['wait_max'] = max(stats['wait_max'], wait)
+            WAIT_SECONDS.labels(priority).observe(wait)
+
+        attempts = row['attempts'] + 1
+        self._update(job_id, status=STATUS_SENDING, attempts=attempts)
+
+        start = time.time()
+        try:
+            if not self.modem_handler:
+                raise RuntimeError("Modem not connected")
+            # Verification codes never reach message history
+            receipt = self.modem_handler.send_sms(row['number'], row['message'],
+                                                  sensitive=priority == PRIORITY_AUTH)
+        except Exception as e:
+            latency = time.time() - start
+            if attempts < self.max_attempts and self._would_miss(deadline, self.retry_delay,
+                                                                  segments):
+                self._expire(job_id, priority, error=str(e))
+            elif attempts < self.max_attempts:
+                logger.warning("SMS job %s attempt %d failed, retrying in %s seconds: %s",
+                               job_id, attempts, self.retry_delay, str(e))
+                self._update(job_id, status=STATUS_QUEUED, error=str(e),
+                             latency=latency)
+                self._push(job_id, priority, row['client'], segments, self.retry_delay)
+            else:
+                logger.error("SMS job %s failed after %d attempts: %s",
+                             job_id, attempts, str(e))
+                self._update(job_id, status=STATUS_FAILED, error=str(e),
+                             latency=latency)
+            return
+
+        latency = time.time() - start
+        per_part = latency / segments
+        self._send_estimate = (0.8 * self._send_estimate + 0.2 * per_part
+                               if self._send_estimate else per_part)
+        tracked = (self.delivery_tracker is not None and isinstance(receipt, dict)
+                   and receipt.get('reference') is not None)
+        if tracked:
+            # Marked pending and registered before the job is marked sent, so a fast
+            # report is matched and the SENT update below does not overwrite it
+            self._update(job_id, delivery_status=DELIVERY_PENDING)
+            self.delivery_tracker.track(receipt['modem'], receipt['reference'],
+                                        job_id, row['number'])
+        self._update(job_id, status=STATUS_SENT, error=None, latency=latency)
+        logger.info("SMS job %s sent", job_id)
+
+    def record_delivery(self, delivery):
+        """Store the final delivery state a DeliveryTracker reported for a job."""
+        return self._update(delivery['job_id'],
+                            delivery_status=delivery['delivery_status'],
+                            delivery_latency=delivery.get('latency'))
+
+    def _would_miss(self, deadline, delay=0, segments=1):
+        """True if a send started after delay would end past the deadline."""
+        return bool(deadline) and \
+            time.time() + delay + self._send_estimate * segments > deadline
+
+    def _expire(self, job_id, priority, error=None):
+        logger.warning("SMS job %s expired before it could be sent", job_id)
+        self._class_stats[priority]['expired'] += 1
+        EXPIRED_JOBS.labels(priority).inc()
+        self._update(job_id, status=STATUS_EXPIRED,
+                     error=error or 'Deadline passed before sending')
@@ -0,0 +1,200 @@
+# sms_reassembly.py
+"""Reassembly of concatenated (multi-part) inbound SMS."""
+from collections import OrderedDict
+from threading import Condition, Thread
+import logging
+import time
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# User data header information element identifiers for concatenation
+IEI_CONCAT_8BIT = 0x00
+IEI_CONCAT_16BIT = 0x08
+
+REASSEMBLY_SECONDS = metrics.histogram(
+    'sms_reassembly_duration_seconds',
+    'Time from the first to the last part of a concatenated SMS',
+    buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600))
+FRAGMENTS = metrics.counter(
+    'sms_fragments_total',
+    'Concatenated SMS parts received, by outcome', ['result'])
+PARTIAL_FLUSHES = metrics.counter(
+    'sms_reassembly_partial_total',
+    'Incomplete concatenated SMS delivered with parts missing', ['reason'])
+
+
+def concat_info(sms):
+    """
+    Return (reference, parts, number) for a concatenated SMS part, else None.
+
+    Args:
+        sms: Received SMS; python-gsmmodem exposes the parsed header as .udh
+    """
+    for element in getattr(sms, 'udh', None) or ():
+        if getattr(element, 'id', None) not in (IEI_CONCAT_8BIT, IEI_CONCAT_16BIT):
+            continue
+        try:
+            reference, parts, number = element.reference, element.parts, element.number
+        except AttributeError:
+            continue
+        if parts > 1 and 1 <= number <= parts:
+            return reference, parts, number
+    return None
+
+
+class _Buffer:
+    def __init__(self, parts, data):
+        self.parts = parts
+        self.texts = {}
+        self.data = data  # metadata of the first part seen
+        self.size = 0
+        self.started = time.time()
+
+
+class SmsReassembler:
+    def __init__(self, emit, timeout=120, max_bytes=256 * 1024):
+        """
+        Initialize the reassembler.
+
+        Args:
+            emit: Callable receiving each complete or flushed message dict
+            timeout: Seconds to wait for missing parts before flushing
+            max_bytes: Text buffered across all incomplete messages; the
+                oldest message is flushed when a new part would exceed it
+        """
+        self.emit = emit
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.completed = 0
+        self.flushed = 0
+        self.duplicates = 0
+        self.orphans = 0  # parts delivered inside incomplete messages
+        self._buffers = OrderedDict()  # oldest first, for eviction
+        self._bytes = 0
+        self._cond = Condition()
+        self._stopped = False
+        self._thread = None
+
+    def add(self, data, info):
+        """
+        Buffer one part; emit the message once every part has arrived.
+
+        Args:
+            data: Part dict with number, time, text and modem
+            info: (reference, parts, number) from concat_info
+        """
+        reference, parts, number = info
+        key = (data.get('modem'), data['number'], reference, parts)
+        text = data.get('text') or ''
+        complete = None
+        evicted = []
+        with self._cond:
+            buf = self._buffers.get(key)
+            if buf is None:
+                buf = self._buffers[key] = _Buffer(parts, data)
+            if number in buf.texts:
+                self.duplicates += 1
+                FRAGMENTS.labels('duplicate').inc()
+                return
+            buf.texts[number] = text
+            buf.size += len(text)
+            self._bytes += len(text)
+            FRAGMENTS.labels('buffered').inc()
+            if len(buf.texts) == parts:
+                complete = self._pop(key)
+            else:
+                while self._bytes > self.max_bytes and len(self._buffers) > 1:
+                    oldest = next(iter(self._buffers))
+                    if oldest == key:
+                        break
+                    evicted.append(self._pop(oldest))
+                self._ensure_sweeper()
+
+        if complete is not None:
+            self.completed += 1
+            REASSEMBLY_SECONDS.observe(time.time() - complete.started)
+            self._emit(complete)
+        for buf in evicted:
+            self._flush(buf, 'memory')
+
+    def _pop(self, key):
+        buf = self._buffers.pop(key)
+        self._bytes -= buf.size
+        return buf
+
+    def _emit(self, buf, missing=None):
+        data = dict(buf.data)
+        data['text'] = ''.join(buf.texts.get(n, '') for n in range(1, buf.parts + 1))
+        data['parts'] = buf.parts
+        if missing:
+            data['partial'] = True
+            data['missing_parts'] = missing
+        try:
+            self.emit(data)
+        except Exception as e:
+            logger.error("Error delivering reassembled SMS: %s", str(e))
+
+    def _flush(self, buf, reason):
+        missing = [n for n in range(1, buf.parts + 1) if n not in buf.texts]
+        self.flushed += 1
+        self.orphans += len(buf.texts)
+        FRAGMENTS.labels('orphaned').inc(len(buf.texts))
+        PARTIAL_FLUSHES.labels(reason).inc()
+        logger.warning("Delivering SMS from %s with parts %s missing (%s)",
+                       buf.data.get('number'), missing, reason)
+        self._emit(buf, missing)
+
+    def _ensure_sweeper(self):
+        # Called with the lock held
+        if self._thread is None:
+            self._thread = Thread(target=self._sweep, name='sms-reassembly')
+            self._thread.daemon = True
+            self._thread.start()
+        self._cond.notify()
+
+    def _sweep(self):
+        while True:
+            with self._cond:
+                expired = []
+                while not expired:
+                    if self._stopped:
+                        return
+                    if not self._buffers:
+                        self._cond.wait()
+                        continue
+                    oldest = next(iter(self._buffers.values()))
+                    wait = oldest.started + self.timeout - time.time()
+                    if wait > 0:
+                        self._cond.wait(wait)
+                        continue
+                    now = time.time()
+                    for key, buf in list(self._buffers.items()):
+                        if buf.started + self.timeout <= now:
+                            expired.append(self._pop(key))
+            for buf in expired:
+                self._flush(buf, 'timeout')
+
+    def close(self):
+        """Stop the sweeper and deliver whatever is still buffered."""
+        with self._cond:
+            self._stopped = True
+            pending = list(self._buffers.values())
+            self._buffers.clear()
+            self._bytes = 0
+            self._cond.notify()
+        for buf in pending:
+            self._flush(buf, 'shutdown')
+
+    def stats(self):
+        with self._cond:
+            pending = len(self._buffers)
+            buffered = self._bytes
+        return {
+            'pending': pending,
+            'buffered_bytes': buffered,
+            'completed': self.completed,
+            'flushed': self.flushed,
+            'orphaned_parts': self.orphans,
+            'duplicates': self.duplicates
+        }
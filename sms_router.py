@@ -0,0 +1,367 @@
+# sms_router.py
+"""
+Keyword and sender routing of inbound SMS.
+
+Rules come from a JSON file, either a list or {"rules": [...]}:
+
+    {"name": "stop", "route": "opt_out", "keywords": ["STOP", "UNSUBSCRIBE"],
+     "match": "first_word", "priority": 0, "final": true}
+    {"name": "acme-otp", "route": "otp", "keywords": ["code"], "senders": ["26134"]}
+    {"name": "acme", "route": "tenant:acme", "senders": ["+26133", "ACME"]}
+
+A rule matches when any of its keywords is found (case-insensitive) and,
+if it lists senders, the sender starts with one of them. A rule without
+keywords matches on the sender alone. Matches are ordered by priority
+(lowest first); a 'final' rule hides the ones after it.
+
+All keywords are compiled into one Aho-Corasick automaton and all sender
+prefixes into one trie, so matching a message costs the same for ten rules
+or ten thousand.
+"""
+from collections import deque
+from threading import Event, Lock, Thread
+import json
+import logging
+import os
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+MATCH_WORD = 'word'  # the keyword as a whole word anywhere in the text
+MATCH_FIRST_WORD = 'first_word'  # the text starts with the keyword as a word
+MATCH_EXACT = 'exact'  # the whole text is the keyword
+MATCH_CONTAINS = 'contains'  # the keyword anywhere, even inside a word
+MATCH_MODES = (MATCH_WORD, MATCH_FIRST_WORD, MATCH_EXACT, MATCH_CONTAINS)
+
+MATCH_SECONDS = metrics.histogram(
+    'sms_route_match_duration_seconds', 'Time to match one inbound SMS against the rules',
+    buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05))
+ROUTED = metrics.counter(
+    'sms_routed_total', 'Inbound SMS per matched route; unrouted counts the rest', ['route'])
+RELOADS = metrics.counter(
+    'sms_route_reloads_total', 'Rule file loads by outcome', ['result'])
+
+
+def normalize_text(text):
+    """Lower-case and collapse whitespace, as keywords are compiled."""
+    return ' '.join(str(text or '').lower().split())
+
+
+def sender_key(sender):
+    """Comparable form of a number or sender ID: no '+', spaces or dashes."""
+    key = str(sender or '').strip().lower()
+    if key.startswith('+'):
+        key = key[1:]
+    return ''.join(c for c in key if c not in ' -()')
+
+
+def _is_word_char(text, index):
+    return 0 <= index < len(text) and text[index].isalnum()
+
+
+def _accepts(mode, text, start, end):
+    if mode == MATCH_CONTAINS:
+        return True
+    if mode == MATCH_EXACT:
+        return start == 0 and end == len(text)
+    if _is_word_char(text, start - 1) or _is_word_char(text, end):
+        return False
+    return mode == MATCH_WORD or start == 0
+
+
+class _Automaton:
+    """Aho-Corasick automaton: one pass over the text finds every keyword."""
+
+    def __init__(self, patterns):
+        """
+        Args:
+            patterns: Iterable of (keyword, value) pairs
+        """
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        for keyword, value in patterns:
+            state = 0
+            for ch in keyword:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                state = nxt
+            self._out[state].append((len(keyword), value))
+
+        # Breadth-first, so every failure target is complete when used
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def search(self, text):
+        """Yield (start, end, value) for every keyword occurrence."""
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for length, value in out[state]:
+                yield i + 1 - length, i + 1, value
+
+
+class _PrefixTrie:
+    """Values stored under prefixes; lookup returns those of every prefix of a key."""
+
+    def __init__(self):
+        self._root = {}
+
+    def add(self, prefix, value):
+        node = self._root
+        for ch in prefix:
+            node = node.setdefault(ch, {})
+        node.setdefault(None, []).append(value)
+
+    def matches(self, key):
+        node = self._root
+        found = list(node.get(None, ()))
+        for ch in key:
+            node = node.get(ch)
+            if node is None:
+                break
+            found.extend(node.get(None, ()))
+        return found
+
+
+def _as_list(value, field, name):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [value]
+    if not isinstance(value, list):
+        raise ValueError("Rule {0}: {1} must be a string or a list".format(name, field))
+    return value
+
+
+def _compile_rule(rule, index):
+    if not isinstance(rule, dict):
+        raise ValueError("Rule #{0} is not an object".format(index))
+    name = rule.get('name')
+    if not name:
+        raise ValueError("Rule #{0} has no name".format(index))
+    keywords = [normalize_text(k) for k in _as_list(rule.get('keywords'), 'keywords', name)]
+    senders = [sender_key(s) for s in _as_list(rule.get('senders'), 'senders', name)]
+    keywords = [k for k in keywords if k]
+    senders = [s for s in senders if s]
+    if not keywords and not senders:
+        raise ValueError("Rule {0} needs keywords or senders".format(name))
+    match = rule.get('match', MATCH_WORD)
+    if match not in MATCH_MODES:
+        raise ValueError("Rule {0}: match must be one of {1}".format(
+            name, ', '.join(MATCH_MODES)))
+    try:
+        priority = int(rule.get('priority', 100))
+    except (TypeError, ValueError):
+        raise ValueError("Rule {0}: priority must be an integer".format(name))
+    return {
+        'name': str(name),
+        'route': str(rule.get('route') or name),
+        'keywords': keywords,
+        'senders': senders,
+        'match': match,
+        'priority': priority,
+        'final': bool(rule.get('final', False))
+    }
+
+
+class RuleSet:
+    """Compiled, read-only rules; a reload builds a new one and swaps it in."""
+
+    def __init__(self, rules):
+        """
+        Args:
+            rules: List of rule dicts as described in the module docstring
+        """
+        self.rules = [_compile_rule(rule, i) for i, rule in enumerate(rules)]
+        names = set()
+        for rule in self.rules:
+            if rule['name'] in names:
+                raise ValueError("Duplicate rule name: {0}".format(rule['name']))
+            names.add(rule['name'])
+
+        self._senders = _PrefixTrie()
+        patterns = []
+        for index, rule in enumerate(self.rules):
+            for keyword in rule['keywords']:
+                patterns.append((keyword, index))
+            for prefix in rule['senders']:
+                self._senders.add(prefix, index)
+        self._automaton = _Automaton(patterns)
+
+    def __len__(self):
+        return len(self.rules)
+
+    def match(self, number, text):
+        """Rules matching a message, in priority order."""
+        rules = self.rules
+        senders = set(self._senders.matches(sender_key(number)))
+        matched = set(i for i in senders if not rules[i]['keywords'])
+        text = normalize_text(text)
+        for start, end, index in self._automaton.search(text):
+            if index in matched:
+                continue
+            rule = rules[index]
+            if rule['senders'] and index not in senders:
+                continue
+            if _accepts(rule['match'], text, start, end):
+                matched.add(index)
+
+        result = []
+        for index in sorted(matched, key=lambda i: (rules[i]['priority'], i)):
+            result.append(rules[index])
+            if rules[index]['final']:
+                break
+        return result
+
+
+class SmsRouter:
+    def __init__(self, path=None, rules=None, reload_interval=5):
+        """
+        Initialize the router.
+
+        Args:
+            path: JSON rules file, reloaded whenever it changes
+            rules: Rules to use when there is no file
+            reload_interval: Seconds between checks of the file
+        """
+        self.path = path
+        self.reload_interval = reload_interval
+        self._ruleset = RuleSet(rules or [])
+        self._hits = dict((rule['name'], 0) for rule in self._ruleset.rules)
+        self._signature = None
+        self._lock = Lock()
+        self._stop = Event()
+        self._thread = None
+        self.loaded_at = time.time() if rules else None
+        self.reloads = 0
+        self.reload_errors = 0
+        self.last_error = None
+        self.routed = 0
+        self.unrouted = 0
+        if path:
+            self.reload()
+
+    def _file_signature(self):
+        stat = os.stat(self.path)
+        return stat.st_mtime, stat.st_size
+
+    def reload(self):
+        """Recompile the rules file; on any error the current rules stay active."""
+        try:
+            self._signature = self._file_signature()
+            with open(self.path) as f:
+                data = json.load(f)
+            ruleset = RuleSet(data.get('rules', []) if isinstance(data, dict) else data)
+        except (IOError, OSError, ValueError, TypeError) as e:
+            self.reload_errors += 1
+            self.last_error = str(e)
+            RELOADS.labels('failed').inc()
+            logger.error("Keeping current SMS routes, could not load %s: %s", self.path, str(e))
+            return False
+
+        with self._lock:
+            self._ruleset = ruleset  # routing in progress finishes on the old rules
+            # Counters follow the rule name across reloads
+            self._hits = dict((rule['name'], self._hits.get(rule['name'], 0))
+                              for rule in ruleset.rules)
+        self.reloads += 1
+        self.loaded_at = time.time()
+        self.last_error = None
+        RELOADS.labels('loaded').inc()
+        logger.info("Loaded %d SMS routing rules from %s", len(ruleset), self.path)
+        return True
+
+    def route(self, data):
+        """Tag an inbound SMS dict with 'routes' and 'rules' and return the routes."""
+        ruleset = self._ruleset
+        with MATCH_SECONDS.time():
+            rules = ruleset.match(data.get('number'), data.get('text'))
+
+        routes = []
+        for rule in rules:
+            if rule['route'] not in routes:
+                routes.append(rule['route'])
+        with self._lock:
+            for rule in rules:
+                if rule['name'] in self._hits:
+                    self._hits[rule['name']] += 1
+            if rules:
+                self.routed += 1
+            else:
+                self.unrouted += 1
+        for route in routes:
+            ROUTED.labels(route).inc()
+        if not routes:
+            ROUTED.labels('unrouted').inc()
+
+        data['routes'] = routes
+        data['rules'] = [rule['name'] for rule in rules]
+        return routes
+
+    def hits(self, limit=None):
+        """Per-rule hit counts, most used first."""
+        with self._lock:
+            rules = self._ruleset.rules
+            result = [{'rule': rule['name'], 'route': rule['route'],
+                       'hits': self._hits.get(rule['name'], 0)} for rule in rules]
+        result.sort(key=lambda r: -r['hits'])
+        return result[:limit] if limit else result
+
+    def start(self):
+        """Watch the rules file and reload it when it changes."""
+        if self._thread or not self.path:
+            return
+
+        def _run():
+            while not self._stop.wait(self.reload_interval):
+                try:
+                    signature = self._file_signature()
+                except (IOError, OSError):
+                    continue  # keep the rules while the file is being replaced
+                if signature != self._signature:
+                    self.reload()
+
+        self._stop.clear()
+        self._thread = Thread(target=_run, name='sms-router-reload')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def stats(self):
+        with self._lock:
+            rules = len(self._ruleset)
+            routed, unrouted = self.routed, self.unrouted
+        return {
+            'path': self.path,
+            'rules': rules,
+            'loaded_at': self.loaded_at,
+            'reloads': self.reloads,
+            'reload_errors': self.reload_errors,
+            'last_error': self.last_error,
+            'routed': routed,
+            'unrouted': unrouted
+        }
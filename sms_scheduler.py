@@ -0,0 +1,102 @@
+# sms_scheduler.py
+"""Event-driven stored-SMS processing with adaptive fallback polling."""
+from threading import Event, Thread
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+class StoredSmsScheduler:
+    def __init__(self, get_handler, min_interval=1, max_interval=60, backoff=2.0):
+        """
+        Initialize the scheduler.
+
+        Args:
+            get_handler: Callable returning the current ModemHandler/ModemPool
+                (or None while no modem is available)
+            min_interval: Polling interval used while messages keep arriving
+            max_interval: Longest polling interval when idle
+            backoff: Factor the interval grows by after each empty pass
+        """
+        self.get_handler = get_handler
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.interval = min_interval
+        self.passes = 0
+        self.notified_passes = 0
+        self.messages = 0
+        self.last_pass = None
+        self._full_pass = False
+        self._wake = Event()
+        self._stop = Event()
+        self._thread = None
+
+    def notify(self, data=None):
+        """Wake the scheduler now; used for +CMTI new-message notifications."""
+        self._wake.set()
+
+    def modem_ready(self, handler=None):
+        """Run a full pass now: a modem that just came up may hold stored SMS."""
+        self._full_pass = True
+        self._wake.set()
+
+    def start(self):
+        if self._thread:
+            return
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name='stored-sms-scheduler')
+        self._thread.daemon = True
+        self._thread.start()
+        logger.info("Stored SMS scheduler started (interval %s-%ss)",
+                    self.min_interval, self.max_interval)
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            notified = self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+
+            handler = self.get_handler()
+            if not handler or not handler.modem:
+                # Checking costs no serial I/O; stay quick to pick up stored
+                # SMS once a modem comes up
+                self.interval = self.min_interval
+                continue
+
+            full_pass, self._full_pass = self._full_pass, False
+            try:
+                found = handler.read_new_sms()
+                if notified and not full_pass:
+                    self.notified_passes += 1
+                else:
+                    # Fallback poll for anything the notifications missed
+                    found += handler.process_stored_sms()
+            except Exception as e:
+                logger.error("Stored SMS pass failed: %s", str(e))
+                found = 0
+
+            self.passes += 1
+            self.messages += found
+            self.last_pass = time.time()
+            if found or notified:
+                self.interval = self.min_interval
+            else:
+                self.interval = min(self.interval * self.backoff, self.max_interval)
+
+    def stats(self):
+        return {
+            'interval': self.interval,
+            'passes': self.passes,
+            'notified_passes': self.notified_passes,
+            'messages': self.messages,
+            'last_pass': self.last_pass
+        }
@@ -0,0 +1,283 @@
+# socket_fanout.py
+"""
+Micro-batched Socket.IO fan-out with filtered per-client feeds.
+
+Flow control is opt-in: a client that sends 'events_ack' {seq} after each
+frame is skipped while it has client_buffer frames unacknowledged, and told
+how many events it missed once it catches up. Clients that never ack get
+every frame. Unacknowledged frames expire after ack_timeout, so a client
+that stops acking is throttled rather than skipped for good.
+"""
+from collections import deque
+from threading import Condition, Lock, Thread
+import json
+import logging
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+FRAME_EVENT = 'events'
+DROPPED_EVENT = 'events_dropped'  # sent to a client that was skipped while lagging
+
+EVENTS_PUBLISHED = metrics.counter(
+    'socketio_emits_total', 'Socket.IO events published to the fan-out', ['event'])
+FRAMES_SENT = metrics.counter(
+    'socketio_frames_total', 'Batched Socket.IO frames emitted')
+EVENTS_DROPPED = metrics.counter(
+    'socketio_events_dropped_total', 'Events not delivered because a buffer was full',
+    ['reason'])
+
+
+class Feed:
+    def __init__(self, events=None, modem=None, prefix=None, route=None):
+        """
+        A subscription filter; clients with the same filter share one room.
+
+        Args:
+            events: Event names to receive, or None for all of them
+            modem: Only events whose data carries this modem port
+            prefix: Only events whose data number starts with this prefix
+            route: Only inbound SMS tagged with this route by the SMS router
+        """
+        self.events = frozenset(events) if events else None
+        self.modem = modem or None
+        self.prefix = prefix or None
+        self.route = route or None
+        self.room = 'feed:' + json.dumps(
+            [sorted(self.events) if self.events else None, self.modem, self.prefix,
+             self.route])
+        self.sids = set()
+
+    def matches(self, event, data):
+        if self.events is not None and event not in self.events:
+            return False
+        if not isinstance(data, dict):
+            return self.modem is None and self.prefix is None and self.route is None
+        if self.modem is not None and data.get('modem') != self.modem:
+            return False
+        if self.prefix is not None and not str(data.get('number') or '').startswith(self.prefix):
+            return False
+        if self.route is not None and self.route not in (data.get('routes') or ()):
+            return False
+        return True
+
+    def describe(self):
+        return {
+            'events': sorted(self.events) if self.events else None,
+            'modem': self.modem,
+            'prefix': self.prefix,
+            'route': self.route
+        }
+
+
+class SocketFanout:
+    def __init__(self, socketio, namespace='/', window=0.05, max_batch=100,
+                 client_buffer=50, max_pending=10000, ack_timeout=30):
+        """
+        Initialize the fan-out.
+
+        Args:
+            socketio: Flask-SocketIO instance
+            namespace: Namespace frames are emitted on
+            window: Seconds events are collected before a frame is emitted
+            max_batch: Events that trigger a frame before the window ends
+            client_buffer: Frames a client may have unacknowledged before
+                further frames skip it
+            max_pending: Events held for the next frame; the oldest are dropped
+            ack_timeout: Seconds after which an unacknowledged frame stops
+                counting against client_buffer
+        """
+        self.socketio = socketio
+        self.namespace = namespace
+        self.window = window
+        self.max_batch = max_batch
+        self.client_buffer = client_buffer
+        self.ack_timeout = ack_timeout
+        self._pending = deque(maxlen=max_pending)
+        self._cond = Condition()
+        self._lock = Lock()
+        self._feeds = {}  # room -> Feed
+        self._clients = {}  # sid -> {'feed', 'inflight', 'dropped', 'acks'}
+        self._seq = 0
+        self._running = False
+        self._thread = None
+        self.frames = 0
+        self.published = 0
+        self.dropped = 0
+
+    # Publishing
+
+    def publish(self, event, data):
+        """Queue an event for the next frame; never blocks on clients."""
+        EVENTS_PUBLISHED.labels(event).inc()
+        with self._cond:
+            if len(self._pending) == self._pending.maxlen:
+                self.dropped += 1
+                EVENTS_DROPPED.labels('pending').inc()
+            self._pending.append((event, data))
+            self.published += 1
+            # Wake the sender to open a window, or to flush a full batch early
+            if len(self._pending) in (1, self.max_batch):
+                self._cond.notify()
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = Thread(target=self._run, name='socket-fanout')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout=5)
+        self._flush()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and not self._pending:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                # Let the window fill unless a full batch is already waiting
+                deadline = time.time() + self.window
+                while self._running and len(self._pending) < self.max_batch:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            try:
+                self._flush()
+            except Exception as e:
+                logger.error("Socket.IO fan-out failed: %s", str(e), exc_info=True)
+
+    def _flush(self):
+        with self._cond:
+            if not self._pending:
+                return
+            batch = [self._pending.popleft()
+                     for _ in range(min(self.max_batch, len(self._pending)))]
+            more = bool(self._pending)
+        with self._lock:
+            feeds = [feed for feed in self._feeds.values() if feed.sids]
+        for feed in feeds:
+            events = [{'event': event, 'data': data}
+                      for event, data in batch if feed.matches(event, data)]
+            if events:
+                self._emit_frame(feed, events)
+        if more:
+            with self._cond:
+                self._cond.notify()
+
+    def _emit_frame(self, feed, events):
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+            now = time.monotonic()
+            skip = []
+            resumed = []
+            for sid in feed.sids:
+                client = self._clients[sid]
+                if not client['acks']:
+                    continue  # never acked: not flow controlled
+                inflight = client['inflight']
+                while inflight and now - inflight[0][1] > self.ack_timeout:
+                    inflight.popleft()
+                if len(inflight) >= self.client_buffer:
+                    client['dropped'] += len(events)
+                    skip.append(sid)
+                    continue
+                inflight.append((seq, now))
+                if client['dropped']:
+                    resumed.append((sid, client['dropped']))
+                    client['dropped'] = 0
+            everyone_skipped = len(skip) == len(feed.sids)
+        if skip:
+            self.dropped += len(events) * len(skip)
+            EVENTS_DROPPED.labels('slow_client').inc(len(events) * len(skip))
+        for sid, count in resumed:
+            self.socketio.emit(DROPPED_EVENT, {'dropped': count}, to=sid,
+                               namespace=self.namespace)
+        if everyone_skipped:
+            return
+        # One emit per room: the frame is encoded once for every member
+        self.socketio.emit(FRAME_EVENT, {'seq': seq, 'events': events}, to=feed.room,
+                           namespace=self.namespace, skip_sid=skip or None)
+        self.frames += 1
+        FRAMES_SENT.inc()
+
+    # Clients
+
+    def connect(self, sid, events=None, modem=None, prefix=None, route=None):
+        """Register a client and put it in the feed matching its filter."""
+        with self._lock:
+            self._clients[sid] = {'feed': None, 'inflight': deque(), 'dropped': 0,
+                                  'acks': False}
+        self.subscribe(sid, events, modem, prefix, route)
+
+    def subscribe(self, sid, events=None, modem=None, prefix=None, route=None):
+        """Move a client to the feed for the given filter; returns the feed."""
+        feed = Feed(events, modem, prefix, route)
+        with self._lock:
+            client = self._clients.get(sid)
+            if client is None:
+                return None
+            feed = self._feeds.setdefault(feed.room, feed)
+            previous = client['feed']
+            if previous is feed:
+                return feed
+            if previous is not None:
+                self._leave(sid, previous)
+            feed.sids.add(sid)
+            client['feed'] = feed
+        self.socketio.server.enter_room(sid, feed.room, namespace=self.namespace)
+        return feed
+
+    def ack(self, sid, seq):
+        """Record that a client processed every frame up to seq."""
+        with self._lock:
+            client = self._clients.get(sid)
+            if client is None:
+                return
+            client['acks'] = True
+            inflight = client['inflight']
+            while inflight and inflight[0][0] <= seq:
+                inflight.popleft()
+
+    def disconnect(self, sid):
+        with self._lock:
+            client = self._clients.pop(sid, None)
+            if client and client['feed'] is not None:
+                self._leave(sid, client['feed'], leave_room=False)
+
+    def _leave(self, sid, feed, leave_room=True):
+        feed.sids.discard(sid)
+        if not feed.sids:
+            self._feeds.pop(feed.room, None)
+        if leave_room:
+            self.socketio.server.leave_room(sid, feed.room, namespace=self.namespace)
+
+    def stats(self):
+        with self._cond:
+            pending = len(self._pending)
+        with self._lock:
+            clients = len(self._clients)
+            lagging = sum(1 for c in self._clients.values()
+                          if len(c['inflight']) >= self.client_buffer)
+            feeds = [dict(feed.describe(), clients=len(feed.sids))
+                     for feed in self._feeds.values()]
+        return {
+            'published': self.published,
+            'frames': self.frames,
+            'dropped': self.dropped,
+            'pending': pending,
+            'clients': clients,
+            'lagging_clients': lagging,
+            'feeds': feeds
+        }
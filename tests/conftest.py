@@ -0,0 +1,74 @@
+# tests/conftest.py
+"""Shared fixtures; everything runs against the simulated modem in fake_modem.py."""
+import os
+import sys
+import time
+
+import jwt
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from config import Config  # noqa: E402
+from fake_modem import DEFAULT_LATENCY  # noqa: E402
+
+# Millisecond AT commands keep the suite fast without changing behaviour
+FAST_LATENCY = dict((command, ('uniform', 0.001, 0.002)) for command in DEFAULT_LATENCY)
+
+# /send_sms parts allowed per caller address during the run
+SEND_SMS_LIMIT = (3, 3600)
+
+
+class FakeConfig:
+    """Just the FAKE_MODEM_* settings FakeGsmModem reads."""
+    FAKE_MODEM_LATENCY = FAST_LATENCY
+
+
+@pytest.fixture(scope='session')
+def gateway(tmp_path_factory):
+    """The app module in single-process mode with one simulated modem, once per run."""
+    workdir = str(tmp_path_factory.mktemp('gateway'))
+    Config.MODEM_BACKEND = 'fake'
+    Config.MODEM_PORTS = ['sim0']
+    Config.FAKE_MODEM_LATENCY = FAST_LATENCY
+    Config.MODEM_DAEMON_SOCKET = None
+    Config.ASYNC_MODE = None
+    Config.CODE_STORE_BACKEND = 'memory'
+    Config.SMS_ROUTES_FILE = None
+    Config.WEBHOOKS = []
+    Config.SMS_QUEUE_DB = os.path.join(workdir, 'sms_queue.db')
+    Config.MESSAGE_STORE_DB = os.path.join(workdir, 'messages.db')
+    Config.CODE_STORE_DB = os.path.join(workdir, 'codes.db')
+    Config.WEBHOOK_SPOOL_DIR = os.path.join(workdir, 'webhook_spool')
+    Config.SEND_SMS_SEGMENT_LIMIT_PER_CLIENT = SEND_SMS_LIMIT
+
+    import app
+    deadline = time.time() + 10
+    while not app.modem_supervisor.ready:
+        if time.time() > deadline:
+            pytest.fail("Simulated modem did not come up")
+        time.sleep(0.01)
+    return app
+
+
+@pytest.fixture
+def client(gateway):
+    return gateway.app.test_client()
+
+
+@pytest.fixture
+def auth_headers(gateway):
+    token = jwt.encode({'phone': '+261340000001', 'exp': int(time.time()) + 600},
+                       gateway.auth_manager.secret_key, algorithm='HS256')
+    return {'Authorization': 'Bearer {0}'.format(token)}
+
+
+def wait_for(predicate, timeout=5):
+    """Poll predicate until it is true; returns its last value."""
+    deadline = time.time() + timeout
+    result = predicate()
+    while not result and time.time() < deadline:
+        time.sleep(0.01)
+        result = predicate()
+    return result
@@ -0,0 +1,107 @@
+# tests/test_app.py
+"""HTTP behaviour of app.py against one simulated modem."""
+import pytest
+
+from conftest import SEND_SMS_LIMIT, wait_for
+
+
+@pytest.mark.parametrize('payload', [
+    {'messages': [{'number': '+261340000001', 'message': {'a': 1}}]},
+    {'recipients': ['+261340000001'], 'message': ['x']},
+    {'recipients': [{'a': 1}], 'message': 'x'},
+    {'recipients': '+261340000001', 'message': 'x'},
+    {'messages': ['+261340000001']}
+])
+def test_batch_rejects_malformed_payloads(client, payload):
+    response = client.post('/send_sms/batch', json=payload)
+    assert response.status_code == 400
+    assert response.get_json()['message'].startswith('Invalid batch payload')
+
+
+def test_batch_rejects_a_bad_json_line(client):
+    body = '{"number": "+261340000001", "message": "hi"}\n[1, 2]\n'
+    response = client.post('/send_sms/batch', data=body, content_type='application/x-ndjson')
+    assert response.status_code == 400
+
+
+def test_batch_is_queued_and_sent(gateway, client):
+    response = client.post('/send_sms/batch?message=Hello', json={
+        'recipients': ['+261340000001', '+261 34 000 0001', '+261340000002', 'nope']})
+    assert response.status_code == 202
+    batch = response.get_json()['batch']
+    assert (batch['total'], batch['duplicates'], batch['rejected']) == (2, 1, 1)
+    assert wait_for(lambda: gateway.sms_queue.get_batch(batch['batch_id'])['sent'] == 2)
+
+
+@pytest.mark.parametrize('payload', [
+    {'number': '+261340000001', 'message': 5},
+    {'number': ['+261340000001'], 'message': 'hi'},
+    {'number': '+261340000001'},
+    {'number': '+261340000001', 'message': 'hi', 'priority': 'auth'}
+])
+def test_send_sms_rejects_bad_input(client, payload):
+    assert client.post('/send_sms', json=payload).status_code == 400
+
+
+def test_send_sms_limit_follows_the_caller_address(gateway):
+    client = gateway.app.test_client()
+    client.environ_base['REMOTE_ADDR'] = '192.0.2.10'
+    count = SEND_SMS_LIMIT[0]
+    for i in range(count):
+        response = client.post('/send_sms', json={'number': '+261340000001', 'message': 'hi'},
+                               headers={'X-Client-Id': 'client-{0}'.format(i)})
+        assert response.status_code == 202
+    response = client.post('/send_sms', json={'number': '+261340000001', 'message': 'hi'},
+                           headers={'X-Client-Id': 'client-new'})
+    assert response.status_code == 429
+    # Another address has its own allowance
+    client.environ_base['REMOTE_ADDR'] = '192.0.2.11'
+    response = client.post('/send_sms', json={'number': '+261340000001', 'message': 'hi'})
+    assert response.status_code == 202
+
+
+@pytest.mark.parametrize('url, payload', [
+    ('/send_ussd', {'ussd_code': '*123#', 'max_age': 'abc'}),
+    ('/send_ussd', {'ussd_code': '*123#', 'max_age': [30]}),
+    ('/send_ussd?max_age=soon', {'ussd_code': '*123#'}),
+    ('/send_ussd', {})
+])
+def test_send_ussd_rejects_bad_input(client, url, payload):
+    assert client.post(url, json=payload).status_code == 400
+
+
+def test_send_ussd_answer_is_cached(client):
+    first = client.post('/send_ussd', json={'ussd_code': '*155#', 'max_age': '60'})
+    second = client.post('/send_ussd?max_age=60', json={'ussd_code': '*155#'})
+    assert first.status_code == second.status_code == 200
+    assert (first.get_json()['cached'], second.get_json()['cached']) == (False, True)
+
+
+@pytest.mark.parametrize('method, url', [
+    ('get', '/messages'),
+    ('get', '/debug/modem-trace'),
+    ('post', '/debug/modem-trace'),
+    ('post', '/forward_sms'),
+    ('post', '/sms/routes/reload')
+])
+def test_routes_require_auth(client, method, url):
+    assert getattr(client, method)(url, json={}).status_code == 401
+
+
+@pytest.mark.parametrize('query', ['cursor=abc', 'cursor=1.5', 'since=yesterday', 'limit=x'])
+def test_messages_rejects_bad_query(client, auth_headers, query):
+    response = client.get('/messages?' + query, headers=auth_headers)
+    assert response.status_code == 400
+
+
+def test_messages_hides_verification_codes(gateway, client, auth_headers):
+    response = client.post('/auth/send-code', json={'phone_number': '+261340000099'})
+    assert response.status_code == 200
+    code = gateway.code_store.get('+261340000099')['code']
+
+    def outbound():
+        response = client.get('/messages?number=%2B261340000099', headers=auth_headers)
+        return response.get_json()['messages']
+    messages = wait_for(outbound)
+    assert messages
+    assert not any(code in (m.get('text') or '') for m in messages)
@@ -0,0 +1,69 @@
+# tests/test_code_store.py
+import time
+
+import pytest
+
+from code_store import CodeStore, SqliteCodeStore
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def make_store(request, tmp_path):
+    def make(capacity=100):
+        if request.param == 'sqlite':
+            return SqliteCodeStore(str(tmp_path / 'codes.db'), capacity=capacity)
+        return CodeStore(capacity=capacity)
+    return make
+
+
+def test_set_get_pop(make_store):
+    store = make_store()
+    expiry = time.time() + 60
+    store.set('+261340000001', '123456', expiry)
+    store.set('+261340000001', '654321', expiry)
+    assert len(store) == 1
+    assert store.get('+261340000001') == {'code': '654321', 'expiry': expiry}
+    assert store.pop('+261340000001')['code'] == '654321'
+    assert store.get('+261340000001') is None
+    assert store.pop('+261340000001') is None
+    stats = store.stats()
+    assert (stats['stored'], stats['hits'], stats['misses']) == (2, 1, 1)
+
+
+def test_sweep_removes_only_expired(make_store):
+    store = make_store()
+    store.set('old', '1', time.time() - 1)
+    store.set('new', '2', time.time() + 60)
+    assert store.sweep() == 1
+    assert store.get('old') is None
+    assert store.get('new')['code'] == '2'
+
+
+def test_full_store_evicts_soonest_expiry(make_store):
+    store = make_store(capacity=2)
+    now = time.time()
+    store.set('a', '1', now + 30)
+    store.set('b', '2', now + 10)
+    store.set('c', '3', now + 60)
+    assert len(store) == 2
+    assert store.get('b') is None
+    assert store.get('a') and store.get('c')
+    assert store.stats()['evicted'] == 1
+
+
+def test_full_store_sweeps_before_evicting(make_store):
+    store = make_store(capacity=2)
+    now = time.time()
+    store.set('expired', '1', now - 1)
+    store.set('a', '2', now + 10)
+    store.set('b', '3', now + 60)
+    assert store.get('a') and store.get('b')
+    assert store.stats()['evicted'] == 0
+
+
+def test_sqlite_store_is_shared(tmp_path):
+    path = str(tmp_path / 'codes.db')
+    writer, reader = SqliteCodeStore(path), SqliteCodeStore(path)
+    writer.set('+261340000001', '123456', time.time() + 60)
+    assert reader.get('+261340000001')['code'] == '123456'
+    assert reader.pop('+261340000001') is not None
+    assert writer.get('+261340000001') is None
@@ -0,0 +1,79 @@
+# tests/test_delivery_reports.py
+import time
+
+import pytest
+
+from delivery_reports import (DELIVERY_DELIVERED, DELIVERY_FAILED, DELIVERY_PENDING,
+                              DELIVERY_UNKNOWN, DeliveryTracker, report_status)
+from fake_modem import FakeStatusReport
+
+
+@pytest.fixture
+def deliveries():
+    return []
+
+
+@pytest.fixture
+def tracker(deliveries):
+    return DeliveryTracker(deliveries.append, ttl=60, early_window=30)
+
+
+def test_report_status():
+    assert report_status(0x00) == DELIVERY_DELIVERED
+    assert report_status(0x20) == DELIVERY_PENDING
+    assert report_status(FakeStatusReport.FAILED) == DELIVERY_FAILED
+    assert report_status(None) == DELIVERY_UNKNOWN
+
+
+def test_report_matches_tracked_message(tracker, deliveries):
+    tracker.track('sim0', 5, 'job-1', '+261340000001')
+    tracker.track('sim1', 5, 'job-2', '+261340000002')
+    # National format for the same number still matches
+    tracker.handle_report('sim0', FakeStatusReport(5, '0340000001', FakeStatusReport.DELIVERED))
+    tracker.handle_report('sim1', FakeStatusReport(5, '+261340000002', FakeStatusReport.FAILED))
+    assert [(d['job_id'], d['delivery_status'], d['status_code']) for d in deliveries] == [
+        ('job-1', DELIVERY_DELIVERED, 0), ('job-2', DELIVERY_FAILED, 68)]
+    assert tracker.stats()['pending'] == 0
+
+
+def test_intermediate_report_keeps_waiting(tracker, deliveries):
+    tracker.track('sim0', 5, 'job-1', '+261340000001')
+    tracker.handle_report('sim0', FakeStatusReport(5, '+261340000001', 0x20))
+    assert deliveries == []
+    tracker.handle_report('sim0', FakeStatusReport(5, '+261340000001', 0x00))
+    assert [d['delivery_status'] for d in deliveries] == [DELIVERY_DELIVERED]
+
+
+def test_report_that_beats_track_is_replayed(tracker, deliveries):
+    tracker.handle_report('sim0', FakeStatusReport(9, '+261340000001', 0x00))
+    assert deliveries == [] and tracker.stats()['early_reports'] == 1
+    tracker.track('sim0', 9, 'job-1', '+261340000001')
+    assert [d['job_id'] for d in deliveries] == ['job-1']
+    assert tracker.stats()['early_reports'] == 0
+
+
+def test_report_for_another_number_does_not_match(tracker, deliveries):
+    tracker.track('sim0', 5, 'job-1', '+261340000001')
+    tracker.handle_report('sim0', FakeStatusReport(5, '+261349999999', 0x00))
+    assert deliveries == []
+    assert tracker.stats()['pending'] == 1
+
+
+def test_unmatched_reports_expire(deliveries):
+    tracker = DeliveryTracker(deliveries.append, early_window=0)
+    tracker.handle_report('sim0', FakeStatusReport(9, '+261340000001', 0x00))
+    tracker.sweep()
+    assert tracker.stats()['early_reports'] == 0
+    assert tracker.stats()['unmatched'] == 1
+
+
+def test_overdue_and_reused_references_are_evicted(deliveries):
+    tracker = DeliveryTracker(deliveries.append, ttl=0.05)
+    tracker.track('sim0', 1, 'job-1', '+261340000001')
+    tracker.track('sim0', 1, 'job-2', '+261340000001')  # reference wrapped around
+    assert [(d['job_id'], d['delivery_status']) for d in deliveries] == [
+        ('job-1', DELIVERY_UNKNOWN)]
+    time.sleep(0.06)
+    assert tracker.sweep() == 1
+    assert deliveries[-1]['job_id'] == 'job-2'
+    assert deliveries[-1]['delivery_status'] == DELIVERY_UNKNOWN
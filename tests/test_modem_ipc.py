@@ -0,0 +1,135 @@
+# tests/test_modem_ipc.py
+import os
+import socket
+import stat
+import struct
+from threading import Event, Thread
+
+import pytest
+
+from conftest import wait_for
+from event_bus import EventBus, SMS_RECEIVED
+from modem_daemon import ModemDaemon
+from modem_executor import ModemExecutor
+from modem_ipc import (HEADER, MAX_FRAME, ModemClient, ModemDaemonError, RemoteProxy,
+                       encode_frame, recv_frame, send_frame)
+
+
+@pytest.fixture
+def pair():
+    left, right = socket.socketpair()
+    yield left, right
+    left.close()
+    right.close()
+
+
+def test_frame_round_trip(pair):
+    left, right = pair
+    send_frame(left, {'i': 1, 'm': 'queue.stats', 'a': [], 'k': {'text': u'Salut à tous'}})
+    send_frame(left, {'i': 2, 'r': None})
+    assert recv_frame(right) == {'i': 1, 'm': 'queue.stats', 'a': [],
+                                 'k': {'text': u'Salut à tous'}}
+    assert recv_frame(right) == {'i': 2, 'r': None}
+
+
+def test_frame_split_across_reads(pair):
+    left, right = pair
+    frame = encode_frame({'t': SMS_RECEIVED, 'd': {'text': 'x' * 1000}})
+    assert struct.unpack('>I', frame[:HEADER.size])[0] == len(frame) - HEADER.size
+
+    def dribble():
+        for i in range(0, len(frame), 7):
+            left.sendall(frame[i:i + 7])
+    thread = Thread(target=dribble)
+    thread.start()
+    assert recv_frame(right)['d']['text'] == 'x' * 1000
+    thread.join()
+
+
+def test_closed_peer_and_oversized_frames(pair):
+    left, right = pair
+    left.sendall(HEADER.pack(MAX_FRAME + 1))
+    with pytest.raises(ModemDaemonError):
+        recv_frame(right)
+    left.sendall(HEADER.pack(10) + b'{"i"')
+    left.close()
+    assert recv_frame(right) is None
+
+
+@pytest.fixture
+def daemon(tmp_path):
+    release = Event()
+    executor = ModemExecutor('sim0')
+
+    def slow():
+        # Parked on the modem thread like a USSD session
+        return executor.submit(lambda: release.wait(5) and 'slow')
+
+    def fail(kind):
+        raise {'value': ValueError, 'other': IOError}[kind]("failed: {0}".format(kind))
+
+    methods = {
+        'echo': lambda *args, **kwargs: [list(args), kwargs],
+        'queue.depth': lambda: 3,
+        'slow': slow,
+        'fail': fail
+    }
+    bus = EventBus()
+    daemon = ModemDaemon(str(tmp_path / 'modem.sock'), methods, bus, workers=2, mode=0o600)
+    daemon.start()
+    daemon.bus = bus
+    daemon.release = release
+    yield daemon
+    release.set()
+    daemon.stop()
+    executor.stop()
+
+
+def test_calls_through_the_daemon(daemon):
+    client = ModemClient(daemon.path, timeout=5)
+    try:
+        assert client.call('echo', 1, 'a', flag=True) == [[1, 'a'], {'flag': True}]
+        assert RemoteProxy(client, 'queue').depth() == 3
+        with pytest.raises(ValueError):
+            client.call('fail', 'value')
+        with pytest.raises(ModemDaemonError):
+            client.call('fail', 'other')
+    finally:
+        client.close()
+
+
+def test_slow_call_does_not_block_others(daemon):
+    client = ModemClient(daemon.path, timeout=5)
+    results = []
+    try:
+        thread = Thread(target=lambda: results.append(client.call('slow')))
+        thread.start()
+        assert wait_for(lambda: client.stats()['in_flight'] == 1)
+        # Replies come back in completion order on the same connection
+        assert client.call('queue.depth') == 3
+        daemon.release.set()
+        thread.join(5)
+        assert results == ['slow']
+    finally:
+        client.close()
+
+
+def test_events_reach_one_worker(daemon):
+    workers = [ModemClient(daemon.path, timeout=5) for _ in range(2)]
+    received = []
+    try:
+        for index, worker in enumerate(workers):
+            worker.stream(lambda topic, data, work, index=index:
+                          received.append((index, topic, data, work)), retry_interval=0.05)
+        assert wait_for(lambda: daemon.stats()['workers'] == 2)
+        daemon.bus.publish(SMS_RECEIVED, {'number': '+261340000001', 'text': 'hi'})
+        assert wait_for(lambda: len(received) == 2)
+        assert sorted(index for index, _, _, _ in received) == [0, 1]
+        assert [work for _, _, _, work in received].count(True) == 1
+    finally:
+        for worker in workers:
+            worker.close()
+
+
+def test_socket_is_not_world_accessible(daemon):
+    assert stat.S_IMODE(os.stat(daemon.path).st_mode) == 0o600
@@ -0,0 +1,22 @@
+# tests/test_modem_trace.py
+from conftest import FakeConfig
+from fake_modem import FakeGsmModem
+from modem_trace import ModemTracer
+
+
+def test_sms_body_is_not_recorded():
+    modem = FakeGsmModem('sim0', config=FakeConfig)
+    tracer = ModemTracer(enabled=True)
+    tracer.attach(modem, 'sim0')
+    modem.write('AT+CSQ')
+    modem.sendSms('+261340000001', 'Your code is 482913')
+    modem.write('AT+COPS?')
+
+    commands = [(e['data'], e['bytes_out']) for e in tracer.events() if e['kind'] == 'command']
+    assert commands == [
+        ('AT+CSQ', 6),
+        ('AT+CMGS="+261340000001"', 23),
+        ('<19 bytes redacted>', 19),
+        ('AT+COPS?', 8)
+    ]
+    assert '482913' not in tracer.dump_jsonl()
@@ -0,0 +1,61 @@
+# tests/test_rate_limit.py
+from rate_limit import RateLimiter, TokenBucket
+
+
+def test_bucket_refills_at_rate():
+    bucket = TokenBucket(rate=2, capacity=2)
+    now = bucket.updated
+    bucket.consume(2)
+    assert bucket.wait_time(1, now) == 0.5
+    assert bucket.wait_time(1, now + 0.5) == 0.0
+    # Never refills past capacity
+    assert bucket.wait_time(2, now + 100) == 0.0
+    assert bucket.tokens == 2
+
+
+def test_cost_above_capacity_is_paid_back_as_debt():
+    bucket = TokenBucket(rate=1, capacity=2)
+    now = bucket.updated
+    assert bucket.wait_time(5, now) == 0.0
+    bucket.consume(5)
+    assert bucket.wait_time(1, now) == 4.0
+
+
+def test_limited_after_burst():
+    limiter = RateLimiter()
+    limiter.add_limit('phone', 1 / 60.0, 3)
+    for _ in range(3):
+        assert limiter.check([('phone', '+261340000001')])[0]
+    allowed, retry_after, scope = limiter.check([('phone', '+261340000001')])
+    assert not allowed and scope == 'phone'
+    assert 59 < retry_after <= 60
+    # Other keys have their own bucket
+    assert limiter.check([('phone', '+261340000002')])[0]
+    assert limiter.stats()['limited'] == {'phone': 1}
+
+
+def test_check_takes_from_all_buckets_or_none():
+    limiter = RateLimiter()
+    limiter.add_limit('phone', 0, 1)
+    limiter.add_limit('ip', 0, 2)
+    assert limiter.check([('phone', 'a'), ('ip', '10.0.0.1')])[0]
+    assert limiter.check([('phone', 'a'), ('ip', '10.0.0.1')])[2] == 'phone'
+    # The refused check above did not use up the ip bucket
+    assert limiter.check([('phone', 'b'), ('ip', '10.0.0.1')])[0]
+    assert limiter.check([('phone', 'c'), ('ip', '10.0.0.1')])[2] == 'ip'
+
+
+def test_scopes_without_a_limit_are_ignored():
+    limiter = RateLimiter()
+    assert limiter.check([('client', 'x')], cost=100) == (True, 0.0, None)
+
+
+def test_least_recently_used_keys_are_dropped():
+    limiter = RateLimiter(max_keys=2)
+    limiter.add_limit('ip', 0, 1)
+    for key in ('a', 'b', 'c'):
+        assert limiter.check([('ip', key)])[0]
+    assert limiter.stats()['buckets'] == {'ip': 2}
+    # 'a' was dropped, so it starts with a full bucket again
+    assert limiter.check([('ip', 'a')])[0]
+    assert not limiter.check([('ip', 'c')])[0]
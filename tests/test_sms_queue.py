@@ -0,0 +1,114 @@
+# tests/test_sms_queue.py
+from threading import Lock
+
+import pytest
+
+from conftest import wait_for
+from sms_queue import (PRIORITY_AUTH, PRIORITY_BULK, PRIORITY_TRANSACTIONAL, STATUS_SENT,
+                       SmsQueue, normalize_number)
+
+
+class RecordingModem:
+    """Stands in for the modem pool and records the send order."""
+
+    def __init__(self):
+        self.sent = []
+        self._lock = Lock()
+
+    def send_sms(self, number, message, sensitive=False):
+        with self._lock:
+            self.sent.append((number, message, sensitive))
+        return {'modem': 'sim0', 'reference': None}
+
+
+@pytest.fixture
+def make_queue(tmp_path):
+    queues = []
+
+    def make(**kwargs):
+        queue = SmsQueue(RecordingModem(), str(tmp_path / 'sms_queue.db'),
+                         retry_delay=0.01, **kwargs)
+        queues.append(queue)
+        return queue
+    yield make
+    for queue in queues:
+        queue.stop()
+
+
+def run(queue, count):
+    queue.start()
+    assert wait_for(lambda: len(queue.modem_handler.sent) == count)
+    return queue.modem_handler.sent
+
+
+def test_clients_take_turns_within_a_class(make_queue):
+    queue = make_queue()
+    for i in range(4):
+        queue.enqueue('+26134000000{0}'.format(i), 'a{0}'.format(i), client='a')
+    for i in range(2):
+        queue.enqueue('+26133000000{0}'.format(i), 'b{0}'.format(i), client='b')
+    sent = run(queue, 6)
+    assert [message for _, message, _ in sent] == ['a0', 'b0', 'a1', 'b1', 'a2', 'a3']
+
+
+def test_higher_classes_go_first(make_queue):
+    queue = make_queue()
+    queue.enqueue('+261340000001', 'bulk', priority=PRIORITY_BULK)
+    queue.enqueue('+261340000002', 'transactional', priority=PRIORITY_TRANSACTIONAL)
+    queue.enqueue('+261340000003', 'code', priority=PRIORITY_AUTH)
+    sent = run(queue, 3)
+    assert [message for _, message, _ in sent] == ['code', 'transactional', 'bulk']
+    # Only verification codes are sent as sensitive
+    assert [sensitive for _, _, sensitive in sent] == [True, False, False]
+
+
+def test_weights_and_parts_set_the_share(make_queue):
+    queue = make_queue(client_weights={'heavy': 2})
+    long_text = 'x' * 400  # three GSM-7 parts
+    for i in range(3):
+        queue.enqueue('+26134000000{0}'.format(i), 'h{0}'.format(i), client='heavy')
+    queue.enqueue('+261330000001', 'l1', client='light')
+    queue.enqueue('+261330000002', long_text, client='light')
+    sent = run(queue, 5)
+    # A part costs 'heavy' half as much; the long message costs 'light' three
+    assert [message[:2] for _, message, _ in sent] == ['h0', 'h1', 'l1', 'h2', 'xx']
+
+
+def test_batch_dedupes_and_rejects(make_queue):
+    queue = make_queue()
+    batch = queue.enqueue_batch([
+        ('+261 34 000 0001', 'hi'),
+        ('00261340000001', 'hi'),
+        ('not a number', 'hi'),
+        ('+261340000002', ''),
+        ('+261340000003', 'hi')
+    ])
+    assert (batch['total'], batch['duplicates'], batch['rejected']) == (2, 1, 2)
+    run(queue, 2)
+    assert wait_for(lambda: queue.get_batch(batch['batch_id'])['sent'] == 2)
+
+
+def test_failed_batch_queues_nothing(make_queue):
+    queue = make_queue()
+
+    def items():
+        yield '+261340000001', 'hi'
+        raise ValueError("bad line")
+
+    with pytest.raises(ValueError):
+        queue.enqueue_batch(items())
+    assert queue.depth() == 0
+
+
+def test_jobs_survive_a_restart(make_queue):
+    job = make_queue().enqueue('+261340000001', 'hello')
+    queue = make_queue()
+    run(queue, 1)
+    assert wait_for(lambda: queue.get_job(job['job_id'])['status'] == STATUS_SENT)
+
+
+def test_normalize_number():
+    assert normalize_number('+261 34-000.0001') == '+261340000001'
+    assert normalize_number('00261340000001') == '+261340000001'
+    assert normalize_number('12') is None
+    assert normalize_number('+26134abc') is None
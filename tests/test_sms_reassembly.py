@@ -0,0 +1,82 @@
+# tests/test_sms_reassembly.py
+import pytest
+
+from conftest import wait_for
+from fake_modem import FakeConcatenation, FakeReceivedSms
+from sms_reassembly import SmsReassembler, concat_info
+
+
+@pytest.fixture
+def emitted():
+    return []
+
+
+@pytest.fixture
+def make_reassembler(emitted):
+    reassemblers = []
+
+    def make(**kwargs):
+        reassembler = SmsReassembler(emitted.append, **kwargs)
+        reassemblers.append(reassembler)
+        return reassembler
+    yield make
+    for reassembler in reassemblers:
+        reassembler.close()
+
+
+def part(text, number='+261340000001', modem='sim0'):
+    return {'number': number, 'text': text, 'modem': modem, 'time': '2026-01-01T00:00:00'}
+
+
+def test_concat_info_reads_the_header():
+    sms = FakeReceivedSms('+261340000001', 'abc', udh=[FakeConcatenation(7, 3, 2)])
+    assert concat_info(sms) == (7, 3, 2)
+    assert concat_info(FakeReceivedSms('+261340000001', 'abc')) is None
+    assert concat_info(FakeReceivedSms('+261340000001', 'abc',
+                                       udh=[FakeConcatenation(7, 3, 4)])) is None
+
+
+def test_parts_in_any_order(make_reassembler, emitted):
+    reassembler = make_reassembler()
+    reassembler.add(part('C'), (7, 3, 3))
+    reassembler.add(part('A'), (7, 3, 1))
+    assert emitted == []
+    reassembler.add(part('A'), (7, 3, 1))  # retransmitted part
+    reassembler.add(part('B'), (7, 3, 2))
+    assert [(m['text'], m['parts']) for m in emitted] == [('ABC', 3)]
+    assert 'partial' not in emitted[0]
+    stats = reassembler.stats()
+    assert (stats['completed'], stats['duplicates'], stats['pending']) == (1, 1, 0)
+
+
+def test_same_reference_from_different_senders(make_reassembler, emitted):
+    reassembler = make_reassembler()
+    reassembler.add(part('A1', number='+261340000001'), (7, 2, 1))
+    reassembler.add(part('B1', number='+261340000002'), (7, 2, 1))
+    reassembler.add(part('A2', number='+261340000001'), (7, 2, 2))
+    assert [m['text'] for m in emitted] == ['A1A2']
+
+
+def test_missing_part_is_flushed_after_timeout(make_reassembler, emitted):
+    reassembler = make_reassembler(timeout=0.05)
+    reassembler.add(part('A'), (9, 3, 1))
+    reassembler.add(part('C'), (9, 3, 3))
+    assert wait_for(lambda: emitted)
+    assert emitted[0]['text'] == 'AC'
+    assert emitted[0]['partial'] is True
+    assert emitted[0]['missing_parts'] == [2]
+
+
+def test_oldest_message_is_flushed_when_memory_runs_out(make_reassembler, emitted):
+    reassembler = make_reassembler(max_bytes=10)
+    reassembler.add(part('x' * 6, number='+261340000001'), (1, 2, 1))
+    reassembler.add(part('y' * 6, number='+261340000002'), (1, 2, 1))
+    assert [(m['number'], m['missing_parts']) for m in emitted] == [('+261340000001', [2])]
+    assert reassembler.stats()['buffered_bytes'] == 6
+
+
+def test_close_delivers_what_is_buffered(make_reassembler, emitted):
+    reassembler = make_reassembler()
+    reassembler.add(part('A'), (3, 2, 1))
+    reassembler.close()
+    assert [m['missing_parts'] for m in emitted] == [[2]]
@@ -0,0 +1,76 @@
+# tests/test_sms_router.py
+import json
+import random
+
+from sms_router import (MATCH_CONTAINS, MATCH_EXACT, MATCH_FIRST_WORD, MATCH_WORD,
+                        RuleSet, SmsRouter, _Automaton)
+
+
+def names(rules):
+    return [rule['name'] for rule in rules]
+
+
+def test_automaton_finds_every_occurrence():
+    rng = random.Random(1)
+    for _ in range(300):
+        patterns = list(set(''.join(rng.choice('ab c') for _ in range(rng.randint(1, 4)))
+                            for _ in range(rng.randint(1, 12))))
+        text = ''.join(rng.choice('ab c') for _ in range(rng.randint(0, 40)))
+        found = sorted(_Automaton([(p, i) for i, p in enumerate(patterns)]).search(text))
+        expected = sorted((start, start + len(p), i) for i, p in enumerate(patterns)
+                          for start in range(len(text) - len(p) + 1)
+                          if text.startswith(p, start))
+        assert found == expected
+
+
+def test_match_modes():
+    rules = RuleSet([
+        {'name': 'word', 'keywords': ['stop'], 'match': MATCH_WORD},
+        {'name': 'first', 'keywords': ['stop'], 'match': MATCH_FIRST_WORD},
+        {'name': 'exact', 'keywords': ['stop'], 'match': MATCH_EXACT},
+        {'name': 'contains', 'keywords': ['stop'], 'match': MATCH_CONTAINS}
+    ])
+    assert names(rules.match('+261340000001', '  STOP ')) == [
+        'word', 'first', 'exact', 'contains']
+    assert names(rules.match('+261340000001', 'please stop now')) == ['word', 'contains']
+    assert names(rules.match('+261340000001', 'Stop it')) == ['word', 'first', 'contains']
+    assert names(rules.match('+261340000001', 'nonstop')) == ['contains']
+    assert rules.match('+261340000001', 'hello') == []
+
+
+def test_senders_priority_and_final():
+    rules = RuleSet([
+        {'name': 'tenant', 'route': 'tenant:acme', 'senders': ['+26133', 'ACME']},
+        {'name': 'otp', 'keywords': ['code'], 'senders': ['26134'], 'priority': 50},
+        {'name': 'opt-out', 'keywords': ['stop'], 'match': 'first_word',
+         'priority': 0, 'final': True}
+    ])
+    assert names(rules.match('+261 33 000 0001', 'hi')) == ['tenant']
+    assert names(rules.match('acme', 'hi')) == ['tenant']
+    assert names(rules.match('+261340000001', 'your code')) == ['otp']
+    # The sender filter applies to keyword rules too
+    assert rules.match('+261320000001', 'your code') == []
+    # A final rule hides everything ranked after it
+    assert names(rules.match('+261330000001', 'stop code')) == ['opt-out']
+
+
+def test_route_tags_message_and_counts_hits():
+    router = SmsRouter(rules=[{'name': 'otp', 'route': 'auth', 'keywords': ['code']}])
+    data = {'number': '+261340000001', 'text': 'Code 1234'}
+    assert router.route(data) == ['auth']
+    assert data['routes'] == ['auth'] and data['rules'] == ['otp']
+    assert router.route({'number': '+261340000001', 'text': 'hello'}) == []
+    assert router.hits() == [{'rule': 'otp', 'route': 'auth', 'hits': 1}]
+    assert router.stats()['unrouted'] == 1
+
+
+def test_bad_reload_keeps_current_rules(tmp_path):
+    path = tmp_path / 'routes.json'
+    path.write_text(json.dumps({'rules': [{'name': 'otp', 'keywords': ['code']}]}))
+    router = SmsRouter(path=str(path))
+    assert router.route({'number': '1', 'text': 'code'}) == ['otp']
+
+    path.write_text(json.dumps([{'name': 'broken'}]))
+    assert router.reload() is False
+    assert 'needs keywords or senders' in router.last_error
+    assert router.route({'number': '1', 'text': 'code'}) == ['otp']
@@ -0,0 +1,105 @@
+# tests/test_ussd_cache.py
+from threading import Event, Thread
+
+import pytest
+
+from conftest import wait_for
+from ussd_cache import UssdCache
+
+
+class SlowModem:
+    """USSD sender that answers once release() is called."""
+
+    def __init__(self, status='success'):
+        self.calls = []
+        self.status = status
+        self.error = None
+        self._release = Event()
+        self._release.set()
+
+    def hold(self):
+        self._release.clear()
+
+    def release(self):
+        self._release.set()
+
+    def send(self, ussd_string, port):
+        self.calls.append((ussd_string, port))
+        self._release.wait(5)
+        if self.error:
+            raise self.error
+        return {'status': self.status, 'response': 'balance {0}'.format(len(self.calls))}
+
+
+def test_answer_is_cached_per_code_and_port():
+    modem = SlowModem()
+    cache = UssdCache(modem.send, ttl=30)
+    first = cache.send('*123#')
+    second = cache.send('*123#')
+    assert (first['cached'], second['cached']) == (False, True)
+    assert second['response'] == first['response']
+    cache.send('*123#', port='sim1')
+    assert len(modem.calls) == 2
+
+
+def test_max_age_zero_forces_a_new_session():
+    modem = SlowModem()
+    cache = UssdCache(modem.send, ttl=30)
+    cache.send('*123#')
+    assert cache.send('*123#', max_age=0)['cached'] is False
+    assert len(modem.calls) == 2
+
+
+def test_failures_and_zero_ttl_codes_are_not_cached():
+    modem = SlowModem(status='error')
+    cache = UssdCache(modem.send, ttl=30, ttls={'*111#': 0})
+    cache.send('*123#')
+    cache.send('*123#')
+    modem.status = 'success'
+    cache.send('*111#')
+    cache.send('*111#')
+    assert len(modem.calls) == 4
+    assert cache.stats()['cached_codes'] == 0
+
+
+def test_concurrent_requests_share_one_session():
+    modem = SlowModem()
+    modem.hold()
+    cache = UssdCache(modem.send)
+    results = []
+    threads = [Thread(target=lambda: results.append(cache.send('*123#'))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    assert wait_for(lambda: cache.stats()['coalesced'] == 4)
+    modem.release()
+    for thread in threads:
+        thread.join(5)
+    assert len(modem.calls) == 1
+    assert sorted(r['coalesced'] for r in results) == [False] + [True] * 4
+    assert len(set(r['response'] for r in results)) == 1
+
+
+def test_error_reaches_every_waiter():
+    modem = SlowModem()
+    modem.hold()
+    modem.error = RuntimeError("USSD timed out")
+    cache = UssdCache(modem.send)
+    errors = []
+
+    def send():
+        try:
+            cache.send('*123#')
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    threads = [Thread(target=send) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    assert wait_for(lambda: cache.stats()['coalesced'] == 2)
+    modem.release()
+    for thread in threads:
+        thread.join(5)
+    assert errors == ['USSD timed out'] * 3
+    assert cache.stats()['in_flight'] == 0
+    with pytest.raises(RuntimeError):
+        cache.send('*123#')
@@ -0,0 +1,118 @@
+# ussd_cache.py
+"""Single-flight coalescing and response caching for USSD queries."""
+from threading import Event, Lock
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+class _Flight:
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class UssdCache:
+    def __init__(self, send_func, ttl=30, ttls=None):
+        """
+        Initialize the USSD cache.
+
+        Args:
+            send_func: Callable (ussd_string, port) performing the modem request
+            ttl: Seconds a successful response stays cached
+            ttls: Optional dict of per-code TTL overrides (0 disables caching)
+        """
+        self.send_func = send_func
+        self.ttl = ttl
+        self.ttls = ttls or {}
+        self._lock = Lock()
+        self._cache = {}  # (port, code) -> (result, fetched_at)
+        self._flights = {}  # (port, code) -> _Flight
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def ttl_for(self, ussd_string):
+        return self.ttls.get(ussd_string, self.ttl)
+
+    def send(self, ussd_string, port=None, max_age=None):
+        """
+        Return a USSD response, sharing in-flight requests and recent answers.
+
+        Args:
+            ussd_string: USSD code to send
+            port: Optional modem port the request must go to
+            max_age: Oldest cached answer the caller accepts, in seconds
+                (default: the code's TTL; 0 forces a new session)
+
+        Returns:
+            Result dict from the modem plus 'cached', 'coalesced' and 'age'
+        """
+        key = (port, ussd_string)
+        ttl = self.ttl_for(ussd_string)
+        max_age = ttl if max_age is None else min(max_age, ttl)
+
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached:
+                age = time.time() - cached[1]
+                if age <= max_age:
+                    self.hits += 1
+                    return dict(cached[0], cached=True, coalesced=False, age=age)
+                if age > ttl:
+                    del self._cache[key]
+
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.misses += 1
+            else:
+                flight.waiters += 1
+                self.coalesced += 1
+
+        if not leader:
+            logger.info("Joining in-flight USSD request for %s", ussd_string)
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return dict(flight.result, cached=False, coalesced=True, age=0.0)
+
+        try:
+            flight.result = self.send_func(ussd_string, port)
+            if ttl > 0 and flight.result.get('status') == 'success':
+                with self._lock:
+                    self._cache[key] = (flight.result, time.time())
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+            if flight.waiters:
+                logger.info("USSD response for %s shared with %d waiter(s)",
+                            ussd_string, flight.waiters)
+
+        return dict(flight.result, cached=False, coalesced=False, age=0.0)
+
+    def invalidate(self, ussd_string=None):
+        """Drop cached answers for one code, or all of them."""
+        with self._lock:
+            if ussd_string is None:
+                self._cache.clear()
+            else:
+                for key in [k for k in self._cache if k[1] == ussd_string]:
+                    del self._cache[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'cached_codes': len(self._cache),
+                'in_flight': len(self._flights)
+            }
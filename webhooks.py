@@ -0,0 +1,340 @@
+# webhooks.py
+"""Inbound SMS fan-out to HTTP webhooks with batching and a retry spool."""
+from collections import deque
+from threading import Condition, Lock, Thread
+import heapq
+import json
+import logging
+import os
+import random
+import time
+import uuid
+
+import metrics
+
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+except ImportError:  # only needed when webhooks are configured
+    requests = None
+
+logger = logging.getLogger(__name__)
+
+POST_SECONDS = metrics.histogram(
+    'webhook_post_duration_seconds', 'Duration of webhook POSTs', ['endpoint'])
+DELIVERIES = metrics.counter(
+    'webhook_batches_total', 'Webhook batches by outcome', ['endpoint', 'result'])
+MESSAGES = metrics.counter(
+    'webhook_messages_total', 'Messages delivered to webhooks', ['endpoint'])
+
+# Client errors that are worth retrying; any other 4xx drops the batch
+RETRYABLE_STATUS = (408, 425, 429)
+
+
+class WebhookEndpoint:
+    def __init__(self, name, url, spool_dir, concurrency=2, batch_size=20,
+                 batch_window=0.5, timeout=10, headers=None, retry_base=1,
+                 retry_max=300, max_age=86400, max_pending=10000, routes=None):
+        """
+        Initialize an endpoint with its own workers, queue and spool.
+
+        Args:
+            name: Endpoint name used in logs, metrics and the spool path
+            url: URL batches are POSTed to
+            spool_dir: Directory failed batches are kept in until retried
+            concurrency: Requests in flight at once, one worker thread each
+            batch_size: Maximum messages per POST
+            batch_window: Seconds to wait for a batch to fill
+            timeout: Seconds before a POST is abandoned and retried
+            headers: Extra HTTP headers, e.g. for authentication
+            retry_base: Delay of the first retry; doubles on every attempt
+            retry_max: Longest delay between retries
+            max_age: Seconds after which an undelivered batch is discarded
+            max_pending: Messages held in memory; more are spooled to disk
+            routes: Only take messages tagged with one of these routes
+                (see sms_router.py); None takes every message
+        """
+        self.name = name
+        self.url = url
+        self.spool_dir = os.path.join(spool_dir, name)
+        self.concurrency = max(1, concurrency)
+        self.batch_size = max(1, batch_size)
+        self.batch_window = batch_window
+        self.timeout = timeout
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.max_age = max_age
+        self.max_pending = max_pending
+        self.routes = frozenset(routes) if routes else None
+
+        # One keep-alive connection per worker
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'Content-Type': 'application/json'})
+        self.session.headers.update(headers or {})
+
+        self._pending = deque()  # (queued_at, message)
+        self._retries = []  # heap of (next_attempt, seq, path)
+        self._seq = 0
+        self._cond = Condition()
+        self._running = False
+        self._threads = []
+        self._stats_lock = Lock()
+        self.delivered = 0
+        self.failed_attempts = 0
+        self.dropped = 0
+
+        if not os.path.isdir(self.spool_dir):
+            os.makedirs(self.spool_dir)
+        self._load_spool()
+
+    # Spool
+
+    def _load_spool(self):
+        """Schedule batches spooled by a previous run."""
+        for filename in os.listdir(self.spool_dir):
+            if not filename.endswith('.json'):
+                continue
+            path = os.path.join(self.spool_dir, filename)
+            try:
+                with open(path) as f:
+                    next_attempt = json.load(f).get('next_attempt', 0)
+            except (IOError, OSError, ValueError) as e:
+                logger.error("Discarding unreadable webhook spool file %s: %s", path, str(e))
+                os.remove(path)
+                continue
+            self._schedule_retry(next_attempt, path)
+        if self._retries:
+            logger.info("Webhook %s has %d spooled batches", self.name, len(self._retries))
+
+    def _write_spool(self, batch):
+        path = batch.get('path') or os.path.join(
+            self.spool_dir, '{0}.json'.format(batch['batch_id']))
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(dict((k, v) for k, v in batch.items() if k != 'path'), f, default=str)
+        os.rename(tmp, path)  # atomic, so a crash never leaves half a batch
+        batch['path'] = path
+        return path
+
+    def _read_spool(self, path):
+        try:
+            with open(path) as f:
+                batch = json.load(f)
+        except (IOError, OSError, ValueError) as e:
+            logger.error("Lost webhook spool file %s: %s", path, str(e))
+            return None
+        batch['path'] = path
+        return batch
+
+    def _schedule_retry(self, next_attempt, path):
+        # Caller holds _cond or is still initializing
+        self._seq += 1
+        heapq.heappush(self._retries, (next_attempt, self._seq, path))
+
+    def _new_batch(self, messages):
+        return {
+            'batch_id': uuid.uuid4().hex,
+            'messages': messages,
+            'attempts': 0,
+            'created_at': time.time(),
+            'next_attempt': 0,
+            'path': None
+        }
+
+    # Queueing
+
+    def wants(self, message):
+        if self.routes is None:
+            return True
+        return not self.routes.isdisjoint(message.get('routes') or ())
+
+    def offer(self, message):
+        """Queue a message without blocking; overflow goes to the spool."""
+        with self._cond:
+            if len(self._pending) < self.max_pending:
+                self._pending.append((time.time(), message))
+                if len(self._pending) == 1 or len(self._pending) >= self.batch_size:
+                    self._cond.notify()
+                return
+        batch = self._new_batch([message])
+        path = self._write_spool(batch)
+        with self._cond:
+            self._schedule_retry(0, path)
+            self._cond.notify()
+
+    def _next_batch(self):
+        with self._cond:
+            while self._running:
+                now = time.time()
+                if self._retries and self._retries[0][0] <= now:
+                    path = heapq.heappop(self._retries)[2]
+                    batch = self._read_spool(path)
+                    if batch is not None:
+                        return batch
+                    continue
+                if self._pending and (len(self._pending) >= self.batch_size or
+                                      self._pending[0][0] + self.batch_window <= now):
+                    count = min(self.batch_size, len(self._pending))
+                    messages = [self._pending.popleft()[1] for _ in range(count)]
+                    return self._new_batch(messages)
+
+                waits = []
+                if self._pending:
+                    waits.append(self._pending[0][0] + self.batch_window - now)
+                if self._retries:
+                    waits.append(self._retries[0][0] - now)
+                self._cond.wait(max(0.01, min(waits)) if waits else None)
+        return None
+
+    # Delivery
+
+    def _worker(self):
+        while self._running:
+            batch = self._next_batch()
+            if batch is None:
+                break
+            try:
+                self._deliver(batch)
+            except Exception as e:
+                logger.error("Webhook %s worker error: %s", self.name, str(e), exc_info=True)
+
+    def _post(self, batch):
+        """POST a batch; returns None on success, else (retryable, reason)."""
+        body = json.dumps({
+            'batch_id': batch['batch_id'],  # the same on every retry, for dedup
+            'messages': batch['messages']
+        }, default=str)
+        try:
+            with POST_SECONDS.labels(self.name).time():
+                response = self.session.post(self.url, data=body, timeout=self.timeout)
+        except requests.RequestException as e:
+            return True, str(e)
+        if 200 <= response.status_code < 300:
+            return None
+        reason = 'HTTP {0}'.format(response.status_code)
+        return (response.status_code >= 500 or response.status_code in RETRYABLE_STATUS,
+                reason)
+
+    def _deliver(self, batch):
+        error = self._post(batch)
+        if error is None:
+            if batch.get('path'):
+                os.remove(batch['path'])
+            with self._stats_lock:
+                self.delivered += len(batch['messages'])
+            DELIVERIES.labels(self.name, 'delivered').inc()
+            MESSAGES.labels(self.name).inc(len(batch['messages']))
+            return
+
+        retryable, reason = error
+        batch['attempts'] += 1
+        with self._stats_lock:
+            self.failed_attempts += 1
+        expired = time.time() - batch['created_at'] > self.max_age
+        if not retryable or expired:
+            logger.error("Webhook %s dropped batch %s of %d messages after %d attempts: %s",
+                         self.name, batch['batch_id'], len(batch['messages']),
+                         batch['attempts'], reason)
+            if batch.get('path'):
+                os.remove(batch['path'])
+            with self._stats_lock:
+                self.dropped += len(batch['messages'])
+            DELIVERIES.labels(self.name, 'expired' if retryable else 'rejected').inc()
+            return
+
+        delay = min(self.retry_max, self.retry_base * 2 ** (batch['attempts'] - 1))
+        delay *= random.uniform(0.5, 1.0)  # jitter so endpoints are not hit in lockstep
+        batch['next_attempt'] = time.time() + delay
+        path = self._write_spool(batch)
+        logger.warning("Webhook %s batch %s failed (%s), retry %d in %.1fs",
+                       self.name, batch['batch_id'], reason, batch['attempts'], delay)
+        DELIVERIES.labels(self.name, 'retried').inc()
+        with self._cond:
+            self._schedule_retry(batch['next_attempt'], path)
+            self._cond.notify()
+
+    # Lifecycle
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        for i in range(self.concurrency):
+            thread = Thread(target=self._worker,
+                            name='webhook-{0}-{1}'.format(self.name, i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """Stop the workers and spool messages that were not sent yet."""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=self.timeout + 5)
+        self._threads = []
+        with self._cond:
+            messages = [message for _, message in self._pending]
+            self._pending.clear()
+        for i in range(0, len(messages), self.batch_size):
+            self._write_spool(self._new_batch(messages[i:i + self.batch_size]))
+        self.session.close()
+
+    def stats(self):
+        with self._cond:
+            pending = len(self._pending)
+            spooled = len(self._retries)
+        with self._stats_lock:
+            return {
+                'url': self.url,
+                'routes': sorted(self.routes) if self.routes else None,
+                'pending': pending,
+                'spooled_batches': spooled,
+                'delivered': self.delivered,
+                'failed_attempts': self.failed_attempts,
+                'dropped': self.dropped
+            }
+
+
+class WebhookDispatcher:
+    def __init__(self, subscriptions, spool_dir, **defaults):
+        """
+        Initialize the dispatcher.
+
+        Args:
+            subscriptions: List of dicts with name and url, and optionally
+                any WebhookEndpoint setting to override for that endpoint
+            spool_dir: Directory holding one spool per endpoint
+            defaults: WebhookEndpoint settings shared by all endpoints
+        """
+        if requests is None:
+            raise RuntimeError("Webhooks need the requests package")
+        self.endpoints = []
+        for subscription in subscriptions:
+            settings = dict(defaults)
+            settings.update(subscription)
+            self.endpoints.append(WebhookEndpoint(spool_dir=spool_dir, **settings))
+        logger.info("Webhooks configured: %s",
+                    ', '.join(e.name for e in self.endpoints) or 'none')
+
+    def publish(self, data):
+        """Hand one message to every endpoint that wants it; never blocks on the network."""
+        for endpoint in self.endpoints:
+            if endpoint.wants(data):
+                endpoint.offer(data)
+
+    def start(self):
+        for endpoint in self.endpoints:
+            endpoint.start()
+
+    def stop(self):
+        for endpoint in self.endpoints:
+            endpoint.stop()
+
+    def stats(self):
+        return dict((e.name, e.stats()) for e in self.endpoints)